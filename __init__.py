@@ -42,6 +42,8 @@ def register():
         table.Table,
         table.Field,
         table.TableDependency,
+        table.TableComputeLog,
+        table.TableComputeProgress,
         table.Warning,
         ir.Rule,
         table.Pivot,
@@ -50,6 +52,7 @@ def register():
         table.Measure,
         table.Property,
         table.Order,
+        table.CubeCache,
         pivot.Site,
         pivot.Layout,
         pivot.Index,
@@ -64,9 +67,11 @@ def register():
         pivot.PivotHeaderLevelField,
         pivot.PivotSidebarTables,
         pivot.PivotCompute,
+        pivot.PivotComputeStatus,
         pivot.PivotApply,
         pivot.PivotSave,
         pivot.PivotTable,
+        pivot.PivotTableRows,
         pivot.DownloadReport,
         module='babi', type_='model')
     Pool.register(
@@ -1,14 +1,27 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 from decimal import Decimal
+import ast
+import builtins
 import datetime
 from functools import lru_cache
 import math
+import operator
+import types
 from dateutil.relativedelta import relativedelta
-from simpleeval import EvalWithCompoundTypes
+from simpleeval import (
+    DEFAULT_OPERATORS, DISALLOW_FUNCTIONS, DISALLOW_METHODS, DISALLOW_PREFIXES,
+    MAX_COMPREHENSION_LENGTH, MAX_STRING_LENGTH, AttributeDoesNotExist,
+    EvalWithCompoundTypes, FeatureNotAvailable, FunctionNotDefined,
+    IterableTooLong, NameNotDefined)
 from trytond.pool import Pool
 from trytond.transaction import Transaction
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def year(text):
     if not text:
@@ -104,9 +117,300 @@ FUNCTIONS = {
     }
 
 
+# Functions also available in EvalWithCompoundTypes
+COMPILED_FUNCTIONS = dict(FUNCTIONS, list=list, tuple=tuple, dict=dict,
+    set=set)
+# Operators that simpleeval replaces by versions that limit the size of the
+# result
+SAFE_OPERATORS = (ast.Add, ast.Mult, ast.Pow, ast.LShift, ast.RShift)
+COMPILED_PREFIX = '_babi_'
+# Functions that may return a different value on each call so expressions
+# using them are not evaluated once per distinct input values
+VOLATILE_FUNCTIONS = {'now', 'today'}
+
+
+def _compiled_getattr(obj, attr, expression):
+    try:
+        item = getattr(obj, attr)
+    except (AttributeError, TypeError):
+        try:
+            item = obj[attr]
+        except (KeyError, TypeError):
+            raise AttributeDoesNotExist(attr, expression)
+    if isinstance(item, types.ModuleType):
+        raise FeatureNotAvailable(
+            'Sorry, modules are not allowed in attribute access')
+    if callable(item) and item in DISALLOW_FUNCTIONS:
+        raise FeatureNotAvailable('This function is forbidden')
+    return item
+
+
+def _compiled_check(item):
+    if type(item) in (int, float, str, bool, type(None), Decimal):
+        return item
+    if isinstance(item, types.ModuleType):
+        raise FeatureNotAvailable('Sorry, modules are not allowed')
+    if isinstance(item, (list, tuple, set, frozenset)):
+        for element in item:
+            _compiled_check(element)
+    elif isinstance(item, dict):
+        for value in item.values():
+            _compiled_check(value)
+    elif callable(item) and item in DISALLOW_FUNCTIONS:
+        raise FeatureNotAvailable('This function is forbidden')
+    return item
+
+
+def _compiled_name(name, expression):
+    raise NameNotDefined(name, expression)
+
+
+def _compiled_function(name, expression):
+    raise FunctionNotDefined(name, expression)
+
+
+def _compiled_iter(iterable):
+    for count, item in enumerate(iterable, 1):
+        if count > MAX_COMPREHENSION_LENGTH:
+            raise IterableTooLong('Comprehension generates too many elements')
+        yield item
+
+
+def _get_compiled_namespace():
+    # The rewritten AST only reads names from FUNCTIONS and the local names
+    # of the expression, the builtins are kept for the imports done by the
+    # functions at runtime
+    namespace = {'__builtins__': builtins.__dict__}
+    namespace.update(COMPILED_FUNCTIONS)
+    namespace.update({
+            COMPILED_PREFIX + 'functions': COMPILED_FUNCTIONS,
+            COMPILED_PREFIX + 'getattr': _compiled_getattr,
+            COMPILED_PREFIX + 'check': _compiled_check,
+            COMPILED_PREFIX + 'name': _compiled_name,
+            COMPILED_PREFIX + 'function': _compiled_function,
+            COMPILED_PREFIX + 'iter': _compiled_iter,
+            })
+    for op in SAFE_OPERATORS:
+        namespace[COMPILED_PREFIX + op.__name__] = DEFAULT_OPERATORS[op]
+    return namespace
+
+
+class ExpressionCompiler(ast.NodeTransformer):
+    '''
+    Rewrite the AST of an expression so it can be compiled into Python
+    bytecode with the same restrictions EvalWithCompoundTypes applies while
+    interpreting it: only the nodes and operators it supports, no access to
+    private attributes or forbidden methods and only FUNCTIONS can be called.
+    '''
+    allowed_nodes = {
+        ast.Expression, ast.Load, ast.Store, ast.comprehension, ast.Starred,
+        ast.And, ast.Or,
+        } | set(EvalWithCompoundTypes().nodes) - {
+        ast.Expr, ast.Assign, ast.AugAssign, ast.Import,
+        } | set(DEFAULT_OPERATORS)
+
+    def __init__(self, expression):
+        super().__init__()
+        self.expression = expression
+        self.local_names = {'o'}
+
+    def _helper(self, name, *args):
+        return ast.Call(
+            func=ast.Name(id=COMPILED_PREFIX + name, ctx=ast.Load()),
+            args=list(args), keywords=[])
+
+    def compile(self):
+        tree = ast.parse(self.expression.strip(), mode='eval')
+        tree = self.visit(tree)
+        function = ast.Expression(body=ast.Lambda(
+                args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='o')],
+                    kwonlyargs=[], kw_defaults=[], defaults=[]),
+                body=tree.body))
+        ast.fix_missing_locations(function)
+        code = compile(function, '<babi expression>', 'eval')
+        return eval(code, _get_compiled_namespace())
+
+    def _target_names(self, target):
+        if isinstance(target, ast.Name):
+            return [target.id]
+        if isinstance(target, ast.Tuple):
+            return [n for t in target.elts for n in self._target_names(t)]
+        raise FeatureNotAvailable('Sorry, only names can be assigned in '
+            'comprehensions')
+
+    def generic_visit(self, node):
+        if type(node) not in self.allowed_nodes:
+            raise FeatureNotAvailable('Sorry, %s is not available in this '
+                'evaluator' % type(node).__name__)
+        return super().generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id.startswith(COMPILED_PREFIX):
+            raise FeatureNotAvailable(
+                'Sorry, %s is a reserved name' % node.id)
+        if isinstance(node.ctx, ast.Store) or node.id in self.local_names:
+            return node
+        if node.id in COMPILED_FUNCTIONS:
+            # simpleeval refuses the names whose value is a module
+            if isinstance(COMPILED_FUNCTIONS[node.id], types.ModuleType):
+                raise FeatureNotAvailable('Sorry, modules are not allowed')
+            return node
+        return self._helper('name', ast.Constant(node.id),
+            ast.Constant(self.expression))
+
+    def visit_Constant(self, node):
+        if (hasattr(node.value, '__len__')
+                and len(node.value) > MAX_STRING_LENGTH):
+            raise FeatureNotAvailable(
+                'Literal in statement is too long! (%s, when %s is max)'
+                % (len(node.value), MAX_STRING_LENGTH))
+        return node
+
+    def visit_Attribute(self, node):
+        for prefix in DISALLOW_PREFIXES:
+            if node.attr.startswith(prefix):
+                raise FeatureNotAvailable('Sorry, access to __attributes '
+                    ' or func_ attributes is not available. (%s)' % node.attr)
+        if node.attr in DISALLOW_METHODS:
+            raise FeatureNotAvailable(
+                'Sorry, this method is not available. (%s)' % node.attr)
+        if not isinstance(node.ctx, ast.Load):
+            raise FeatureNotAvailable('Sorry, attributes cannot be assigned')
+        return self._helper('getattr', self.visit(node.value),
+            ast.Constant(node.attr), ast.Constant(self.expression))
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name):
+            if node.func.id in COMPILED_FUNCTIONS:
+                func = ast.Subscript(
+                    value=ast.Name(id=COMPILED_PREFIX + 'functions',
+                        ctx=ast.Load()),
+                    slice=ast.Constant(node.func.id), ctx=ast.Load())
+            else:
+                func = self._helper('function', ast.Constant(node.func.id),
+                    ast.Constant(self.expression))
+        elif isinstance(node.func, ast.Attribute):
+            func = self.visit(node.func)
+        else:
+            raise FeatureNotAvailable('Lambda Functions not implemented')
+        if any(isinstance(x, ast.Starred) for x in node.args):
+            raise FeatureNotAvailable('Sorry, argument unpacking is not '
+                'available')
+        if any(x.arg is None for x in node.keywords):
+            raise FeatureNotAvailable('Sorry, keyword argument unpacking is '
+                'not available')
+        # Results are checked like simpleeval does so functions cannot hand
+        # out modules or forbidden functions
+        return self._helper('check', ast.Call(func=func,
+                args=[self.visit(x) for x in node.args],
+                keywords=[ast.keyword(arg=x.arg, value=self.visit(x.value))
+                    for x in node.keywords]))
+
+    def visit_BinOp(self, node):
+        if type(node.op) not in DEFAULT_OPERATORS:
+            raise FeatureNotAvailable('Sorry, %s is not available in this '
+                'evaluator' % type(node.op).__name__)
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        if isinstance(node.op, SAFE_OPERATORS):
+            return self._helper(type(node.op).__name__, left, right)
+        return ast.BinOp(left=left, op=node.op, right=right)
+
+    def visit_List(self, node):
+        elts = []
+        for element in node.elts:
+            if isinstance(element, ast.Starred):
+                elts.append(ast.Starred(value=self.visit(element.value),
+                        ctx=element.ctx))
+            else:
+                elts.append(self.visit(element))
+        return ast.List(elts=elts, ctx=node.ctx)
+
+    def visit_Starred(self, node):
+        raise FeatureNotAvailable('Sorry, unpacking is only available in '
+            'lists')
+
+    def visit_GeneratorExp(self, node):
+        # simpleeval evaluates generator expressions into lists
+        return self.visit(ast.ListComp(elt=node.elt,
+                generators=node.generators))
+
+    def visit_ListComp(self, node):
+        return self._visit_comprehensions(node, ['elt'])
+
+    def visit_DictComp(self, node):
+        return self._visit_comprehensions(node, ['key', 'value'])
+
+    def _visit_comprehensions(self, node, fields):
+        if type(node) not in self.allowed_nodes:
+            raise FeatureNotAvailable('Sorry, %s is not available in this '
+                'evaluator' % type(node).__name__)
+        # The targets are only local names of the following generators and
+        # of the fields of the comprehension
+        local_names = self.local_names
+        try:
+            for generator in node.generators:
+                generator.iter = self._helper('iter',
+                    self.visit(generator.iter))
+                self.local_names = self.local_names | set(
+                    self._target_names(generator.target))
+                generator.target = self.visit(generator.target)
+                generator.ifs = [self.visit(x) for x in generator.ifs]
+            for field in fields:
+                setattr(node, field, self.visit(getattr(node, field)))
+        finally:
+            self.local_names = local_names
+        return node
+
+
 @lru_cache(maxsize=1024)
-def _get_parsed_expression(expression):
-    return EvalWithCompoundTypes.parse(expression)
+def compile_expression(expression):
+    '''
+    Return a function that evaluates expression for the record given as its
+    only argument.
+    '''
+    return ExpressionCompiler(expression).compile()
+
+
+
+def _get_node_path(node, names):
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+    if isinstance(node, ast.Attribute):
+        path = _get_node_path(node.value, names)
+        if path is not None:
+            return path + (node.attr,)
+    elif isinstance(node, ast.Subscript):
+        return _get_node_path(node.value, names)
+
+
+@lru_cache(maxsize=1024)
+def get_expression_paths(expression):
+    '''
+    Return the attribute paths of o used by expression. For example
+    "o.party.addresses[0].city" returns {('party', 'addresses', 'city')}.
+    Comprehension variables iterating over a path extend it.
+    '''
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        return frozenset()
+    names = {'o': ()}
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.comprehension)
+                and isinstance(node.target, ast.Name)):
+            path = _get_node_path(node.iter, names)
+            if path is not None:
+                names[node.target.id] = path
+    paths = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute):
+            path = _get_node_path(node, names)
+            if path:
+                paths.add(path)
+    # Keep only the longest paths as their prefixes are implied
+    return frozenset(x for x in paths
+        if not any(len(y) > len(x) and y[:len(x)] == x for y in paths))
 
 
 @lru_cache(maxsize=256)
@@ -116,15 +420,18 @@ def _get_batch_expression(expressions):
     return '(' + ', '.join(expressions) + ')'
 
 
+def _get_none_value(convert_none):
+    if convert_none == 'empty':
+        # TODO: Make translatable
+        return '(empty)'
+    elif convert_none == 'zero':
+        return '0'
+    return convert_none
+
+
 def _normalize_value(value, convert_none='empty', digits=None, ttype=None):
     if (value is False or value is None):
-        if convert_none == 'empty':
-            # TODO: Make translatable
-            value = '(empty)'
-        elif convert_none == 'zero':
-            value = '0'
-        else:
-            value = convert_none
+        value = _get_none_value(convert_none)
     if digits:
         if isinstance(value, (int, float)) and ttype == 'numeric':
             value = Decimal(value)
@@ -136,6 +443,28 @@ def _normalize_value(value, convert_none='empty', digits=None, ttype=None):
     return value
 
 
+def _normalize_column(values, convert_none='empty', digits=None,
+        ttype=None):
+    "Same as _normalize_value for all the values of a column"
+    none_value = _get_none_value(convert_none)
+    if not digits:
+        return [none_value if value is False or value is None else value
+            for value in values]
+    quantize = Decimal(10) ** -Decimal(digits)
+    result = []
+    for value in values:
+        if value is False or value is None:
+            value = none_value
+        if isinstance(value, (int, float)) and ttype == 'numeric':
+            value = Decimal(value)
+        if isinstance(value, Decimal):
+            value = value.quantize(quantize)
+        elif isinstance(value, float):
+            value = round(value, digits)
+        result.append(value)
+    return result
+
+
 def _expand_batch_option(option, size):
     if isinstance(option, (list, tuple)):
         assert len(option) == size
@@ -154,17 +483,12 @@ def babi_eval_batch(expressions, obj, convert_none='empty', digits=None,
     if not expressions:
         return tuple()
 
-    evaluator = EvalWithCompoundTypes(
-        names={'o': obj}, functions=FUNCTIONS.copy())
     if len(expressions) == 1:
-        value = evaluator.eval(expressions[0],
-            previously_parsed=_get_parsed_expression(expressions[0]))
+        value = compile_expression(expressions[0])(obj)
         return (_normalize_value(value, convert_none=convert_none,
                 digits=digits, ttype=ttypes),)
 
-    batch_expression = _get_batch_expression(expressions)
-    values = evaluator.eval(batch_expression,
-        previously_parsed=_get_parsed_expression(batch_expression))
+    values = compile_expression(_get_batch_expression(expressions))(obj)
     convert_nones = _expand_batch_option(convert_none, len(expressions))
     digits_list = _expand_batch_option(digits, len(expressions))
     ttypes_list = _expand_batch_option(ttypes, len(expressions))
@@ -172,3 +496,234 @@ def babi_eval_batch(expressions, obj, convert_none='empty', digits=None,
             digits=digits_, ttype=ttype_)
         for value, convert_none_, digits_, ttype_
         in zip(values, convert_nones, digits_list, ttypes_list))
+
+
+def _get_attribute_path(node):
+    path = []
+    while isinstance(node, ast.Attribute):
+        path.insert(0, node.attr)
+        node = node.value
+    if path and isinstance(node, ast.Name) and node.id == 'o':
+        return tuple(path)
+
+
+class _ColumnInputs(ast.NodeVisitor):
+
+    def __init__(self):
+        self.paths = set()
+        self.pure = True
+
+    def visit_Attribute(self, node):
+        path = _get_attribute_path(node)
+        if path:
+            self.paths.add(path)
+        else:
+            self.generic_visit(node)
+
+    def visit_Call(self, node):
+        path = _get_attribute_path(node.func)
+        if path:
+            # Methods of records may read anything so only methods of the
+            # values of the fields are allowed
+            if len(path) == 1:
+                self.pure = False
+            self.paths.add(path[:-1])
+        else:
+            self.visit(node.func)
+        for arg in node.args:
+            self.visit(arg)
+        for keyword in node.keywords:
+            self.visit(keyword)
+
+    def visit_Name(self, node):
+        if node.id == 'o' or node.id in VOLATILE_FUNCTIONS:
+            self.pure = False
+
+
+@lru_cache(maxsize=1024)
+def get_column_inputs(expression):
+    '''
+    Return the attribute paths of o used by expression if it only accesses o
+    through them and does not call VOLATILE_FUNCTIONS, None otherwise. Those
+    expressions return the same value for records with the same values in
+    the paths.
+    '''
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        return
+    visitor = _ColumnInputs()
+    visitor.visit(tree)
+    if not visitor.pure:
+        return
+    # The value of a path already gives access to the longer ones
+    return tuple(sorted(x for x in visitor.paths
+            if not any(y != x and x[:len(y)] == y for y in visitor.paths)))
+
+
+ARRAY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    }
+# Larger integers could overflow the 64 bits integers of NumPy
+ARRAY_MAX_INTEGER = 2 ** 31
+
+
+@lru_cache(maxsize=1024)
+def _get_array_expression(expression):
+    "Return the AST of expression if it is only arithmetic on paths of o"
+    try:
+        tree = ast.parse(expression.strip(), mode='eval').body
+    except SyntaxError:
+        return
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            if type(node.op) not in ARRAY_OPERATORS:
+                return
+        elif isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                return
+            if (type(node.value) is int
+                    and abs(node.value) >= ARRAY_MAX_INTEGER):
+                return
+        elif isinstance(node, ast.Attribute):
+            if not _get_attribute_path(node):
+                return
+        elif not isinstance(node, (ast.Name, ast.Load, ast.operator,
+                    ast.unaryop)):
+            return
+    return tree
+
+
+def _eval_array(node, arrays):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Attribute):
+        return arrays[_get_attribute_path(node)]
+    if isinstance(node, ast.UnaryOp):
+        return ARRAY_OPERATORS[type(node.op)](_eval_array(node.operand,
+                arrays))
+    left = _eval_array(node.left, arrays)
+    right = _eval_array(node.right, arrays)
+    if isinstance(node.op, ast.Div) and not numpy.all(right):
+        # Let python raise ZeroDivisionError for the record
+        raise ZeroDivisionError
+    return ARRAY_OPERATORS[type(node.op)](left, right)
+
+
+def _eval_array_column(tree, inputs):
+    multiplications = sum(1 for x in ast.walk(tree)
+        if isinstance(x, ast.BinOp) and isinstance(x.op, ast.Mult))
+    arrays = {}
+    for path, values in inputs.items():
+        types_ = {type(x) for x in values}
+        if types_ == {int}:
+            if (multiplications > 1
+                    or any(abs(x) >= ARRAY_MAX_INTEGER for x in values)):
+                return
+        elif types_ != {float}:
+            return
+        arrays[path] = numpy.array(values)
+    try:
+        result = _eval_array(tree, arrays)
+    except ZeroDivisionError:
+        return
+    return result.tolist()
+
+
+def _get_path_value(obj, path):
+    for name in path:
+        obj = getattr(obj, name)
+    return obj
+
+
+def _get_column_proxy(paths, values):
+    root = {}
+    for path, value in zip(paths, values):
+        node = root
+        for name in path[:-1]:
+            node = node.setdefault(name, {})
+        node[path[-1]] = value
+
+    def namespace(node):
+        return types.SimpleNamespace(**{k: namespace(v)
+                if isinstance(v, dict) else v for k, v in node.items()})
+    return namespace(root)
+
+
+_MISSING = object()
+
+
+def _eval_column(expression, objs, path_values):
+    function = compile_expression(expression)
+    paths = get_column_inputs(expression)
+    if paths is None:
+        return [function(obj) for obj in objs]
+
+    if numpy is not None and paths and objs:
+        tree = _get_array_expression(expression)
+        if tree is not None and not any(_MISSING in path_values[x]
+                for x in paths):
+            values = _eval_array_column(tree,
+                {x: path_values[x] for x in paths})
+            if values is not None:
+                return values
+
+    # Evaluate once per distinct combination of input values
+    cache = {}
+    values = []
+    for index, obj in enumerate(objs):
+        key = tuple(path_values[x][index] for x in paths)
+        if _MISSING in key:
+            # Reading the paths failed so let the expression decide whether
+            # it needs them
+            values.append(function(obj))
+            continue
+        try:
+            value = cache[key]
+        except KeyError:
+            value = cache[key] = function(_get_column_proxy(paths, key))
+        except TypeError:
+            # Unhashable values
+            value = function(_get_column_proxy(paths, key))
+        values.append(value)
+    return values
+
+
+def babi_eval_columns(expressions, objs, convert_none='empty', digits=None,
+        ttypes=None):
+    '''
+    Evaluate expressions for all objs at once and return a list of values per
+    expression.
+
+    Expressions that only read attribute paths of o are evaluated once per
+    distinct combination of values and, when NumPy is available, arithmetic
+    on integer or float paths is computed over arrays.
+    '''
+    objs = list(objs)
+    path_values = {}
+    for expression in expressions:
+        # Compiling validates the expression before its paths are read
+        compile_expression(expression)
+        for path in get_column_inputs(expression) or ():
+            if path in path_values:
+                continue
+            values = []
+            for obj in objs:
+                try:
+                    values.append(_get_path_value(obj, path))
+                except Exception:
+                    values.append(_MISSING)
+            path_values[path] = values
+
+    convert_nones = _expand_batch_option(convert_none, len(expressions))
+    digits_list = _expand_batch_option(digits, len(expressions))
+    ttypes_list = _expand_batch_option(ttypes, len(expressions))
+    return [_normalize_column(_eval_column(expression, objs, path_values),
+            convert_none=convert_none_, digits=digits_, ttype=ttype_)
+        for expression, convert_none_, digits_, ttype_
+        in zip(expressions, convert_nones, digits_list, ttypes_list)]
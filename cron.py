@@ -53,6 +53,7 @@ class Cron(metaclass=PoolMeta):
         cls.method.selection.extend([
                 ('babi.table|_compute', 'Compute Business Intelligence Table'),
                 ('babi.table|clean', 'Delete Tables with Parameters'),
+                ('babi.cube.cache|evict', 'Evict Cube Caches'),
                 ('babi.table.cluster|compute',
                     'Compute Business Intelligence Cluster'),
                 ])
@@ -9,15 +9,39 @@ from collections import defaultdict
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from itertools import product
-from collections import OrderedDict
 from enum import Enum
 from urllib.parse import urlencode, parse_qs
+from sql import Literal, Null
+from sql.conditionals import Case, NullIf
+from sql.functions import Function
+from sql.operators import And, Or
+from trytond.cache import Cache
 from trytond.config import config
+from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from trytond.pool import Pool
 from trytond.transaction import Transaction
 from trytond import backend
 
 DEFAULT_MIME_TYPE = config.get('babi', 'mime_type', default='image/png')
+# Number of centroids of the t-digests used by approximate percentiles, higher
+# values are more accurate but slower
+TDIGEST_COMPRESSION = config.getint('babi', 'tdigest_compression',
+    default=100)
+# Extension of PostgreSQL required by each approximate aggregate
+APPROXIMATE_EXTENSIONS = {
+    'approx_median': 'tdigest',
+    'approx_percentile': 'tdigest',
+    'approx_count_distinct': 'hll',
+    }
+
+# Percentage of the rows of the table used by the sampled preview of pivots
+PIVOT_SAMPLE_PERCENT = config.getfloat('babi', 'pivot_sample_percent',
+    default=1)
+# Aggregates whose values are scaled to the whole table in sampled cubes
+SAMPLE_SCALED_AGGREGATES = {'sum', 'count'}
+
+_database_extensions_cache = Cache('babi.database_extensions', context=False)
 
 # From html_report
 def strfdelta(tdelta, fmt):
@@ -77,6 +101,21 @@ def _deserialize_expansion_value(value):
     return value
 
 
+def _scale_value(value, factor):
+    "Return the value of a measure computed on a sample scaled by factor"
+    if value is None:
+        return value
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, Decimal):
+        return (value * factor).quantize(value)
+    if isinstance(value, int):
+        return round(value * factor)
+    if isinstance(value, (float, timedelta)):
+        return value * float(factor)
+    return value
+
+
 def _encode_expansions(expansions):
     payload = json.dumps(
         [_serialize_expansion_value(v) for v in expansions],
@@ -120,16 +159,128 @@ class Percentile(sql.aggregate.Aggregate):
             within=[expression], window=window)
 
 
+class Arguments(sql.Expression):
+    'A list of expressions used as the arguments of an aggregate'
+    __slots__ = ('expressions',)
+
+    def __init__(self, *expressions):
+        super().__init__()
+        self.expressions = expressions
+
+    def __str__(self):
+        return ', '.join(map(str, self.expressions))
+
+    @property
+    def params(self):
+        p = []
+        for expression in self.expressions:
+            p.extend(expression.params)
+        return tuple(p)
+
+
+class TDigestPercentile(sql.aggregate.Aggregate):
+    '''
+    Approximate percentile computed from a t-digest of the values, which does
+    not need to sort them. Requires the tdigest extension of PostgreSQL.
+    '''
+    __slots__ = ()
+    _sql = 'TDIGEST_PERCENTILE'
+
+    def __init__(self, percentile, expression, window=None):
+        super().__init__(Arguments(
+                sql.Cast(expression, 'DOUBLE PRECISION'),
+                sql.Literal(TDIGEST_COMPRESSION),
+                sql.Literal(float(percentile) / 100)),
+            window=window)
+
+
+class HllAddAgg(sql.aggregate.Aggregate):
+    __slots__ = ()
+    _sql = 'HLL_ADD_AGG'
+
+
+class HllHashAny(Function):
+    __slots__ = ()
+    _function = 'HLL_HASH_ANY'
+
+
+class HllCardinality(Function):
+    __slots__ = ()
+    _function = 'HLL_CARDINALITY'
+
+
+def database_extensions():
+    '''
+    Return the names of the PostgreSQL extensions installed in the database
+    of the current transaction that are used by approximate aggregates
+    '''
+    if backend.name != 'postgresql':
+        return set()
+    extensions = _database_extensions_cache.get('extensions')
+    if extensions is None:
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT extname FROM pg_extension '
+            'WHERE extname IN %s',
+            (tuple(set(APPROXIMATE_EXTENSIONS.values())),))
+        extensions = sorted(x for x, in cursor)
+        _database_extensions_cache.set('extensions', extensions)
+    return set(extensions)
+
+
+def get_column_types(table_name):
+    "Return the SQL type of each column of table_name in PostgreSQL"
+    if backend.name != 'postgresql':
+        return {}
+    columns = sql.Table('columns', 'information_schema')
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*columns.select(columns.column_name, columns.data_type,
+            where=(columns.table_name == table_name)
+            & (columns.table_schema == 'public')))
+    return dict(cursor)
+
+
+def approximate_missing_extension(aggregate):
+    "Return the extension required by aggregate that is not installed"
+    extension = APPROXIMATE_EXTENSIONS.get(aggregate)
+    if extension and extension not in database_extensions():
+        return extension
+
+
+class GroupingLevel(Function):
+    __slots__ = ()
+    _function = 'GROUPING'
+
+
+class NullValue(sql.Expression):
+    '''
+    A NULL rendered in the query instead of a parameter so its type is
+    resolved from the other queries of a UNION
+    '''
+    __slots__ = ()
+
+    def __str__(self):
+        return 'NULL'
+
+    @property
+    def params(self):
+        return ()
+
+
 class Cube:
     EXPAND_ALL = [('all',)]
+    # Column of the cache that tells which grouping level each row belongs to
+    LEVEL_COLUMN = '_babi_level'
 
     def __init__(self, table=None, rows=None, columns=None, measures=None,
             properties=None, order=None, row_expansions=None,
             parameters=None,
-            column_expansions=None):
+            column_expansions=None, sample=None):
         '''
         order must have the following format:
         [('column_name', 'asc'), ('column_name', 'desc'), (('measure', 'sum'), 'asc')]
+
+        If sample is set, the cube is computed from a random sample with that
+        percentage of the rows of the table and its measures are estimates.
         '''
         if rows is None:
             rows = []
@@ -159,96 +310,323 @@ class Cube:
         self.row_expansions = row_expansions
         self.column_expansions = column_expansions
         self.parameters = parameters
+        self.sample = sample
 
     def clear_cache(self):
-        cursor = Transaction().connection.cursor()
-        if backend.name == 'postgresql':
-            table = sql.Table('tables', schema='information_schema')
-            query = table.select(table.table_name, where=(
-                    table.table_schema == 'public') &
-                (table.table_name.like(self.cache_prefix() + '%')))
-        else:
-            table = sql.Table('sqlite_master')
-            query = table.select(table.name, where=(table.type == 'table') &
-                (table.name.like(self.cache_prefix() + '%')))
-        cursor.execute(*query)
-        for cache in [x[0] for x in cursor.fetchall()]:
-            cursor.execute('DROP TABLE IF EXISTS "%s"' % cache)
+        CubeCache = Pool().get('babi.cube.cache')
+        CubeCache.clear([self.table])
 
     @staticmethod
     def clear_orphan_caches(tables):
         # Remove all cache tables that are not in use by any of the tables
-        prefixes = []
-        for table in tables:
-            cube = Cube(table)
-            prefixes.append(cube.cache_prefix())
-        cursor = Transaction().connection.cursor()
-        if backend.name == 'postgresql':
-            table = sql.Table('tables', schema='information_schema')
-            query = table.select(table.table_name,
-                where=(table.table_schema == 'public') &
-                (table.table_name.like('_babi_cache_%')))
-        else:
-            table = sql.Table('sqlite_master')
-            query = table.select(table.name,
-                where=(table.type == 'table') &
-                (table.name.like('_babi_cache_%')))
-        cursor.execute(*query)
-        for cache in [x[0] for x in cursor.fetchall()]:
-            for prefix in prefixes:
-                if cache.startswith(prefix):
-                    break
-            else:
-                cursor.execute('DROP TABLE IF EXISTS "%s"' % cache)
+        CubeCache = Pool().get('babi.cube.cache')
+        CubeCache.clear_orphans(tables)
 
     def cache_prefix(self):
         h = hashlib.md5(self.table.encode()).hexdigest()[:20]
         return f'_babi_cache_{h}_'
 
-    def get_data(self, query, orderby):
+    def get_cache_signature(self, query):
+        # SQLite cursors do not support mogrify(), so hash the query text
+        # together with its parameters and execute the CREATE TABLE with
+        # parameters directly on all backends.
+        cache_data = repr(tuple(query)).encode('utf-8')
+        return hashlib.md5(cache_data).hexdigest()[:20]
+
+    def get_definition(self):
+        "Return what the cache of the cube contains"
+        return {
+            'dimensions': self.get_group_columns(),
+            'measures': [list(x) for x in self.measures],
+            'properties': list(self.properties),
+            'sample': self.sample,
+            }
+
+    def create_cache_table(self, cache, query_string, params):
+        "Create the cache table with the result of the query if it not exists"
         cursor = Transaction().connection.cursor()
-        query_string, params = tuple(query)
+        unlogged = ''
+        if backend.name == 'postgresql':
+            unlogged = 'UNLOGGED'
+
+            # Even if we use CREATE TABLE IF NOT EXISTS, we need to do
+            # an explicit lock in order to prevent an error when two
+            # transactions try to create the same table. See:
+            # https://stackoverflow.com/questions/29900845/create-schema-if-not-exists-raises-duplicate-key-error
+            lock_id = int(hashlib.sha1(cache.encode("utf-8")).hexdigest(), 16) % (2 ** 63)
+            cursor.execute(f'SELECT pg_advisory_xact_lock({lock_id})')
+
+        cursor.execute(
+            f"CREATE {unlogged} TABLE IF NOT EXISTS {cache} AS "
+            f"{query_string}", params)
 
+    def get_source_table(self):
+        '''
+        Return the table the cube is computed from, which is the sample of the
+        table if the cube is sampled, creating it if needed.
+
+        The sample is kept as a cache of the table, so it is reused by all the
+        sampled cubes of the table until it is computed again.
+        '''
+        if not self.sample:
+            return sql.Table(self.table)
+        CubeCache = Pool().get('babi.cube.cache')
+        cursor = Transaction().connection.cursor()
+
+        sample = float(self.sample)
+        cache = self.cache_prefix() + 'sample_' + str(sample).replace('.', '_')
+        if CubeCache.lookup(cache):
+            CubeCache.touch(cache)
+            return sql.Table(cache)
+
+        if backend.name == 'postgresql':
+            # The rows are chosen one by one instead of by blocks (SYSTEM),
+            # which is slower but the sample is only computed once
+            query_string = (f'SELECT * FROM "{self.table}" '
+                f'TABLESAMPLE BERNOULLI ({sample}) REPEATABLE (0)')
+        else:
+            query_string = (f'SELECT * FROM "{self.table}" '
+                f'WHERE ABS(RANDOM() % 1000000) < {sample * 10000}')
         cursor.execute('SAVEPOINT babi_cube')
         try:
-            # SQLite cursors do not support mogrify(), so hash the query text
-            # together with its parameters and execute the CREATE TABLE with
-            # parameters directly on all backends.
-            cache_data = repr((query_string, params)).encode('utf-8')
-            cache = self.cache_prefix() + hashlib.md5(cache_data).hexdigest()[:20]
-            unlogged = ''
-            if backend.name == 'postgresql':
-                unlogged = 'UNLOGGED'
-
-                # Even if we use CREATE TABLE IF NOT EXISTS, we need to do an
-                # explicit lock in order to prevent an error when two transactions
-                # try to create the same table. See:
-                # https://stackoverflow.com/questions/29900845/create-schema-if-not-exists-raises-duplicate-key-error
-                lock_id = int(hashlib.sha1(cache.encode("utf-8")).hexdigest(), 16) % (2 ** 63)
-                cursor.execute(f'SELECT pg_advisory_xact_lock({lock_id})')
-
-            # TODO: We could have some performance improvements if we did not
-            # depend on the order of the fields in the query. That would probably mean
-            # that get_values() should sort groupby fields alphabetically and then
-            # be able to pick the right values from the result tuple
-            # (probably using DictCursor)
-            cursor.execute(
-                f"CREATE {unlogged} TABLE IF NOT EXISTS {cache} AS "
-                f"{query_string}", params)
+            self.create_cache_table(cache, query_string, ())
+            CubeCache.register(cache, self.table, None)
+            cursor.execute('RELEASE SAVEPOINT babi_cube')
+        except:
+            cursor.execute('ROLLBACK TO SAVEPOINT babi_cube')
+            raise
+        return sql.Table(cache)
 
-            table = sql.Table(cache)
-            query_order = []
-            for field, order in orderby:
-                query_order.append(
-                    self.apply_order(getattr(table, field), order))
+    def get_sample_factors(self):
+        '''
+        Return the factor by which the value of each measure must be scaled
+        to estimate the value on the whole table, or None if it must not be
+        '''
+        if not self.sample:
+            return [None] * len(self.measures)
+        factor = Decimal(100) / Decimal(str(self.sample))
+        return [factor
+            if self.measure_parts(x)[1] in SAMPLE_SCALED_AGGREGATES
+            else None for x in self.measures]
+
+    def get_cache(self, query, orderby, source_query=None):
+        '''
+        Create the cache table with the result of query if it does not exist
+        yet and the index used to read its levels in the given order. Return
+        the cache table.
+
+        The cache is named after query but, if given, it is filled with
+        source_query, which must return the same result.
 
-            cursor.execute(*table.select(order_by=query_order))
-            records = cursor.fetchall()
+        Cache tables are tracked in the babi.cube.cache registry, which is
+        used to know if the table exists and records its accesses.
+        '''
+        CubeCache = Pool().get('babi.cube.cache')
+        cursor = Transaction().connection.cursor()
+
+        signature = self.get_cache_signature(query)
+        cache = self.cache_prefix() + signature
+        registered = CubeCache.lookup(cache)
+        query_string, params = tuple(source_query or query)
+
+        cursor.execute('SAVEPOINT babi_cube')
+        try:
+            if not registered:
+                self.create_cache_table(cache, query_string, params)
+
+            # Levels are read one by one in the order of the cube so the index
+            # starts with the level and follows with the order
+            index_columns = [f'"{self.LEVEL_COLUMN}"'] + [
+                f'"{field}" {order.upper()}' for field, order in orderby]
+            index_hash = hashlib.md5(
+                ','.join(index_columns).encode('utf-8')).hexdigest()[:6]
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS "{cache}_{index_hash}" '
+                f'ON "{cache}" ({", ".join(index_columns)})')
+            if registered:
+                CubeCache.touch(cache)
+            else:
+                CubeCache.register(cache, self.table, signature,
+                    self.get_definition())
             cursor.execute('RELEASE SAVEPOINT babi_cube')
         except:
             cursor.execute('ROLLBACK TO SAVEPOINT babi_cube')
             raise
-        return records
+        return sql.Table(cache)
+
+    def get_data(self, cache, groupby, level, orderby, conditions=None,
+            offset=None, limit=None):
+        '''
+        Return the rows of the given level of the cache that match conditions.
+        Each row has the values of the groupby fields followed by the measures
+        and the properties.
+        '''
+        cursor = Transaction().connection.cursor()
+        fields = [getattr(cache, x) for x in groupby]
+        fields += [getattr(cache, self.measure_name(x)) for x in self.measures]
+        fields += [getattr(cache, self.property_name(x))
+            for x in self.properties]
+        query_order = [self.apply_order(getattr(cache, field), order)
+            for field, order in orderby]
+        where = getattr(cache, self.LEVEL_COLUMN) == level
+        for condition in conditions or []:
+            where &= condition
+        cursor.execute(*cache.select(*fields, where=where,
+                order_by=query_order, offset=offset, limit=limit))
+        return cursor.fetchall()
+
+    def get_expansion_condition(self, cache, dimensions, grouped, expansions):
+        '''
+        Return the condition on the cache that selects the headers of a level
+        that are visible with expansions, where the level is grouped by the
+        first "grouped" dimensions of an axis. It follows the checks done on
+        the results in get_values. Return None when all the headers are
+        visible and False when none is.
+        '''
+        columns = [getattr(cache, x) for x in dimensions[:grouped]]
+        if not expansions:
+            # Only the total is visible
+            if not columns:
+                return
+            return And([x == Null for x in columns])
+
+        default = tuple([None] * len(dimensions))
+        # Values are only compared on PostgreSQL as SQLite does not store
+        # some types, like Decimal, the way its parameters are bound
+        compare_values = backend.name == 'postgresql'
+        conditions = []
+        for expansion in expansions:
+            if expansion == self.EXPAND_ALL[0]:
+                return
+            if expansion == default:
+                if len(columns) <= 1:
+                    return
+                conditions.append(And([x == Null for x in columns[1:]]))
+                continue
+            # The header must be a direct child of the expanded one
+            if len(columns) < len(expansion) + 1:
+                continue
+            condition = And([])
+            for column, value in zip(columns, expansion):
+                if value is None:
+                    condition.append(column == Null)
+                elif compare_values:
+                    condition.append(column == value)
+            not_null = [Case((x == Null, 0), else_=1) for x in columns]
+            condition.append(sum(not_null[1:], not_null[0])
+                == len(expansion) + 1)
+            conditions.append(condition)
+        if not conditions:
+            return False
+        return Or(conditions)
+
+    def get_group_columns(self):
+        "Return the fields of all the dimensions of the cube"
+        return list(dict.fromkeys(self.rows + self.columns))
+
+    @staticmethod
+    def get_level(group_columns, groupby):
+        '''
+        Return the number that identifies the level grouped by groupby. It
+        follows the bitmask returned by GROUPING(): one bit per group column,
+        the first being the most significant, set when the column is not
+        grouped.
+        '''
+        level = 0
+        for column in group_columns:
+            level <<= 1
+            if column not in groupby:
+                level |= 1
+        return level
+
+    def get_cache_order(self, group_columns):
+        '''
+        Return the order of the cube as (column, order) tuples of the cache.
+        Columns not grouped in a level are NULL there, so the same order is
+        valid for all the levels.
+        '''
+        orderby = []
+        for item in self.order:
+            if isinstance(item[0], tuple):
+                orderby.append((self.measure_name(item[0]), item[1]))
+            elif item[0] in group_columns:
+                orderby.append(item)
+        return orderby
+
+    def get_measure_source(self, table, groupby, reuse=False):
+        '''
+        Return the table to aggregate from together with the measures and
+        properties to select from it. If reuse is True, table is the cache of
+        a finer cube whose most detailed level is aggregated again.
+        '''
+        if reuse:
+            source = table.select(
+                where=getattr(table, self.LEVEL_COLUMN) == 0)
+            column_types = get_column_types(table._name)
+            measures = [self.reaggregate_method(source, x, column_types)
+                for x in self.measures]
+            properties = [sql.aggregate.Min(
+                    getattr(source, self.property_name(x))).as_(
+                    self.property_name(x))
+                for x in self.properties]
+            return source, measures, properties
+        if any(self.measure_parts(x)[3] for x in self.measures):
+            source, measures = self.get_values_window_source(table, groupby)
+        else:
+            source = table
+            measures = [self.measure_method(table, x) for x in self.measures]
+        # We could use DISTINCT ON but unfortunately it is not standard and
+        # not supported by SQLite
+        # See: https://www.postgresql.org/docs/17/sql-select.html#SQL-DISTINCT
+        properties = [sql.aggregate.Min(
+                getattr(source, x)).as_(self.property_name(x))
+            for x in self.properties]
+        return source, measures, properties
+
+    def get_level_query(self, table, group_columns, groupby, reuse=False):
+        '''
+        Return the query of a single level with a column for every group
+        column, NULL for the ones not in groupby, and the level number.
+        '''
+        source, measures, properties = self.get_measure_source(table,
+            group_columns, reuse=reuse)
+        fields = [getattr(source, x).as_(x) if x in groupby
+            else NullValue().as_(x) for x in group_columns]
+        fields.append(sql.Cast(sql.Literal(
+                    self.get_level(group_columns, groupby)),
+                'INTEGER').as_(self.LEVEL_COLUMN))
+        return source.select(*(fields + measures + properties),
+            group_by=[getattr(source, x) for x in groupby])
+
+    def get_grouping_sets_query(self, table, group_columns, groupbys,
+            reuse=False):
+        '''
+        Return a single GROUP BY GROUPING SETS query that computes all the
+        levels with one scan of the table
+        '''
+        source, measures, properties = self.get_measure_source(table,
+            group_columns, reuse=reuse)
+        columns = [getattr(source, x) for x in group_columns]
+        fields = [x.as_(name) for x, name in zip(columns, group_columns)]
+        fields.append(GroupingLevel(*columns).as_(self.LEVEL_COLUMN))
+        return source.select(*(fields + measures + properties),
+            group_by=[sql.Grouping(*[[getattr(source, x) for x in groupby]
+                        for groupby in groupbys])])
+
+    def get_cache_query(self, table, group_columns, groupbys, reuse=False):
+        '''
+        Return the query that computes all the levels in a single result.
+        '''
+        if backend.name == 'postgresql' and group_columns:
+            return self.get_grouping_sets_query(table, group_columns,
+                groupbys, reuse=reuse)
+        # The most detailed level goes first so the type of each column is
+        # known when PostgreSQL resolves the UNION.
+        queries = [self.get_level_query(table, group_columns, x, reuse=reuse)
+            for x in sorted(groupbys, key=len, reverse=True)]
+        if len(queries) == 1:
+            return queries[0]
+        return sql.Union(*queries, all_=True)
 
     def get_query_list(self, list):
         '''
@@ -271,36 +649,14 @@ class Cube:
             index += 1
         return list_coordinates
 
-    def get_value_coordinate(self, result, rxc):
-        '''
-        Given a result of a cursor query and the list of coordinates, return
-        the key of the dictionary of values we need to use. The strucutre we
-        follow is:
-            result: ('Party Name 1', Decimal('10.01'))
-            rxc: ([None, None], ['party_name'])
-        The key we end calculating will be:
-            ([None, None], ['Party Name 1'])
-        '''
-        index = 0
-        key = []
-        for rowxcolumn in rxc:
-            rowxcolumn_coordinate = []
-            for rowxcolumn_element in rowxcolumn:
-                if not rowxcolumn_element:
-                    rowxcolumn_coordinate.append(None)
-                else:
-                    result[index].type = CellType.ROW_HEADER
-                    rowxcolumn_coordinate.append(result[index])
-                    index += 1
-            key.append(tuple(rowxcolumn_coordinate))
-        return tuple(key)
-
-    def get_row_header(self, rows, cube_rows):
+    def get_row_header(self, rows, cube_rows, dimension_values):
         '''
         Given a list of all the row headers ordered, return a list with the
         header cells. The structre we follow is:
-            rows: [[None, None], ['Party Name 1', None],
-                ['Party Name 1', 'Party Name 2']]
+            rows: [[None, None], [0, None], [0, 0]]
+        Where each element is the code of the value in dimension_values, a
+        list with the values of each dimension, ie.:
+            dimension_values: [['Party Name 1'], ['Party Name 2']]
         And the structure we return is:
             row_header: [['Party', '', ''], ['', 'Party Name 1', ''],
                 ['', '', 'Party Name 2']]
@@ -329,41 +685,42 @@ class Cube:
                 # element will be always the last element of the list with
                 # text. An example of what we do here is:
                 # r = ['Element1', 'Subelement1'] -> row = [None, 'Subelement1']
-                last_item = [lt for lt in [
-                    next(item for item in reversed(r) if item is not None)]][0]
+                last_index = max(i for i, x in enumerate(r) if x is not None)
 
                 # The empty row at the start represnet the column where we have
                 # total
                 row.append(Cell('', type=CellType.ROW_HEADER))
-                for element in r:
-                    if element and element == last_item:
-                        # In the case of being in the last element of the list,
-                        # we can know that there are no more expansions
-                        if element == r[-1]:
-                            row.append(element.copy(type=CellType.ROW_HEADER))
-                        else:
-                            # Here we are calculating the expansion of this
-                            # cell. Here is an example:
-                            # r = ['Element1', None] -> ['Element1']
-                            element_expansion = tuple([e.value for e in r[:r.index(element)+1]])
-                            row.append(element.copy(type=CellType.ROW_HEADER,
-                                row_expansion=element_expansion))
-                    else:
+                for index, code in enumerate(r):
+                    if index != last_index:
                         row.append(Cell('', type=CellType.ROW_HEADER))
+                        continue
+                    value = dimension_values[index][code]
+                    # In the case of being in the last element of the list,
+                    # we can know that there are no more expansions
+                    if index == len(r) - 1:
+                        row.append(Cell(value, type=CellType.ROW_HEADER))
+                    else:
+                        # Here we are calculating the expansion of this
+                        # cell. Here is an example:
+                        # r = ['Element1', None] -> ['Element1']
+                        element_expansion = tuple(dimension_values[i][x]
+                            for i, x in enumerate(r[:index + 1]))
+                        row.append(Cell(value, type=CellType.ROW_HEADER,
+                            row_expansion=element_expansion))
             row_header.append(row)
         return row_header
 
-    def get_column_header(self, columns, cube_columns):
+    def get_column_header(self, columns, cube_columns, dimension_values):
         '''
         Given a list of all the column headers, ordered, return a list with the
         column headers. The strucutre we follow is:
-            columns: [[None, None], ['Party Name 1', None],
-                ['Party Name 1', 'Party Name 2']]
+            columns: [[None, None], [0, None], [0, 0]]
         And the structure we return is:
             column_header: [['Party', '', ''],
                 ['', 'Party Name 1', 'Party Name 2']]
         '''
-        columns_in_rows = self.get_row_header(columns, cube_columns)
+        columns_in_rows = self.get_row_header(columns, cube_columns,
+            dimension_values)
 
         # Get the extra rows we need to add at the start for each column header
         # represent the row headers
@@ -406,6 +763,16 @@ class Cube:
             window = sql.Window([getattr(table, over_field)])
         if aggregate == 'average':
             aggregate = 'avg'
+        if aggregate in APPROXIMATE_EXTENSIONS:
+            extension = approximate_missing_extension(aggregate)
+            if extension:
+                raise UserError(gettext('babi.msg_approximate_extension',
+                        aggregate=cls.measure_label(measure),
+                        extension=extension))
+            return cls.approximate_method(table, measure, window)
+        if aggregate == 'count_distinct':
+            return sql.aggregate.Count(getattr(table, field), distinct=True,
+                window=window).as_(cls.measure_name(measure))
         if aggregate == 'median':
             return Median(getattr(table, field), window=window).as_(
                 cls.measure_name(measure))
@@ -417,13 +784,31 @@ class Cube:
         return Operator(getattr(table, field), window=window).as_(
             cls.measure_name(measure))
 
+    @classmethod
+    def approximate_method(cls, table, measure, window=None):
+        '''
+        Return the aggregate that approximates measure using the extensions of
+        PostgreSQL
+        '''
+        field, aggregate, percentile, _ = cls.measure_parts(measure)
+        column = getattr(table, field)
+        name = cls.measure_name(measure)
+        if aggregate == 'approx_median':
+            return TDigestPercentile(50, column, window=window).as_(name)
+        if aggregate == 'approx_percentile':
+            return TDigestPercentile(percentile, column,
+                window=window).as_(name)
+        # HyperLogLog sketches return the cardinality as a double
+        return sql.Cast(HllCardinality(HllAddAgg(HllHashAny(column),
+                    window=window)), 'BIGINT').as_(name)
+
     @classmethod
     def measure_parts(cls, measure):
         field = measure[0]
         aggregate = measure[1]
         percentile = None
         over_field = None
-        if aggregate == 'percentile':
+        if aggregate in ('percentile', 'approx_percentile'):
             if len(measure) > 2:
                 percentile = measure[2]
             if len(measure) > 3:
@@ -440,6 +825,10 @@ class Cube:
             'average': 'Average',
             'min': 'Minimum',
             'max': 'Maximum',
+            'count_distinct': 'Distinct Count',
+            'approx_median': 'Approximate Median',
+            'approx_percentile': 'Approximate Percentile',
+            'approx_count_distinct': 'Approximate Distinct Count',
         }
         aggregate_label = aggregate_labels.get(aggregate,
             capitalize(aggregate))
@@ -454,7 +843,7 @@ class Cube:
     @classmethod
     def measure_name(cls, measure):
         field, aggregate, percentile, over_field = cls.measure_parts(measure)
-        if aggregate == 'percentile':
+        if percentile is not None:
             percentile = str(percentile).replace('.', '_')
             name = f'{aggregate}_{percentile}_{field}'
         else:
@@ -474,80 +863,246 @@ class Cube:
         else:
             return field.desc
 
-    def get_values(self):
+    def get_levels(self):
         '''
-        Calculate the values of the cube. Returns a tuple of OrderedDicts:
-        (values, property_values). Both dictionaries follow the same structure
-        where the key is a tuple of (row, column) coordinates and the value is
-        a tuple of cells. The values dictionary contains the values of the
-        measures and the property_values dictionary contains the values of the
-        properties. Ie.:
-
-        {
-            ((Cell('Party Name 1'), Cell(None)), (Cell('Type'), Cell(None))):
-                (Cell(value1), Cell(value2)),
-        }
+        Return the (rows, columns) coordinates of every level of the cube
+        together with the fields each one is grouped by
         '''
         rows = self.get_query_list(self.rows)
         columns = self.get_query_list(self.columns)
 
         # Get the cartesian product between the rows and columns
         rxc = list(product(rows, columns))
-
-        table = sql.Table(self.table)
-        # Format the measures and properties to use them in the query
-        has_window_measures = any(self.measure_parts(x)[3] for x in self.measures)
-        property_count = len(self.properties)
-        values = OrderedDict()
-        property_values = OrderedDict()
-        for rowxcolumn in rxc:
-            groupby = [rc for rowcolumn in rowxcolumn
+        groupbys = [[rc for rowcolumn in rowxcolumn
                 for rc in rowcolumn if rc != None]
+            for rowxcolumn in rxc]
+        return rxc, groupbys
 
-            # Prepare the order we need to use in the query
-            orderby = []
-            for item in self.order:
-                if isinstance(item[0], tuple):
-                    orderby.append((self.measure_name(item[0]), item[1]))
-                else:
-                    if item[0] in groupby:
-                        orderby.append(item)
-
-            if has_window_measures:
-                query = self.get_values_window_query(table, groupby)
+    def get_cache_table(self, groupbys):
+        '''
+        Return the cache table with all the levels, creating it if needed.
+        New caches are computed from the cache of a finer cube of the same
+        table when possible, which is smaller than the table.
+        '''
+        CubeCache = Pool().get('babi.cube.cache')
+        table = self.get_source_table()
+        group_columns = self.get_group_columns()
+        orderby = self.get_cache_order(group_columns)
+        query = self.get_cache_query(table, group_columns, groupbys)
+        source_query = None
+        cache = self.cache_prefix() + self.get_cache_signature(query)
+        if not CubeCache.lookup(cache):
+            finer_cache = self.get_reusable_cache()
+            if finer_cache:
+                source_query = self.get_cache_query(sql.Table(finer_cache),
+                    group_columns, groupbys, reuse=True)
+        return self.get_cache(query, orderby, source_query=source_query)
+
+    def get_reaggregate_columns(self):
+        '''
+        Return the measure columns a finer cache must have to compute the
+        measures of the cube from it or None if they can not be computed that
+        way
+        '''
+        columns = set()
+        for measure in self.measures:
+            field, aggregate, _, over_field = self.measure_parts(measure)
+            if over_field:
+                return
+            if aggregate in ('avg', 'average'):
+                columns.add(self.measure_name((field, 'sum')))
+                columns.add(self.measure_name((field, 'count')))
+            elif aggregate in ('sum', 'count', 'min', 'max'):
+                columns.add(self.measure_name((field, aggregate)))
             else:
-                measures = [self.measure_method(table, x) for x in self.measures]
-                # We could use DISTINCT ON but unfortunately it is not standard and
-                # not supported by SQLite
-                # See: https://www.postgresql.org/docs/17/sql-select.html#SQL-DISTINCT
-                properties = [sql.aggregate.Min(
-                        getattr(table, x)).as_(self.property_name(x))
-                    for x in self.properties]
-                groupby_fields = [getattr(table, x) for x in groupby]
-                fields = groupby_fields + measures + properties
-                query = table.select(*fields, group_by=groupby_fields)
-            results = self.get_data(query, orderby)
+                # Median, percentiles and distinct counts can not be
+                # aggregated again
+                return
+        return columns
+
+    def get_reusable_cache(self):
+        '''
+        Return the name of the registered cache of a cube of the same table
+        with all the dimensions, measures and properties needed to compute
+        this cube from its most detailed level, if any
+        '''
+        CubeCache = Pool().get('babi.cube.cache')
+        columns = self.get_reaggregate_columns()
+        if columns is None:
+            return
+        group_columns = set(self.get_group_columns())
+        for name, definition in CubeCache.get_definitions(self.table):
+            if not group_columns <= set(definition['dimensions']):
+                continue
+            if not set(self.properties) <= set(definition['properties']):
+                continue
+            if definition.get('sample') != self.sample:
+                continue
+            measures = set(self.measure_name(tuple(x))
+                for x in definition['measures'])
+            if not columns <= measures:
+                continue
+            return name
+
+    @classmethod
+    def reaggregate_method(cls, table, measure, column_types=None):
+        '''
+        Return the aggregate that computes measure from the measure columns
+        of a finer cube in table. column_types are the SQL types of the
+        columns of the finer cube, the sums are cast to them as adding again
+        the BIGINT sums of integers would return NUMERIC.
+        '''
+        field, aggregate, _, _ = cls.measure_parts(measure)
+        name = cls.measure_name(measure)
+
+        def column(aggregate):
+            return getattr(table, cls.measure_name((field, aggregate)))
+
+        if aggregate in ('avg', 'average'):
+            # Multiply by one so integer sums are not truncated by the
+            # division while keeping the type AVG() returns
+            one = Decimal(1) if backend.name == 'postgresql' else 1.0
+            return (sql.aggregate.Sum(column('sum')) * one
+                / NullIf(sql.aggregate.Sum(column('count')), 0)).as_(name)
+        if aggregate == 'count':
+            return sql.Cast(sql.aggregate.Sum(column('count')),
+                'BIGINT').as_(name)
+        if aggregate == 'sum':
+            type_ = (column_types or {}).get(cls.measure_name(
+                    (field, 'sum')))
+            if type_:
+                return sql.Cast(sql.aggregate.Sum(column('sum')),
+                    type_.upper()).as_(name)
+        Operator = getattr(sql.aggregate, aggregate.capitalize())
+        return Operator(column(aggregate)).as_(name)
+
+    def precompute(self):
+        '''
+        Create the cache table with all the levels of the cube so it is ready
+        when the cube is built
+        '''
+        _, groupbys = self.get_levels()
+        return self.get_cache_table(groupbys)
+
+    def get_row_keys(self, offset=0, limit=None):
+        '''
+        Return the visible values of the first row dimension in the order
+        they are displayed, from offset and up to limit of them. They are the
+        unit used to page the rows of the cube.
+        '''
+        if not self.rows:
+            return []
+        _, groupbys = self.get_levels()
+        cache = self.get_cache_table(groupbys)
+        group_columns = self.get_group_columns()
+        condition = self.get_expansion_condition(cache, self.rows, 1,
+            self.row_expansions)
+        if condition is False:
+            return []
+        conditions = [condition] if condition is not None else []
+        groupby = self.rows[:1]
+        results = self.get_data(cache, groupby,
+            self.get_level(group_columns, groupby),
+            self.get_cache_order(group_columns), conditions,
+            offset=offset or None, limit=limit)
+        return [x[0] for x in results]
+
+    def get_page(self, offset=0, limit=None, max_rows=None):
+        '''
+        Return the values of the first row dimension of a page and the
+        CubeValues of their rows (see get_row_keys and get_values).
+
+        If max_rows is set the page stops at the last value of the first row
+        dimension whose expanded rows fit in max_rows. A value is never split
+        across pages so the first one is always kept, whatever the number of
+        its rows.
+        '''
+        row_keys = None
+        if limit is not None and self.rows:
+            row_keys = self.get_row_keys(offset, limit)
+        values = self.get_values(row_keys=row_keys)
+        if row_keys and max_rows is not None:
+            rows = defaultdict(set)
+            for row, _ in values.keys():
+                if row[0] is not None:
+                    rows[values.row_values[0][row[0]]].add(row)
+            count = 0
+            for index, row_key in enumerate(row_keys):
+                count += len(rows[row_key])
+                if index and count > max_rows:
+                    row_keys = row_keys[:index]
+                    values.keep_rows(row_keys)
+                    break
+        return row_keys, values
+
+    def get_row_keys_condition(self, cache, row_keys):
+        "Return the condition that keeps the rows under row_keys"
+        column = getattr(cache, self.rows[0])
+        values = [x for x in row_keys if x is not None]
+        condition = column.in_(values) if values else Literal(False)
+        if len(values) < len(row_keys):
+            condition |= (column == Null)
+        return condition
+
+    def get_values(self, row_keys=None):
+        '''
+        Calculate the values of the cube. Returns a CubeValues instance with
+        the values of the measures of each (row, column) coordinates, in the
+        order they were read, and the values of the properties of each row.
+
+        If row_keys is given only the rows under those values of the first
+        row dimension are returned, together with the grand total.
+        '''
+        rxc, groupbys = self.get_levels()
+        cache = self.get_cache_table(groupbys)
+        group_columns = self.get_group_columns()
+        orderby = self.get_cache_order(group_columns)
+        if row_keys is not None:
+            row_key_set = set(row_keys)
+
+        property_count = len(self.properties)
+        factors = self.get_sample_factors()
+        scaled = any(factors)
+        values = CubeValues(len(self.rows), len(self.columns),
+            len(self.measures))
+        for rowxcolumn, groupby in zip(rxc, groupbys):
+            # Only fetch the headers that are visible
+            conditions = []
+            for dimensions, coordinates, expansions in (
+                    (self.rows, rowxcolumn[0], self.row_expansions),
+                    (self.columns, rowxcolumn[1], self.column_expansions)):
+                grouped = len([x for x in coordinates if x is not None])
+                condition = self.get_expansion_condition(cache, dimensions,
+                    grouped, expansions)
+                if condition is not None:
+                    conditions.append(condition)
+            if any(x is False for x in conditions):
+                continue
+            # The grand total row is always read as it has all the columns
+            paged = row_keys is not None and rowxcolumn[0][0] is not None
+            if paged and backend.name == 'postgresql':
+                conditions.append(self.get_row_keys_condition(cache,
+                        row_keys))
+            results = self.get_data(cache, groupby,
+                self.get_level(group_columns, groupby), orderby, conditions)
 
             # If we dont have any expansion -> we are in the level 0
             # TODO: We need a "special" case to show all levels list
             #  |-> use expansions / None -> open everything
             default_row_coordinates = tuple([None] * len(self.rows))
             default_column_coordinates = tuple([None] * len(self.columns))
-            for raw_result in results:
-                if property_count:
-                    result = [Cell(x) for x in raw_result[:-property_count]]
-                else:
-                    result = [Cell(x) for x in raw_result]
-                coordinates = self.get_value_coordinate(result, rowxcolumn)
-
-                if (property_count and coordinates[0]
-                        and coordinates[0][-1] is not None):
-                    coordinates[0][-1].properties = (
-                        raw_result[-property_count:])
+            row_groupby = [x is not None for x in rowxcolumn[0]]
+            column_groupby = [x is not None for x in rowxcolumn[1]]
+            measure_end = len(groupby) + len(self.measures)
+            for result in results:
+                result_values = iter(result)
+                row_coordinate_values = tuple(next(result_values) if x
+                    else None for x in row_groupby)
+                column_coordinate_values = tuple(next(result_values) if x
+                    else None for x in column_groupby)
+                if paged and row_coordinate_values[0] not in row_key_set:
+                    continue
 
-                # Get the row values from the coordinates
-                row_coordinate_values = tuple(
-                    [c.value if c else None for c in coordinates[0]])
                 row_ok = False
                 if self.row_expansions:
                     for row_expansion in self.row_expansions:
@@ -577,9 +1132,6 @@ class Cube:
                     if row_coordinate_values == default_row_coordinates:
                         row_ok = True
 
-                # Get the column values from the coordinates
-                column_coordinate_values = tuple(
-                    [c.value if c else None for c in coordinates[1]])
                 column_ok = False
                 if self.column_expansions:
                     for column_expansion in self.column_expansions:
@@ -610,18 +1162,23 @@ class Cube:
                         column_ok = True
 
                 if row_ok and column_ok:
-                    if groupby:
-                        # If we have the groupby_columns attribute, we get all the
-                        # values since the last column that is not a group by
-                        # column
-                        values[coordinates] = result[len(groupby):]
-                    else:
-                        # In the case we have all the columns as none, the result
-                        # will equal the number of measures we have
-                        values[coordinates] = result
-        return values, property_values
-
-    def get_values_window_query(self, table, groupby):
+                    properties = None
+                    if property_count and row_groupby and row_groupby[-1]:
+                        properties = result[measure_end:]
+                    measures = result[len(groupby):measure_end]
+                    if scaled:
+                        measures = [_scale_value(v, f) if f else v
+                            for v, f in zip(measures, factors)]
+                    values.add(row_groupby, row_coordinate_values,
+                        column_groupby, column_coordinate_values,
+                        measures, properties)
+        return values
+
+    def get_values_window_source(self, table, groupby):
+        '''
+        Return a subquery of table with the window measures already computed
+        and the aggregates of all the measures on it
+        '''
         field_aliases = list(groupby)
         for property_ in self.properties:
             if property_ not in field_aliases:
@@ -647,89 +1204,66 @@ class Cube:
                         getattr(inner_query, alias)).as_(alias))
             else:
                 measures.append(self.measure_method(inner_query, measure))
-        properties = [sql.aggregate.Min(
-                getattr(inner_query, x)).as_(self.property_name(x))
-            for x in self.properties]
-        groupby_fields = [getattr(inner_query, x) for x in groupby]
-        fields = groupby_fields + measures + properties
-        return inner_query.select(*fields, group_by=groupby_fields)
+        return inner_query, measures
 
-    def build(self):
+    @staticmethod
+    def get_header_elements(coordinates, length):
+        '''
+        Return the unique coordinates of an axis sorted as they are displayed:
+        the total first and each header followed by its children, which keep
+        the order in which they were read. The coordinates are indexed in a
+        prefix tree, so they are sorted with a single depth first traversal.
+        '''
+        total = tuple([None] * length)
+        children = defaultdict(list)
+        seen = {total}
+        for coordinate in coordinates:
+            if coordinate in seen:
+                continue
+            seen.add(coordinate)
+            depth = length - coordinate.count(None)
+            parent = coordinate[:depth - 1] + (None,) * (length - depth + 1)
+            children[parent].append(coordinate)
+
+        elements = []
+        stack = [total]
+        while stack:
+            element = stack.pop()
+            elements.append(element)
+            stack.extend(reversed(children.get(element, [])))
+        return elements
+
+    def build(self, offset=0, limit=None, header=True, max_rows=None,
+            page=None):
         '''
         Create the table with values from a cube object. Return a list of lists
         with the format:
             table = [[Cell, Cell, Cell, Cell], [Cell, Cell, Cell, Cell]]
+
+        If limit is set only the rows under limit values of the first row
+        dimension, starting at offset, are returned (see get_page). The
+        grand total row is only part of the first page and the column headers
+        are only returned if header is True.
+
+        page is the result of get_page when it has already been computed.
         '''
-        values, property_values = self.get_values()
-
-        def build_rows_index(values):
-            """
-            Build a dict that maps each count of None
-            to the list of rows that contain exactly that many,
-            preserving the insertion order of values.keys().
-            """
-            rows_by_nones = defaultdict(list)
-            for (row, _) in values.keys():
-                cnt = row.count(None)
-                rows_by_nones[cnt].append(row)
-            return rows_by_nones
-
-        def get_rows(values, key, nones, depth):
-            rows_by_nones = build_rows_index(values)
-            added = set()
-
-            def helper(cur_key, cur_nones, cur_depth):
-                res = []
-                for row in rows_by_nones.get(cur_nones, []):
-                    if row[:len(cur_key)] != cur_key:
-                        continue
-                    if row in added:
-                        continue
-                    added.add(row)
-                    res.append(row)
-                    res.extend(helper(row[:cur_depth], cur_nones - 1, cur_depth + 1))
-                return res
-            return helper(key, nones, depth)
-
-        def build_cols_index(values):
-            """
-            Build a dict that maps each count of None
-            to the list of columns that contain exactly that many,
-            preserving the insertion order of values.keys().
-            """
-            cols_by_nones = defaultdict(list)
-            for (_, col) in values.keys():
-                cnt = col.count(None)
-                cols_by_nones[cnt].append(col)
-            return cols_by_nones
-
-        def get_cols(values, key, nones, depth):
-            cols_by_nones = build_cols_index(values)
-            added = set()
-
-            def helper(cur_key, cur_nones, cur_depth):
-                res = []
-                for col in cols_by_nones.get(cur_nones, []):
-                    if col[:len(cur_key)] != cur_key:
-                        continue
-                    if col in added:
-                        continue
-                    added.add(col)
-                    res.append(col)
-                    res.extend(helper(col[:cur_depth], cur_nones - 1, cur_depth + 1))
-                return res
-            return helper(key, nones, depth)
+        if page is None:
+            page = self.get_page(offset, limit, max_rows)
+        row_keys, values = page
+        estimate = bool(self.sample)
 
-        row_elements = [tuple([None]*len(self.rows))]
-        row_elements += get_rows(values, (), len(self.rows)-1, 1)
-        col_elements = [tuple([None]*len(self.columns))]
-        col_elements += get_cols(values, (), len(self.columns)-1, 1)
+        row_elements = self.get_header_elements(
+            (row for row, _ in values.keys()), len(self.rows))
+        col_elements = self.get_header_elements(
+            (column for _, column in values.keys()), len(self.columns))
 
         # TODO: for each cell header, know the expansion we need to do
-        row_header = self.get_row_header(row_elements, self.rows)
-        table = self.get_column_header(col_elements, self.columns)
+        row_header = self.get_row_header(row_elements, self.rows,
+            values.row_values)
+        table = self.get_column_header(col_elements, self.columns,
+            values.column_values)
         count = 0
-        for row in table:
+        for row in (table if header else []):
             count += 1
             if self.properties:
                 if row_header:
@@ -744,7 +1278,8 @@ class Cube:
                 nrow += row[length:]
                 row = nrow
             yield row
-        for row in range(len(row_elements)):
+        first = 1 if row_keys is not None and offset else 0
+        for row in range(first, len(row_elements)):
             table_row = row_header[row]
             if self.properties:
                 if row_header:
@@ -752,13 +1287,14 @@ class Cube:
                 else:
                     length = 0
             if self.properties:
-                props = table_row[-1].properties or [''] * len(self.properties)
+                props = (values.properties.get(row_elements[row])
+                    or [''] * len(self.properties))
                 table_row += [Cell(x, type=CellType.ROW_HEADER) for x in props]
             for col in range(len(col_elements)):
-                value = values.get((row_elements[row], col_elements[col]))
-                if value:
+                value = values.get(row_elements[row], col_elements[col])
+                if value is not None:
                     for cell in value:
-                        table_row.append(cell)
+                        table_row.append(Cell(cell, estimate=estimate))
                 else:
                     for measure in range(len(self.measures)):
                         table_row.append(Cell(None))
@@ -786,6 +1322,8 @@ class Cube:
             ).encode('utf-8')
             encoded = base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
             cube_properties['parameters'] = encoded
+        if cube_properties.get('sample') is None:
+            del cube_properties['sample']
         return urlencode(cube_properties, doseq=True)
 
     @classmethod
@@ -821,6 +1359,9 @@ class Cube:
             payload = base64.urlsafe_b64decode((encoded + padding).encode('ascii'))
             cube_properties['parameters'] = json.loads(payload.decode('utf-8'))
 
+        if cube_properties.get('sample'):
+            cube_properties['sample'] = float(cube_properties['sample'][0])
+
         if table_name:
             cube_properties['table'] = table_name
         return cls(**cube_properties)
@@ -833,16 +1374,19 @@ class CellType(Enum):
 
 
 class Cell:
-    __slots__ = ('value', 'type', 'row_expansion', 'column_expansion', 'properties')
+    __slots__ = ('value', 'type', 'row_expansion', 'column_expansion',
+        'properties', 'estimate')
 
     def __init__(self, value=None, type=CellType.VALUE, row_expansion=None,
-            column_expansion=None, properties=None):
+            column_expansion=None, properties=None, estimate=False):
         self.value = value
         # Use as a type an enum, it is much faster than a dictionary
         self.type = type
         self.row_expansion = row_expansion
         self.column_expansion = column_expansion
         self.properties = properties
+        # The value was computed from a sample of the table
+        self.estimate = estimate
 
     def formatted(self, lang=None, worksheet=None):
         if not lang:
@@ -869,7 +1413,7 @@ class Cell:
                     fmt = '#,##0.' + '0' * digits
                 else:
                     fmt = '#,##0'
-                cell = openpyxl.cell.Cell(worksheet, value=value)
+                cell = openpyxl.cell.WriteOnlyCell(worksheet, value=value)
                 cell.number_format = fmt
                 return cell
             return lang.format_number(value, grouping=True, digits=digits)
@@ -912,7 +1456,93 @@ class Cell:
 
     def copy(self, **kwargs):
         new = Cell(self.value, self.type, self.row_expansion,
-            self.column_expansion, self.properties)
+            self.column_expansion, self.properties, self.estimate)
         for arg in kwargs:
             setattr(new, arg, kwargs[arg])
         return new
+
+
+class CubeValues:
+    '''
+    Compact representation of the values of a cube. The values of each
+    dimension are coded as integers, so the (row, column) coordinates are
+    tuples of codes, with None for the dimensions not grouped, and the values
+    of the measures are kept in one list per measure. Cells are only created
+    when the table is built.
+    '''
+    __slots__ = ('row_codes', 'row_values', 'column_codes', 'column_values',
+        'index', 'measures', 'properties')
+
+    def __init__(self, rows, columns, measures):
+        # Map each value of a dimension to its code and back
+        self.row_codes = [{} for _ in range(rows)]
+        self.row_values = [[] for _ in range(rows)]
+        self.column_codes = [{} for _ in range(columns)]
+        self.column_values = [[] for _ in range(columns)]
+        # Position of each (row, column) coordinates in the measure lists
+        self.index = {}
+        self.measures = [[] for _ in range(measures)]
+        self.properties = {}
+
+    @staticmethod
+    def encode(codes, values, grouped, coordinate):
+        result = []
+        for dimension_codes, dimension_values, is_grouped, value in zip(
+                codes, values, grouped, coordinate):
+            if not is_grouped:
+                result.append(None)
+                continue
+            code = dimension_codes.get(value)
+            if code is None:
+                code = dimension_codes[value] = len(dimension_values)
+                dimension_values.append(value)
+            result.append(code)
+        return tuple(result)
+
+    def add(self, row_grouped, row, column_grouped, column, measures,
+            properties=None):
+        '''
+        Add the values of the measures of the given row and column, which are
+        tuples with the value of each dimension
+        '''
+        row = self.encode(self.row_codes, self.row_values, row_grouped, row)
+        column = self.encode(self.column_codes, self.column_values,
+            column_grouped, column)
+        self.index[(row, column)] = len(self.measures and self.measures[0])
+        for measure, value in zip(self.measures, measures):
+            measure.append(value)
+        if properties is not None:
+            self.properties.setdefault(row, tuple(properties))
+
+    def get(self, row, column):
+        "Return the values of the measures of the given coded coordinates"
+        position = self.index.get((row, column))
+        if position is None:
+            return
+        return [x[position] for x in self.measures]
+
+    def decode_row(self, row):
+        return tuple(None if x is None else self.row_values[i][x]
+            for i, x in enumerate(row))
+
+    def decode_column(self, column):
+        return tuple(None if x is None else self.column_values[i][x]
+            for i, x in enumerate(column))
+
+    def keep_rows(self, row_keys):
+        '''
+        Keep only the rows under the given values of the first row dimension
+        together with the rows not grouped by it, like the grand total
+        '''
+        codes = {self.row_codes[0][x] for x in row_keys
+            if x in self.row_codes[0]}
+        self.index = {k: v for k, v in self.index.items()
+            if k[0][0] is None or k[0][0] in codes}
+        self.properties = {k: v for k, v in self.properties.items()
+            if k[0] is None or k[0] in codes}
+
+    def keys(self):
+        return self.index.keys()
+
+    def __len__(self):
+        return len(self.index)
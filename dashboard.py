@@ -10,6 +10,7 @@ from trytond.exceptions import UserError
 from trytond.model.exceptions import ValidationError
 from trytond.i18n import gettext
 from .table import convert_to_symbol
+from .cube import TDIGEST_COMPRESSION, approximate_missing_extension
 
 
 class Dashboard(ModelSQL, ModelView):
@@ -900,10 +901,14 @@ class WidgetParameter(sequence_ordered(), ModelSQL, ModelView):
             ('min', 'Minimum'),
             ('max', 'Maximum'),
             ('median', 'Median'),
+            ('approx_median', 'Approximate Median'),
+            ('count_distinct', 'Distinct Count'),
             ], 'Aggregate', states={
             'required': Bool(Eval('aggregate_required')),
             'invisible': Bool(Eval('aggregate_invisible')),
-            })
+            },
+        help='The approximate median requires the tdigest extension of '
+        'PostgreSQL.')
     aggregate_required = fields.Function(fields.Boolean('Aggregate Required'),
         'on_change_with_aggregate_required')
     aggregate_invisible = fields.Function(fields.Boolean('Aggregate Invisible'),
@@ -944,11 +949,15 @@ class WidgetParameter(sequence_ordered(), ModelSQL, ModelView):
     def check_aggregate(self):
         if not self.aggregate or not self.field:
             return
-        if self.aggregate in ('sum', 'avg', 'median'):
+        if self.aggregate in ('sum', 'avg', 'median', 'approx_median'):
             if (self.field and self.field.type
                     and self.field.type not in ('integer', 'float', 'numeric')):
                 raise ValidationError(gettext('babi.msg_invalid_aggregate',
                     parameter=self.rec_name, widget=self.widget.rec_name))
+        extension = approximate_missing_extension(self.aggregate)
+        if extension:
+            raise ValidationError(gettext('babi.msg_approximate_extension',
+                    aggregate=self.rec_name, extension=extension))
 
     def check_type(self):
         settings = self.widget.parameter_settings()
@@ -970,9 +979,18 @@ class WidgetParameter(sequence_ordered(), ModelSQL, ModelView):
         if not self.field:
             return
         if self.aggregate:
-            if self.aggregate == 'median':
+            if self.aggregate == 'approx_median':
+                extension = approximate_missing_extension(self.aggregate)
+                if extension:
+                    raise UserError(gettext('babi.msg_approximate_extension',
+                            aggregate=self.rec_name, extension=extension))
+                return ('tdigest_percentile("%s"::DOUBLE PRECISION, %d, 0.5)'
+                    % (self.field.internal_name, TDIGEST_COMPRESSION))
+            elif self.aggregate == 'median':
                 return ('percentile_cont(0.5) WITHIN GROUP (ORDER BY "%s")' %
                     self.field.internal_name)
+            elif self.aggregate == 'count_distinct':
+                return 'COUNT(DISTINCT "%s")' % self.field.internal_name
             else:
                 return '%s("%s")' % (self.aggregate.upper(),
                     self.field.internal_name)
@@ -1,8 +1,10 @@
 import ast
+import json
 import logging
 import secrets
 import tempfile
 from datetime import date, datetime
+from itertools import chain
 from dominate.tags import (div, h1, p, pre, a, form, button, span, table, thead,
     tbody, tr, td, head, html, meta, title, script, h3, comment, select,
     option, main, th, style, details, summary, input_, label)
@@ -13,17 +15,25 @@ from weasyprint import HTML
 from psycopg.errors import UndefinedTable
 from werkzeug.utils import redirect
 from werkzeug.wrappers import Response
+from trytond.config import config
 from trytond.model import fields
 from trytond.pool import Pool, PoolMeta
 from trytond.transaction import Transaction
 from trytond.modules.voyager.voyager import Component, Endpoint
 from trytond.modules.voyager.i18n import _
-from .cube import Cube, CellType, capitalize
-from .table import datetime_to_company_tz
-from .tools import adjust_column_widths
+from .cube import (Cube, CellType, PIVOT_SAMPLE_PERCENT, capitalize,
+    approximate_missing_extension)
+from .table import HOURGLASS, datetime_to_company_tz
+from .tools import append_rows
 
 logger = logging.getLogger(__name__)
 
+# Number of values of the first row dimension rendered per page of a pivot
+PIVOT_PAGE_SIZE = config.getint('babi', 'pivot_page_size', default=100)
+# Number of expanded rows after which a page of a pivot stops, a value of the
+# first row dimension is never split so a page may have more rows
+PIVOT_PAGE_ROWS = config.getint('babi', 'pivot_page_rows', default=500)
+
 # TODO: Use table.py implementation in 7.2 version and above
 def save_virtual_workbook(workbook):
     with tempfile.NamedTemporaryFile() as tmp:
@@ -155,7 +165,7 @@ def _normalize_table_name(name):
 
 def _measure_key(field_name, aggregate, percentile=None, over_field=None):
     key = (field_name, aggregate)
-    if aggregate == 'percentile':
+    if aggregate in ('percentile', 'approx_percentile'):
         key += (percentile,)
     if over_field:
         key += (over_field,)
@@ -174,11 +184,15 @@ def _measure_label(measure, field_names=None):
         'median': _('Median'),
         'percentile': _('Percentile'),
         'count': _('Count'),
+        'count_distinct': _('Distinct Count'),
         'min': _('Minimum'),
         'max': _('Maximum'),
+        'approx_median': _('Approximate Median'),
+        'approx_percentile': _('Approximate Percentile'),
+        'approx_count_distinct': _('Approximate Distinct Count'),
     }
     label = labels.get(aggregate, capitalize(aggregate))
-    if aggregate == 'percentile':
+    if percentile is not None:
         label = f"{label} ({percentile})"
     if over_field:
         if field_names:
@@ -803,6 +817,24 @@ class IndexNull(IndexMixin, Endpoint):
         return Index(self.table_name)
 
 
+def _index_url(table_name, table_properties):
+    pool = Pool()
+    Index = pool.get('www.index.pivot')
+    if table_properties == 'null':
+        return Index.url(table_name=table_name, table_properties='null')
+    placeholder = '__TABLE_PROPERTIES__'
+    url = Index.url(table_name=table_name, table_properties=placeholder)
+    return url.replace(placeholder, table_properties)
+
+
+def _compute_progress(status_url, label):
+    return div(span(HOURGLASS, cls="animate-pulse"), span(label),
+        hx_post=status_url, hx_trigger="every 2s", hx_swap="outerHTML",
+        cls=("inline-flex h-full min-w-[7.25rem] items-center gap-2 "
+            "rounded-md px-3 text-xs font-semibold text-gray-700 ring-1 "
+            "ring-inset ring-gray-300"))
+
+
 class PivotCompute(Endpoint):
     'Pivot Compute'
     __name__ = 'www.pivot_compute'
@@ -816,8 +848,8 @@ class PivotCompute(Endpoint):
 
     def render(self):
         pool = Pool()
-        Index = pool.get('www.index.pivot')
         Table = pool.get('babi.table')
+        PivotComputeStatus = pool.get('www.pivot_compute.status')
         table_name = _normalize_table_name(self.table_name)
 
         tables = Table.search([
@@ -831,6 +863,7 @@ class PivotCompute(Endpoint):
         target_table_name = self.table_name
         cube = None
         redirect_properties = self.table_properties
+        job = None
         if access:
             try:
                 request = Transaction().context.get('voyager_context').request
@@ -872,7 +905,7 @@ class PivotCompute(Endpoint):
                         logger.error('Parametrized table copy returned empty list')
                     else:
                         table = new_tables[0]
-                        table._compute()
+                        job = Table.enqueue_compute([table]).get(table.id)
                         target_table_name = table.table_name
                         if self.table_properties == 'null':
                             pivots = [p for p in table.pivots if p.active]
@@ -886,29 +919,75 @@ class PivotCompute(Endpoint):
                         elif cube:
                             redirect_properties = cube.encode_properties()
                 else:
-                    Table.compute([table])
+                    job = Table.enqueue_compute([table]).get(table.id)
                     if cube:
                         redirect_properties = cube.encode_properties()
             except Exception:
                 logger.exception('Error computing pivot for table %s', table_name)
                 raise
 
-        if redirect_properties == 'null':
-            redirect_url = Index.url(table_name=target_table_name,
-                table_properties='null')
-        else:
-            placeholder = '__TABLE_PROPERTIES__'
-            redirect_url = Index.url(table_name=target_table_name,
-                table_properties=placeholder)
-            redirect_url = redirect_url.replace(placeholder, redirect_properties)
+        redirect_url = _index_url(target_table_name, redirect_properties)
         request = Transaction().context.get('voyager_context').request
         if request and request.headers.get('HX-Request') == 'true':
+            # The table is computed by the queue, the page polls the status
+            # of the task and is redirected once it is done
+            if job is not None:
+                status_url = PivotComputeStatus.url(
+                    table_name=target_table_name,
+                    table_properties=redirect_properties, job=str(job))
+                return Response(str(_compute_progress(status_url,
+                            _('Queued'))), content_type='text/html')
             response = Response('')
             response.headers['HX-Redirect'] = redirect_url
             return response
         return redirect(redirect_url)
 
 
+class PivotComputeStatus(Endpoint):
+    'Pivot Compute Status'
+    __name__ = 'www.pivot_compute.status'
+    _url = '/compute_status/<string:table_name>/<string:table_properties>/<string:job>'
+    _type = 'babi_pivot'
+    _method = 'POST'
+
+    table_name = fields.Char('Table Name')
+    table_properties = fields.Char('Table Properties')
+    job = fields.Char('Job')
+
+    def render(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+
+        internal_name = _normalize_table_name(self.table_name)
+        tables = Table.search([('internal_name', '=', internal_name)], limit=1)
+        if not tables or not tables[0].check_access():
+            return Response('')
+        table, = tables
+
+        # Only the tasks that compute the table are reported, the index shows
+        # the result or the error of the computation
+        state = 'done'
+        if self.job and self.job.isdigit():
+            state = table.get_compute_state(int(self.job))
+        if state in ('done', 'failed'):
+            response = Response('')
+            response.headers['HX-Redirect'] = _index_url(self.table_name,
+                self.table_properties)
+            return response
+
+        if state == 'queued':
+            label = _('Queued')
+        elif table.compute_progress is not None:
+            label = _('Computing %s%%') % int(table.compute_progress)
+        else:
+            label = _('Computing')
+        return Response(str(_compute_progress(self.url(
+                        table_name=self.table_name,
+                        table_properties=self.table_properties,
+                        job=self.job), label)),
+            content_type='text/html')
+
+
 class PivotApply(Endpoint):
     'Pivot Apply'
     __name__ = 'www.pivot_apply'
@@ -1024,11 +1103,15 @@ class PivotSave(Endpoint):
                 Cube.measure_parts(measure))
             if aggregate == 'average':
                 aggregate = 'avg'
+            approximate = aggregate.startswith('approx_')
+            if approximate:
+                aggregate = aggregate[len('approx_'):]
             field = fields_by_internal.get(field_name)
             over_field = fields_by_internal.get(over_field)
             if field and aggregate:
                 to_create_measures.append(Measure(pivot=pivot,
                     field=field, aggregate=aggregate,
+                    approximate=approximate,
                     percentile=percentile,
                     over_field=over_field))
 
@@ -1063,7 +1146,7 @@ class PivotSave(Endpoint):
             element_map[item.field.internal_name] = item
         for item in pivot.measures:
             element_map[_measure_key(item.field.internal_name,
-                item.aggregate, item.percentile,
+                item.cube_aggregate, item.percentile,
                 item.over_field and item.over_field.internal_name)] = item
 
         sequence = 0
@@ -1459,9 +1542,16 @@ class PivotHeaderSelection(PivotHeaderSelectionMixin, Endpoint):
                                         with select(id="measure", name="measure", required=True, cls="mt-2 block w-full rounded-md border-0 py-1.5 pl-3 pr-10 text-gray-900 ring-1 ring-inset ring-gray-300 focus:ring-2 focus:ring-indigo-600 sm:text-sm sm:leading-6"):
                                             option(_('Average'), value='avg')
                                             option(_('Count'), value='count')
+                                            option(_('Distinct Count'), value='count_distinct')
+                                            if not approximate_missing_extension('approx_count_distinct'):
+                                                option(_('Approximate Distinct Count'), value='approx_count_distinct')
                                             option(_('Max'), value='max')
                                             option(_('Median'), value='median')
+                                            if not approximate_missing_extension('approx_median'):
+                                                option(_('Approximate Median'), value='approx_median')
                                             option(_('Percentile'), value='percentile')
+                                            if not approximate_missing_extension('approx_percentile'):
+                                                option(_('Approximate Percentile'), value='approx_percentile')
                                             option(_('Min'), value='min')
                                             option(_('Sum'), value='sum', selected=True)
                                             script(raw("""
@@ -1470,7 +1560,8 @@ class PivotHeaderSelection(PivotHeaderSelectionMixin, Endpoint):
                                                     var measure = document.getElementById('measure');
                                                     var percentile = document.getElementById('percentile_container');
                                                     if (!measure || !percentile) return;
-                                                    var show = measure.value === 'percentile';
+                                                    var show = (measure.value === 'percentile'
+                                                      || measure.value === 'approx_percentile');
                                                     percentile.classList.toggle('hidden', !show);
                                                     var input = document.getElementById('percentile');
                                                     if (input) input.required = show;
@@ -1744,6 +1835,12 @@ class PivotTable(Endpoint):
         cube.column_expansions = []
         collapsed_table_properties = cube.encode_properties()
 
+        # Prepare the cube properties to switch between the sampled preview
+        # and the exact values
+        cube = Cube.parse_properties(self.table_properties, self.table_name)
+        cube.sample = None if cube.sample else PIVOT_SAMPLE_PERCENT
+        sample_table_properties = cube.encode_properties()
+
         cube = Cube.parse_properties(self.table_properties, self.table_name)
 
         css = 'text-gray-300'
@@ -1765,15 +1862,75 @@ class PivotTable(Endpoint):
                 "inline-flex items-center justify-center h-7 w-7 rounded-md ring-1 ring-inset ring-gray-300 hover:bg-indigo-50 hover:text-indigo-700 active:bg-indigo-100 active:text-indigo-800 active:scale-95 transition " + css))
         collapse_all.add(COLLAPSE_ALL)
 
+        if cube.sample:
+            sample_label = _('Exact values')
+            sample_tooltip = _('Compute the values from all the rows')
+        else:
+            sample_label = _('Sample preview')
+            sample_tooltip = _('Estimate the values from a %s%% sample of '
+                'the rows, which is faster on large tables') % (
+                PIVOT_SAMPLE_PERCENT)
+        sample_toggle = a(sample_label,
+            href=Index.url(table_name=self.table_name,
+                table_properties=sample_table_properties),
+            **_tooltip_attrs(sample_tooltip,
+                "inline-flex h-7 items-center rounded-md px-2 text-xs font-semibold text-gray-700 ring-1 ring-inset ring-gray-300 hover:bg-indigo-50 hover:text-indigo-700 active:bg-indigo-100 active:text-indigo-800 active:scale-95 transition"))
+
         controls = div(cls="flex items-center gap-2 pb-2")
         controls.add(expand_all)
         controls.add(collapse_all)
         controls.add(download)
+        controls.add(sample_toggle)
+        if cube.sample:
+            controls.add(span(_('Values are estimates from a %s%% sample '
+                        'of the rows') % cube.sample,
+                    cls="text-xs text-amber-700"))
 
         pivot_table = table(cls="table-auto text-sm text-left rtl:text-right text-black overflow-x-auto")
-        data_row_index = 0
+        # Only the first page of rows is rendered, the following ones are
+        # requested when the last row is scrolled into view
+        for pivot_row in self.render_rows(cube, language, field_names,
+                offset=0, header=True):
+            pivot_table.add(pivot_row)
+
+        loading_div = div(id="loading-state", cls="loading-indicator absolute -translate-x-1/2 -translate-y-1/2 top-2/4 left-1/2 w-full bg-gray-800 bg-opacity-50 h-full")
+        loading_spinner_ = div(role="status", cls="absolute -translate-x-1/2 -translate-y-1/2 top-20 left-48")
+        loading_spinner_.add(LOADING_SPINNER)
+        loading_spinner_.add(p(_('Loading ...'), cls="text-white"))
+        loading_div.add(loading_spinner_)
+
+        pivot_div = div(id='pivot_table', cls=("inline-block min-w-full py-2 align-middle "
+            "sm:px-6 lg:px-8 relative my-2"))
+        pivot_div.add(loading_div)
+        pivot_div.add(controls)
+        table_container = div(cls="shadow-md rounded-lg overflow-hidden border border-gray-200")
+        table_container.add(pivot_table)
+        pivot_div.add(table_container)
+        return pivot_div
+
+    def render_rows(self, cube, language, field_names, offset=0,
+            header=False, row_index=0):
+        '''
+        Return the table rows of a page of the cube followed, if there are
+        more, by a row that loads the next page when it is revealed.
+
+        row_index is the number of data rows of the previous pages so the
+        striping continues across pages.
+        '''
+        pool = Pool()
+        PivotTableRows = pool.get('www.pivot_table.rows')
+
+        rows = []
+        width = 1
+        # Keep the top-left header cell empty now that controls are outside
+        # the table
+        blank_cell = header
+        data_row_index = row_index
         header_row_index = 0
-        for row in cube.build():
+        page = cube.get_page(offset, PIVOT_PAGE_SIZE, PIVOT_PAGE_ROWS)
+        row_keys, _ = page
+        for row in cube.build(offset, header=header, page=page):
+            width = len(row)
             has_data = any(cell.type == CellType.VALUE for cell in row)
             row_bg = ""
             if has_data:
@@ -1784,12 +1941,10 @@ class PivotTable(Endpoint):
                 header_row_index += 1
             pivot_row = tr(cls="hover:bg-gray-50 transition-colors" + row_bg)
             for cell in row:
-                if download:
-                    # Keep the top-left header cell empty now that controls are outside the table.
+                if blank_cell:
                     pivot_row.add(td('', cls="text-xs font-semibold text-slate-900 px-6 py-1.5 border-b-0.5 border-black"))
-                    download = None
+                    blank_cell = False
                     continue
-
                 # Handle the headers links
                 if (cell.type == CellType.ROW_HEADER or
                         cell.type == CellType.COLUMN_HEADER):
@@ -1852,24 +2007,65 @@ class PivotTable(Endpoint):
 
                     pivot_row.add(td(cell_value, cls="text-xs font-semibold text-slate-900 px-2 py-1 border-b-0.5 border-black", style="white-space: nowrap"))
 
+                elif cell.estimate and cell.value is not None:
+                    pivot_row.add(td('~' + str(cell.formatted(language)),
+                            **_tooltip_attrs(_('Estimate'),
+                                "border-b italic text-gray-600 border-gray-200 px-2 py-1 text-right"),
+                            style="white-space: nowrap"))
                 else:
                     pivot_row.add(td(cell.formatted(language), cls="border-b text-black border-gray-200 px-2 py-1 text-right", style="white-space: nowrap"))
-            pivot_table.add(pivot_row)
+            rows.append(pivot_row)
+
+        next_offset = offset + len(row_keys or [])
+        if row_keys and cube.get_row_keys(next_offset, 1):
+            rows.append(tr(
+                    td(_('Loading ...'), colspan=width,
+                        cls="text-xs text-gray-500 px-2 py-1"),
+                    hx_post=PivotTableRows.url(
+                        table_name=self.table_name,
+                        table_properties=self.table_properties,
+                        output_format=self.output_format or 'xlsx',
+                        offset=str(next_offset)),
+                    hx_vals=json.dumps({'row_index': data_row_index}),
+                    hx_trigger="revealed", hx_swap="outerHTML"))
+        return rows
+
+
+class PivotTableRows(PivotTable):
+    'Pivot Table Rows'
+    __name__ = 'www.pivot_table.rows'
+    _url = '/table_rows/<string:table_name>/<string:table_properties>/<string:output_format>/<string:offset>'
+    _type = 'babi_pivot'
+    _method = 'POST'
 
-        loading_div = div(id="loading-state", cls="loading-indicator absolute -translate-x-1/2 -translate-y-1/2 top-2/4 left-1/2 w-full bg-gray-800 bg-opacity-50 h-full")
-        loading_spinner_ = div(role="status", cls="absolute -translate-x-1/2 -translate-y-1/2 top-20 left-48")
-        loading_spinner_.add(LOADING_SPINNER)
-        loading_spinner_.add(p(_('Loading ...'), cls="text-white"))
-        loading_div.add(loading_spinner_)
+    offset = fields.Char('Offset')
 
-        pivot_div = div(id='pivot_table', cls=("inline-block min-w-full py-2 align-middle "
-            "sm:px-6 lg:px-8 relative my-2"))
-        pivot_div.add(loading_div)
-        pivot_div.add(controls)
-        table_container = div(cls="shadow-md rounded-lg overflow-hidden border border-gray-200")
-        table_container.add(pivot_table)
-        pivot_div.add(table_container)
-        return pivot_div
+    def render(self):
+        pool = Pool()
+        Language = pool.get('ir.lang')
+        Table = pool.get('babi.table')
+
+        internal_name = _normalize_table_name(self.table_name)
+        tables = Table.search([('internal_name', '=', internal_name)], limit=1)
+        if not tables or not tables[0].check_access():
+            return Response('')
+        btable = tables[0]
+        field_names = dict((x.internal_name, x.name) for x in btable.fields_)
+
+        language = Transaction().context.get('language', 'en')
+        language, = Language.search([('code', '=', language)], limit=1)
+
+        try:
+            request = Transaction().context.get('voyager_context').request
+            row_index = int(request.form.get('row_index', 0))
+        except (AttributeError, ValueError):
+            row_index = 0
+
+        cube = Cube.parse_properties(self.table_properties, self.table_name)
+        rows = self.render_rows(cube, language, field_names,
+            offset=int(self.offset or 0), row_index=row_index)
+        return Response(''.join(str(x) for x in rows),
+            content_type='text/html')
 
 
 class DownloadReport(Endpoint):
@@ -1883,13 +2079,13 @@ class DownloadReport(Endpoint):
     output_format = fields.Char('Output Format')
 
     def render_xlsx(self, table, cube, language):
-        wb = Workbook()
-        ws = wb.active
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
         # header
-        ws.append([table.rec_name, _('data from %s') % datetime_to_company_tz(table.calculation_date)])
-        for row in cube.build():
-            ws.append([x.formatted(language, worksheet=ws) for x in row])
-        adjust_column_widths(ws, max_width=30)
+        rows = chain([[table.rec_name, _('data from %s') % datetime_to_company_tz(table.calculation_date)]],
+            ([x.formatted(language, worksheet=ws) for x in row]
+                for row in cube.build()))
+        append_rows(ws, rows, max_width=30)
         return save_virtual_workbook(wb), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
     def render_pdf(self, table, cube, language):
@@ -2022,6 +2218,8 @@ class DownloadReport(Endpoint):
         output_format = self.output_format or table.output_format or 'xlsx'
 
         cube = Cube.parse_properties(self.table_properties, self.table_name)
+        # Reports always contain the exact values
+        cube.sample = None
         content, content_type = getattr(self, 'render_%s' % output_format)(table, cube, language)
         response = Response(content)
         response.headers['Content-Disposition'] = f'attachment; filename={self.table_name}.{output_format}'
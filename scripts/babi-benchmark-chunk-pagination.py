@@ -0,0 +1,77 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+#
+# Compare the per chunk latency of OFFSET and keyset pagination when walking
+# a model the way babi.table model computation does.
+#
+# Run it from trytond-console, optionally defining model_name, chunk_size and
+# max_chunks before executing the script:
+#
+#   >>> model_name = 'sale.line'
+#   >>> exec(open('scripts/babi-benchmark-chunk-pagination.py').read())
+import statistics
+import time
+
+from trytond.modules.babi.table import search_model_chunk
+
+pool = globals()['pool']
+MODEL_NAME = globals().get('model_name', 'babi.test')
+CHUNK_SIZE = globals().get('chunk_size', 100)
+MAX_CHUNKS = globals().get('max_chunks', 200)
+REPORT_EVERY = max(MAX_CHUNKS // 20, 1)
+
+Model = pool.get(MODEL_NAME)
+
+
+def offset_chunks():
+    index = 0
+    while index < MAX_CHUNKS:
+        start = time.perf_counter()
+        records = Model.search([], offset=index * CHUNK_SIZE,
+            limit=CHUNK_SIZE, order=[('id', 'ASC')])
+        yield time.perf_counter() - start
+        if not records:
+            break
+        index += 1
+
+
+def keyset_chunks():
+    last_id = None
+    index = 0
+    while index < MAX_CHUNKS:
+        start = time.perf_counter()
+        records = search_model_chunk(Model, [], last_id=last_id,
+            limit=CHUNK_SIZE)
+        yield time.perf_counter() - start
+        if not records:
+            break
+        last_id = records[-1].id
+        index += 1
+
+
+offset_times = list(offset_chunks())
+keyset_times = list(keyset_chunks())
+
+print(f'Model: {MODEL_NAME}')
+print(f'Chunk size: {CHUNK_SIZE}')
+print()
+print('chunk'.rjust(6), 'offset ms'.rjust(12), 'keyset ms'.rjust(12))
+print('-' * 32)
+for index, (offset_time, keyset_time) in enumerate(
+        zip(offset_times, keyset_times)):
+    if index % REPORT_EVERY:
+        continue
+    print(f'{index:6d}{offset_time * 1000:12.3f}{keyset_time * 1000:12.3f}')
+
+print()
+for name, times in (('offset', offset_times), ('keyset', keyset_times)):
+    if not times:
+        continue
+    half = max(len(times) // 2, 1)
+    first = statistics.mean(times[:half]) * 1000
+    last = statistics.mean(times[half:] or times) * 1000
+    print(f'{name}: first half {first:.3f} ms/chunk, '
+        f'second half {last:.3f} ms/chunk')
+print()
+print('Keyset latency should stay flat while offset latency grows with '
+    'the chunk position.')
@@ -13,6 +13,7 @@ from dateutil.relativedelta import relativedelta
 from simpleeval import EvalWithCompoundTypes
 
 from trytond.modules.babi.babi_eval import (
+    compile_expression,
     date,
     day,
     month,
@@ -92,9 +93,14 @@ def simpleeval_reused(evaluator, expression, obj, digits=None, ttype=None):
     return normalize(evaluator.eval(expression), digits=digits, ttype=ttype)
 
 
+def compiled_eval(function, obj, digits=None, ttype=None):
+    return normalize(function(obj), digits=digits, ttype=ttype)
+
+
 def benchmark(case, number, repeat):
     reused = EvalWithCompoundTypes(
         names={'o': case.obj}, functions=BASE_FUNCTIONS.copy())
+    compiled = compile_expression(case.expression)
 
     def run_native():
         native_eval(case.expression, case.obj, case.digits, case.ttype)
@@ -106,14 +112,19 @@ def benchmark(case, number, repeat):
         simpleeval_reused(
             reused, case.expression, case.obj, case.digits, case.ttype)
 
+    def run_compiled():
+        compiled_eval(compiled, case.obj, case.digits, case.ttype)
+
     native_times = timeit.repeat(run_native, number=number, repeat=repeat)
     fresh_times = timeit.repeat(run_fresh, number=number, repeat=repeat)
     reused_times = timeit.repeat(run_reused, number=number, repeat=repeat)
+    compiled_times = timeit.repeat(run_compiled, number=number, repeat=repeat)
 
     return {
         'native': native_times,
         'simpleeval_fresh': fresh_times,
         'simpleeval_reused': reused_times,
+        'compiled': compiled_times,
     }
 
 
@@ -161,8 +172,10 @@ def main():
         'slowdown'.rjust(10),
         'reused us/call'.rjust(18),
         'slowdown'.rjust(10),
+        'compiled us/call'.rjust(18),
+        'slowdown'.rjust(10),
     )
-    print('-' * 92)
+    print('-' * 122)
 
     for case in cases:
         timings = benchmark(case, number=number, repeat=repeat)
@@ -173,6 +186,8 @@ def main():
             timings['simpleeval_fresh'], timings['native'])
         reused_slowdown = slowdown(
             timings['simpleeval_reused'], timings['native'])
+        compiled_us = mean_us(timings['compiled'], number)
+        compiled_slowdown = slowdown(timings['compiled'], timings['native'])
         print(
             case.name.ljust(18),
             f'{native_us:14.3f}',
@@ -180,12 +195,15 @@ def main():
             f'{fresh_slowdown:10.2f}x',
             f'{reused_us:18.3f}',
             f'{reused_slowdown:10.2f}x',
+            f'{compiled_us:18.3f}',
+            f'{compiled_slowdown:10.2f}x',
         )
 
     print()
     print('Interpretation:')
-    print('- `simpleeval us/call` matches the current babi_eval pattern.')
+    print('- `simpleeval us/call` matches the previous babi_eval pattern.')
     print('- `reused us/call` isolates the evaluator engine cost if reused.')
+    print('- `compiled us/call` matches the current babi_eval pattern.')
 
 
 if __name__ == '__main__':
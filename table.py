@@ -1,7 +1,13 @@
+import ast
+import atexit
 import csv
 from collections import defaultdict
+from contextlib import closing, contextmanager, nullcontext
+import hashlib
+import json
 import multiprocessing
 import pytz
+import os
 import queue
 import time
 import traceback
@@ -14,22 +20,27 @@ import tempfile
 import html
 import urllib.parse
 import secrets
+import threading
 import psycopg
 try:
     from psycopg import ClientCursor
 except ImportError:
     ClientCursor = None
-from sql import Flavor, Literal
+from sql import Conflict, Flavor, Literal, Null
+from sql.aggregate import Max
+from sql.conditionals import NullIf
+from sql.functions import ToChar
 from sql.operators import Equal
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from types import SimpleNamespace
 from openpyxl import Workbook
 from openpyxl.writer.excel import save_workbook
-from openpyxl.cell import Cell
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 from simpleeval import EvalWithCompoundTypes
 from trytond import backend
 from trytond.bus import notify
+from trytond.cache import Cache
 from trytond.transaction import Transaction
 from trytond.pool import Pool
 from trytond.model import (Exclude, Model, ModelView, ModelSQL, fields,
@@ -45,12 +56,14 @@ from trytond.modules.company.model import (
 from trytond.report import Report
 from trytond.wizard import Wizard, StateView, StateAction, Button
 from trytond.rpc import RPC
+from trytond.tools import grouped_slice
 from trytond.tools.immutabledict import ImmutableDict
 from .babi import (
     TimeoutChecker, TimeoutException, FIELD_TYPES, QUEUE_NAME, eval_domain)
-from .babi_eval import babi_eval, babi_eval_batch
-from .cube import Cube
-from .tools import adjust_column_widths
+from .babi_eval import (
+    babi_eval, babi_eval_batch, babi_eval_columns, get_expression_paths)
+from .cube import Cube, approximate_missing_extension
+from .tools import append_rows
 
 RETENTION_DAYS = config.getint('babi', 'retention_days', default=30)
 VALID_FIRST_SYMBOLS = '_abcdefghijklmnopqrstuvwxyz'
@@ -76,6 +89,42 @@ logger = logging.getLogger(__name__)
 
 MODEL_COMPUTE_CHUNK_SIZE = config.getint('babi', 'compute_chunk_size', default=100)
 MODEL_COMPUTE_PROCESSES = config.getint('babi', 'compute_processes', default=2)
+MODEL_COMPUTE_CHUNK_MIN_SIZE = config.getint('babi', 'compute_chunk_min_size',
+    default=10)
+MODEL_COMPUTE_CHUNK_MAX_SIZE = config.getint('babi', 'compute_chunk_max_size',
+    default=10000)
+# Seconds of evaluation per chunk the adaptive chunk size aims for
+MODEL_COMPUTE_CHUNK_TIME = config.getfloat('babi', 'compute_chunk_time',
+    default=2)
+# Maximum memory growth (in MB) allowed per chunk
+MODEL_COMPUTE_CHUNK_MEMORY = config.getint('babi', 'compute_chunk_memory',
+    default=512)
+# Evaluate the expressions of a chunk column by column instead of record by
+# record
+MODEL_COMPUTE_COLUMNS = config.getboolean('babi', 'compute_columns',
+    default=True)
+# Compute jobs a pool worker runs before being replaced
+MODEL_COMPUTE_WORKER_MAX_JOBS = config.getint('babi',
+    'compute_worker_max_jobs', default=50)
+# Memory growth (in MB) after which a pool worker is replaced
+MODEL_COMPUTE_WORKER_MAX_MEMORY = config.getint('babi',
+    'compute_worker_max_memory', default=1024)
+# Total size (in MB) of the cube caches kept by the eviction cron
+CUBE_CACHE_MAX_SIZE = config.getint('babi', 'cube_cache_max_size',
+    default=10240)
+# Rows fetched at a time by the server-side cursor of table exports
+QUERY_FETCH_SIZE = config.getint('babi', 'query_fetch_size', default=2000)
+# Minimum seconds between the updates of the progress of a computation
+MODEL_COMPUTE_PROGRESS_INTERVAL = config.getfloat('babi',
+    'compute_progress_interval', default=1)
+# Column that stores the id of the source record in incremental tables
+MODEL_SOURCE_ID_COLUMN = '_babi_source_id'
+# Seconds subtracted from the high-water mark of incremental tables so the
+# records written by transactions committed after it are computed again
+MODEL_INCREMENTAL_MARGIN = config.getint('babi', 'incremental_margin',
+    default=300)
+# Measure aggregates that can be approximated
+APPROXIMATE_AGGREGATES = ['median', 'percentile', 'count_distinct']
 
 
 class ModelComputeFieldError(Exception):
@@ -87,6 +136,50 @@ class ModelComputeFieldError(Exception):
         self.error = error
 
 
+def get_memory_usage():
+    "Return the current resident memory of the process in bytes"
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class ChunkSizeController:
+    '''
+    Adapt the number of records computed per chunk from the measured time and
+    memory needed to evaluate the previous chunks: cheap expressions get
+    bigger chunks while expressions traversing many relations get smaller
+    ones.
+    '''
+    def __init__(self, size=None, target_time=MODEL_COMPUTE_CHUNK_TIME,
+            memory=MODEL_COMPUTE_CHUNK_MEMORY * 1024 * 1024,
+            min_size=MODEL_COMPUTE_CHUNK_MIN_SIZE,
+            max_size=MODEL_COMPUTE_CHUNK_MAX_SIZE):
+        self.target_time = target_time
+        self.memory = memory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = self._clamp(size or MODEL_COMPUTE_CHUNK_SIZE)
+
+    def _clamp(self, size):
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    def update(self, count, elapsed, memory=0):
+        if not count:
+            return self.size
+        size = self.size
+        if elapsed > 0:
+            size = self.target_time * count / elapsed
+        if memory > 0 and self.memory:
+            size = min(size, self.memory * count / memory)
+        # Avoid oscillations by, at most, doubling or halving the size
+        size = max(self.size / 2, min(self.size * 2, size))
+        self.size = self._clamp(size)
+        return self.size
+
+
 def drop_table_or_view(connection, table_name):
     cursor = connection.cursor()
     if backend.name != 'postgresql':
@@ -107,10 +200,29 @@ def drop_table_or_view(connection, table_name):
         cursor.execute(f'DROP TABLE IF EXISTS "{table_name}" CASCADE')
 
 
-def get_model_expression_specs(fields_):
-    return [(field.name, field.internal_name, field.expression.expression,
+def get_sql_type(ttype):
+    datetime_type = 'TIMESTAMP' if backend.name == 'postgresql' else 'DATETIME'
+    mapping = {
+        'char': 'VARCHAR',
+        'integer': 'INTEGER',
+        'float': 'FLOAT',
+        'numeric': 'NUMERIC',
+        'boolean': 'BOOLEAN',
+        'many2one': 'INTEGER',
+        'date': 'DATE',
+        'datetime': datetime_type,
+        }
+    return mapping[ttype]
+
+
+def get_model_expression_specs(fields_, source_id=False):
+    specs = [(field.name, field.internal_name, field.expression.expression,
             field.expression.ttype, field.expression.decimal_digits)
         for field in fields_]
+    if source_id:
+        specs.append((MODEL_SOURCE_ID_COLUMN, MODEL_SOURCE_ID_COLUMN, 'o.id',
+                'integer', None))
+    return specs
 
 
 def get_model_batch_specs(expression_specs):
@@ -121,33 +233,522 @@ def get_model_batch_specs(expression_specs):
     return batch_expressions, batch_digits, batch_ttypes
 
 
+def get_model_prefetch_plan(Model, expressions):
+    '''
+    Return the tree of fields of Model used by the attribute paths of
+    expressions. Paths stop at the first name that is not a field.
+    '''
+    plan = {}
+    for expression in expressions:
+        if not expression:
+            continue
+        for path in get_expression_paths(expression):
+            node = plan
+            target = Model
+            for name in path:
+                field = target._fields.get(name)
+                if field is None:
+                    break
+                node = node.setdefault(name, {})
+                if field._type not in ('many2one', 'one2many', 'many2many'):
+                    break
+                target = field.get_target()
+    return plan
+
+
+def prefetch_model_records(records, plan):
+    '''
+    Load the fields of plan for all records level by level so the related
+    records are read once per chunk instead of once per record.
+    '''
+    if not records:
+        return
+    Model = records[0].__class__
+    for name, subplan in plan.items():
+        field = Model._fields[name]
+        # Records of a chunk share their ids so the first access reads the
+        # field for all of them and the others hit the cache
+        values = [getattr(record, name) for record in records]
+        if not subplan:
+            continue
+        if field._type == 'many2one':
+            related = [x for x in values if x]
+        elif field._type in ('one2many', 'many2many'):
+            related = [x for value in values for x in value]
+        else:
+            continue
+        ids = list(dict.fromkeys(x.id for x in related if x.id >= 0))
+        # Browse with the context of the records to share their cache
+        with Transaction().set_context(records[0]._context):
+            targets = field.get_target().browse(ids)
+        prefetch_model_records(targets, subplan)
+
+
+class ExpressionSQLTranslator:
+    '''
+    Translate the BABI expressions that are paths of stored fields, like
+    "o.product.code", optionally wrapped by one of the y, ym, ymd, m and d
+    helpers, into SQL expressions over the table of Model joined with the
+    tables of the many2one fields of the path.
+
+    Only the expressions whose result can not differ from the Python
+    evaluation are translated: the many2one fields of the path must be
+    required, as Python fails on an empty relation, and the values are not
+    rounded, as the database does not round half to even.
+    '''
+    # Expression types that can be filled with the value of each field type
+    field_ttypes = {
+        'char': {'char'},
+        'text': {'char'},
+        'selection': {'char'},
+        'integer': {'integer'},
+        'float': {'float'},
+        'numeric': {'numeric'},
+        'boolean': {'boolean'},
+        'many2one': {'many2one', 'integer'},
+        'date': {'date'},
+        'datetime': {'datetime'},
+        'timestamp': {'datetime'},
+        }
+    date_formats = {
+        'y': 'YYYY',
+        'ym': 'YYYY-MM',
+        'ymd': 'YYYY-MM-DD',
+        'm': 'MM',
+        'd': 'DD',
+        }
+
+    def __init__(self, Model):
+        self.Model = Model
+        self.table = None
+        self.from_ = None
+        self.joins = {}
+        # Translated expressions by their index in the expression specs
+        self.columns = {}
+        if self._is_sql_model(Model):
+            self.table = Model.__table__()
+            self.from_ = self.table
+
+    @staticmethod
+    def _is_sql_model(Model):
+        return (issubclass(Model, ModelSQL)
+            and not callable(getattr(Model, 'table_query', None)))
+
+    def add_columns(self, expression_specs):
+        for index, (_, _, expression, ttype, digits) in enumerate(
+                expression_specs):
+            column = self.translate(expression, ttype, digits)
+            if column is not None:
+                self.columns[index] = column
+
+    def translate(self, expression, ttype, digits=None):
+        if self.table is None:
+            return
+        try:
+            node = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError:
+            return
+        date_format = None
+        if isinstance(node, ast.Call):
+            if (backend.name != 'postgresql'
+                    or not isinstance(node.func, ast.Name)
+                    or node.func.id not in self.date_formats
+                    or len(node.args) != 1
+                    or node.keywords):
+                return
+            date_format = self.date_formats[node.func.id]
+            node = node.args[0]
+
+        path = []
+        while isinstance(node, ast.Attribute):
+            path.insert(0, node.attr)
+            node = node.value
+        if not path or not isinstance(node, ast.Name) or node.id != 'o':
+            return
+
+        column, field = self._get_column(path)
+        if column is None:
+            return
+        if date_format:
+            if (field._type not in {'date', 'datetime', 'timestamp'}
+                    or ttype != 'char'):
+                return
+            return ToChar(column, date_format)
+        if ttype not in self.field_ttypes.get(field._type, set()):
+            return
+        if field._type == 'boolean':
+            # Python evaluation stores False as NULL
+            return NullIf(column, Literal(False))
+        if digits and ttype in {'numeric', 'float'}:
+            # Only the values that already have the digits are not rounded
+            field_digits = getattr(field, 'digits', None)
+            if (not isinstance(field_digits, tuple)
+                    or not isinstance(field_digits[1], int)
+                    or field_digits[1] > digits):
+                return
+        return column
+
+    def _get_column(self, path):
+        Model = self.Model
+        table = self.table
+        for index, name in enumerate(path):
+            field = Model._fields.get(name)
+            if (field is None
+                    or isinstance(field, fields.Function)
+                    or getattr(field, 'translate', False)):
+                return None, None
+            if index == len(path) - 1:
+                return sql.Column(table, name), field
+            if field._type != 'many2one' or not field.required:
+                return None, None
+            Target = field.get_target()
+            if not self._is_sql_model(Target):
+                return None, None
+            key = tuple(path[:index + 1])
+            if key not in self.joins:
+                target = Target.__table__()
+                self.from_ = self.from_.join(target, 'LEFT',
+                    condition=sql.Column(table, name) == target.id)
+                self.joins[key] = target
+            Model = Target
+            table = self.joins[key]
+        return None, None
+
+    def is_complete(self, expression_specs, python_filter=None):
+        "Return if the table can be computed only with SQL"
+        return (self.table is not None
+            and not python_filter
+            and all(i in self.columns for i in range(len(expression_specs))))
+
+    def get_python_expressions(self, expressions):
+        return [x for i, x in enumerate(expressions) if i not in self.columns]
+
+    def get_query(self, domain):
+        "Return the query of all the columns for the records matching domain"
+        return self.from_.select(
+            *[self.columns[i] for i in sorted(self.columns)],
+            where=self.table.id.in_(self.Model.search(domain, query=True)),
+            order_by=[self.table.id.asc])
+
+    def get_values(self, ids):
+        "Return the values of the columns indexed by record id"
+        cursor = Transaction().connection.cursor()
+        indexes = sorted(self.columns)
+        values = {}
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*self.from_.select(self.table.id,
+                    *[self.columns[i] for i in indexes],
+                    where=self.table.id.in_(list(sub_ids))))
+            for row in cursor:
+                values[row[0]] = dict(zip(indexes, row[1:]))
+        return values
+
+
+class _CountingCursor:
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.count += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter.count += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+
+class QueryCounter:
+    "Proxy of a database connection that counts the executed queries"
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.count = 0
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._connection.cursor(*args, **kwargs), self)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class ComputeProfiler:
+    '''
+    Accumulate the evaluation time, exceptions and queries of each expression,
+    of the prefetch of the records and of the query of the fields computed by
+    the database, and the search, evaluation and insert time of each chunk.
+    '''
+    def __init__(self, filter_name=None):
+        self.filter_name = filter_name
+        self.counter = None
+        self.expressions = {}
+        self.chunks = []
+
+    def evaluate(self, type_, name, expression, record, **kwargs):
+        with self.measure(type_, name, 1):
+            return babi_eval(expression, record, **kwargs)
+
+    def evaluate_filter(self, expression, record):
+        return self.evaluate('filter', self.filter_name, expression, record,
+            convert_none=None)
+
+    @contextmanager
+    def measure(self, type_, name, records):
+        '''
+        Accumulate the time and queries of the block for records and yield
+        the statistics of type_ and name
+        '''
+        stats = self.expressions.setdefault((type_, name), {
+                'records': 0,
+                'eval_time': 0.0,
+                'exceptions': 0,
+                'queries': 0,
+                })
+        queries = self.counter.count if self.counter else 0
+        start = time.perf_counter()
+        try:
+            yield stats
+        except Exception:
+            stats['exceptions'] += 1
+            raise
+        finally:
+            stats['eval_time'] += time.perf_counter() - start
+            stats['records'] += records
+            if self.counter:
+                stats['queries'] += self.counter.count - queries
+
+    def add_chunk(self, records, search_time=0, eval_time=0, insert_time=0):
+        self.chunks.append({
+                'records': records,
+                'search_time': search_time,
+                'eval_time': eval_time,
+                'insert_time': insert_time,
+                })
+
+    def get_logs(self):
+        logs = []
+        for (type_, name), stats in self.expressions.items():
+            logs.append(dict(stats, type=type_, name=name))
+        for index, stats in enumerate(self.chunks, 1):
+            logs.append(dict(stats, type='chunk', name=str(index)))
+        return logs
+
+
+def profile_measure(profiler, type_, name, records):
+    '''
+    Return the context that measures the block with profiler (see
+    ComputeProfiler.measure) or that does nothing without profiler
+    '''
+    if profiler:
+        return profiler.measure(type_, name, records)
+    return nullcontext({'records': records})
+
+
 def compute_model_insert_values(records, python_filter, expression_specs,
-        batch_expressions, batch_digits, batch_ttypes):
-    to_insert = []
-    for record in records:
-        if python_filter:
-            if not babi_eval(python_filter, record, convert_none=None):
-                continue
+        batch_expressions, batch_digits, batch_ttypes, prefetch_plan=None,
+        translator=None, profiler=None):
+    if prefetch_plan:
+        with profile_measure(profiler, 'prefetch', None, len(records)):
+            prefetch_model_records(records, prefetch_plan)
+    sql_values = None
+    if translator and translator.columns:
+        # Only the expressions that could not be translated to SQL are
+        # evaluated in python
+        # The translated fields are computed by a single query
+        name = ', '.join(expression_specs[i][0]
+            for i in sorted(translator.columns))
+        with profile_measure(profiler, 'sql', name, len(records)):
+            sql_values = translator.get_values([x.id for x in records])
+        indexes = [i for i in range(len(expression_specs))
+            if i not in translator.columns]
+        expression_specs = [expression_specs[i] for i in indexes]
+        batch_expressions = [batch_expressions[i] for i in indexes]
+        batch_digits = [batch_digits[i] for i in indexes]
+        batch_ttypes = [batch_ttypes[i] for i in indexes]
+    if python_filter:
+        if profiler:
+            records = [x for x in records
+                if profiler.evaluate_filter(python_filter, x)]
+        else:
+            records = [x for x in records
+                if babi_eval(python_filter, x, convert_none=None)]
+
+    rows = None
+    if profiler:
+        # Each field is evaluated on its own to measure it
+        rows = [compute_model_profiled_values(record, expression_specs,
+                profiler) for record in records]
+    elif MODEL_COMPUTE_COLUMNS and records:
         try:
-            values = list(babi_eval_batch(
-                    batch_expressions,
-                    record,
-                    convert_none=None,
-                    digits=batch_digits,
-                    ttypes=batch_ttypes))
-        except Exception as batch_message:
-            for field_name, _, expression, ttype, digits in expression_specs:
-                try:
-                    babi_eval(expression, record, convert_none=None,
-                        digits=digits, ttype=ttype)
-                except Exception as message:
-                    raise ModelComputeFieldError(field_name, record.id,
-                        repr(message)) from message
-            raise batch_message
+            rows = list(zip(*babi_eval_columns(batch_expressions, records,
+                        convert_none=None, digits=batch_digits,
+                        ttypes=batch_ttypes)))
+        except Exception:
+            # Evaluate record by record to find the failing field
+            rows = None
+        if rows is not None and not batch_expressions:
+            rows = [()] * len(records)
+
+    to_insert = []
+    for index, record in enumerate(records):
+        if rows is not None:
+            values = list(rows[index])
+        else:
+            values = compute_model_record_values(record, expression_specs,
+                batch_expressions, batch_digits, batch_ttypes)
+        if sql_values is not None:
+            record_values = sql_values[record.id]
+            python_values = iter(values)
+            values = [record_values[i] if i in record_values
+                else next(python_values)
+                for i in range(len(translator.columns) + len(values))]
         to_insert.append(values)
     return to_insert
 
 
+def compute_model_profiled_values(record, expression_specs, profiler):
+    values = []
+    for field_name, _, expression, ttype, digits in expression_specs:
+        try:
+            values.append(profiler.evaluate('field', field_name, expression,
+                    record, convert_none=None, digits=digits, ttype=ttype))
+        except Exception as message:
+            raise ModelComputeFieldError(field_name, record.id,
+                repr(message)) from message
+    return values
+
+
+def compute_model_record_values(record, expression_specs, batch_expressions,
+        batch_digits, batch_ttypes):
+    try:
+        return list(babi_eval_batch(
+                batch_expressions,
+                record,
+                convert_none=None,
+                digits=batch_digits,
+                ttypes=batch_ttypes))
+    except Exception as batch_message:
+        for field_name, _, expression, ttype, digits in expression_specs:
+            try:
+                babi_eval(expression, record, convert_none=None,
+                    digits=digits, ttype=ttype)
+            except Exception as message:
+                raise ModelComputeFieldError(field_name, record.id,
+                    repr(message)) from message
+        raise batch_message
+
+
+def _copy_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _copy_integer(value):
+    # Round like PostgreSQL does when the value is inserted in an integer
+    # column: half to even for floats and half away from zero for numerics
+    if isinstance(value, float):
+        return int(round(value))
+    if isinstance(value, Decimal):
+        return int(value.to_integral_value(rounding=ROUND_HALF_UP))
+    return int(value)
+
+
+def _copy_numeric(value):
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+# Column types that are streamed with binary COPY and the conversion that
+# ensures the value matches the binary format expected by PostgreSQL
+COPY_BINARY_TYPES = {
+    'integer': ('int4', _copy_integer),
+    'many2one': ('int4', _copy_integer),
+    'float': ('float8', float),
+    'numeric': ('numeric', _copy_numeric),
+    'date': ('date', _copy_date),
+    }
+
+
+def insert_model_values(cursor, table_name, internal_names, ttypes,
+        values):
+    if not values:
+        return
+    if backend.name != 'postgresql' or not hasattr(cursor, 'copy'):
+        table = sql.Table(table_name)
+        columns = [sql.Column(table, name) for name in internal_names]
+        cursor.execute(*table.insert(columns=columns, values=values))
+        return
+
+    # Stream rows with COPY instead of a huge multi-row INSERT. Binary format
+    # is only used when all columns have a type with a safe conversion.
+    columns = ', '.join('"%s"' % name for name in internal_names)
+    query = f'COPY "{table_name}" ({columns}) FROM STDIN'
+    binary = all(ttype in COPY_BINARY_TYPES for ttype in ttypes)
+    if binary:
+        query += ' (FORMAT BINARY)'
+        converters = [COPY_BINARY_TYPES[ttype][1] for ttype in ttypes]
+    with cursor.copy(query) as copy:
+        if binary:
+            copy.set_types([COPY_BINARY_TYPES[ttype][0] for ttype in ttypes])
+            for row in values:
+                copy.write_row([None if value is None else convert(value)
+                        for convert, value in zip(converters, row)])
+        else:
+            for row in values:
+                copy.write_row(row)
+
+
+def search_model_chunk(Model, domain, last_id=None,
+        limit=MODEL_COMPUTE_CHUNK_SIZE):
+    # Keyset pagination: start right after the last id of the previous chunk
+    # so every chunk costs the same no matter its position, unlike OFFSET
+    # which rescans all the preceding rows.
+    if last_id is not None:
+        domain = [domain, ('id', '>', last_id)]
+    return Model.search(domain, limit=limit, order=[('id', 'ASC')])
+
+
+def search_model_id_range(Model, domain, min_id, max_id):
+    return Model.search([domain,
+            ('id', '>=', min_id),
+            ('id', '<=', max_id),
+            ], order=[('id', 'ASC')])
+
+
+def get_model_id_ranges(Model, domain, size=MODEL_COMPUTE_CHUNK_SIZE):
+    '''
+    Scan the ids matching domain once and split them in contiguous
+    (min_id, max_id) ranges of at most size records.
+    '''
+    cursor = Transaction().connection.cursor()
+    cursor.execute(*Model.search(domain, order=[('id', 'ASC')], query=True))
+    ranges = []
+    while True:
+        ids = [x[0] for x in cursor.fetchmany(size)]
+        if not ids:
+            break
+        ranges.append((ids[0], ids[-1]))
+    return ranges
+
+
 def ensure_pool(database_name):
     database_list = Pool.database_list()
     pool = Pool(database_name)
@@ -199,68 +800,218 @@ def import_snapshot_transaction(database_name, user, context, snapshot_id,
     transaction._locked_tables = set()
     transaction._locked_records = defaultdict(set)
     transaction.connection = connection
+    # Like Transaction.start, drop the cached values invalidated by other
+    # processes since the worker computed its previous job
+    Cache.sync(transaction)
     return transaction
 
 
-def compute_model_worker(database_name, user, context, snapshot_id,
-        model_name, domain, table_name, internal_names, expression_specs,
-        python_filter, timeout, input_queue,
-        result_queue):
+def compute_model_worker(job, range_queue, result_queue):
+    '''
+    Compute the id ranges of job until a None range is received and return
+    the message that ends the job.
+    '''
+    job_id = job['id']
+    model_name = job['model_name']
+    domain = job['domain']
+    table_name = job['table_name']
+    internal_names = job['internal_names']
+    expression_specs = job['expression_specs']
+    python_filter = job['python_filter']
     transaction = None
     try:
-        pool = ensure_pool(database_name)
+        pool = ensure_pool(job['database_name'])
         Model = pool.get(model_name)
-        table = sql.Table(table_name)
-        columns = [sql.Column(table, name) for name in internal_names]
         batch_expressions, batch_digits, batch_ttypes = get_model_batch_specs(
             expression_specs)
-        transaction = import_snapshot_transaction(database_name, user,
-            context, snapshot_id, timeout=timeout)
+        translator = ExpressionSQLTranslator(Model)
+        translator.add_columns(expression_specs)
+        prefetch_plan = get_model_prefetch_plan(Model,
+            [python_filter] + translator.get_python_expressions(
+                batch_expressions))
+        transaction = import_snapshot_transaction(job['database_name'],
+            job['user'], job['context'], job['snapshot_id'],
+            timeout=job['timeout'])
         count = 0
         while True:
-            chunk_index = input_queue.get()
-            if chunk_index is None:
+            id_range = range_queue.get()
+            if id_range is None:
                 break
-            offset = chunk_index * MODEL_COMPUTE_CHUNK_SIZE
-            records = Model.search(domain, offset=offset,
-                limit=MODEL_COMPUTE_CHUNK_SIZE, order=[('id', 'ASC')])
+            min_id, max_id = id_range
+            records = search_model_id_range(Model, domain, min_id, max_id)
+            start = time.monotonic()
+            memory = get_memory_usage()
             to_insert = compute_model_insert_values(records, python_filter,
                 expression_specs, batch_expressions, batch_digits,
-                batch_ttypes)
+                batch_ttypes, prefetch_plan=prefetch_plan,
+                translator=translator)
+            elapsed = time.monotonic() - start
+            memory = get_memory_usage() - memory
             if to_insert:
                 cursor = transaction.connection.cursor()
                 try:
-                    cursor.execute(*table.insert(columns=columns,
-                            values=to_insert))
+                    insert_model_values(cursor, table_name, internal_names,
+                        batch_ttypes, to_insert)
                 finally:
                     cursor.close()
             count += len(records)
             result_queue.put({
                     'type': 'progress',
+                    'job': job_id,
                     'count': len(records),
                     'inserted': len(to_insert),
-                    'chunk_index': chunk_index,
+                    'id_range': id_range,
+                    'elapsed': elapsed,
+                    'memory': memory,
                     })
         transaction.stop(True)
         transaction = None
-        result_queue.put({'type': 'done', 'count': count})
+        return {'type': 'done', 'job': job_id, 'count': count}
     except ModelComputeFieldError as error:
         if transaction:
             transaction.stop(False)
-        result_queue.put({
-                'type': 'field_error',
-                'field_name': error.field_name,
-                'record_id': error.record_id,
-                'error': error.error,
-                })
+        return {
+            'type': 'field_error',
+            'job': job_id,
+            'field_name': error.field_name,
+            'record_id': error.record_id,
+            'error': error.error,
+            }
     except Exception as error:
         if transaction:
             transaction.stop(False)
-        result_queue.put({
-                'type': 'error',
-                'error': repr(error),
-                'traceback': traceback.format_exc(),
-                })
+        return {
+            'type': 'error',
+            'job': job_id,
+            'error': repr(error),
+            'traceback': traceback.format_exc(),
+            }
+
+
+def compute_model_pool_worker(index, job_queue, range_queue, result_queue,
+        database_names, max_jobs, max_memory):
+    '''
+    Run the compute jobs received from job_queue until None is received or
+    the worker must be recycled.
+    '''
+    # Initialize the pools before the first job arrives
+    for database_name in database_names:
+        try:
+            ensure_pool(database_name)
+        except Exception:
+            logger.warning('Could not initialize pool of %s', database_name,
+                exc_info=True)
+    memory = get_memory_usage()
+    jobs = 0
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        result = compute_model_worker(job, range_queue, result_queue)
+        jobs += 1
+        recycle = (jobs >= max_jobs
+            or get_memory_usage() - memory > max_memory * 1024 * 1024)
+        result_queue.put(dict(result, worker=index, recycle=recycle))
+        if recycle:
+            break
+
+
+class ComputeWorkerPool:
+    '''
+    Long-lived processes that compute the chunks of model tables.
+
+    Workers keep the Pool of every database they have computed so following
+    computations do not pay the initialization again. A worker is replaced
+    after a number of jobs or when its memory grows too much.
+    '''
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, size=MODEL_COMPUTE_PROCESSES,
+            max_jobs=MODEL_COMPUTE_WORKER_MAX_JOBS,
+            max_memory=MODEL_COMPUTE_WORKER_MAX_MEMORY):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()
+        self.databases = set()
+        self.workers = [None] * size
+        self._create_queues()
+
+    @classmethod
+    def get(cls):
+        "Return the pool of the current process"
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                atexit.register(cls._instance.shutdown)
+            return cls._instance
+
+    def _create_queues(self):
+        self.range_queue = self.mp_context.Queue()
+        self.result_queue = self.mp_context.Queue()
+
+    @property
+    def processes(self):
+        return [x[0] for x in self.workers if x]
+
+    def _spawn(self, index):
+        job_queue = self.mp_context.Queue()
+        process = self.mp_context.Process(
+            target=compute_model_pool_worker,
+            args=(index, job_queue, self.range_queue, self.result_queue,
+                sorted(self.databases), self.max_jobs, self.max_memory),
+            daemon=True)
+        process.start()
+        self.workers[index] = (process, job_queue)
+
+    def replace(self, index):
+        "Replace the worker at index which is exiting by itself"
+        process, _ = self.workers[index]
+        process.join()
+        self._spawn(index)
+
+    def start(self, database_name):
+        "Ensure all workers are running and warm the pool of database_name"
+        self.databases.add(database_name)
+        for index, worker in enumerate(self.workers):
+            if worker and worker[0].is_alive():
+                continue
+            if worker:
+                worker[0].join()
+            self._spawn(index)
+
+    def submit(self, job, id_ranges):
+        for _, job_queue in self.workers:
+            job_queue.put(job)
+        for id_range in id_ranges:
+            self.range_queue.put(id_range)
+        for _ in self.workers:
+            self.range_queue.put(None)
+
+    def get_result(self, job_id, timeout=1):
+        "Return the next message of job or None if there is none yet"
+        while True:
+            try:
+                result = self.result_queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if result.get('job') == job_id:
+                return result
+
+    def shutdown(self):
+        "Stop all workers and discard the pending messages"
+        for worker in self.workers:
+            if not worker:
+                continue
+            process, _ = worker
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.workers = [None] * self.size
+        self._create_queues()
+
 
 def save_virtual_workbook(workbook):
     with tempfile.NamedTemporaryFile() as tmp:
@@ -712,6 +1463,32 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
     calculation_date = fields.DateTime('Date of calculation', readonly=True)
     calculation_time = fields.Float('Time taken to calculate (in seconds)',
         digits=(16, 6), readonly=True)
+    compute_progress = fields.Function(fields.Float('Compute Progress',
+            digits=(16, 2), help='Percentage of the records of the last '
+            'computation already computed, if it is known.'),
+        'get_compute_progress')
+    compute_chunk_size = fields.Integer('Compute Chunk Size', readonly=True,
+        help='Number of records computed per chunk, adapted on each '
+        'computation from the time and memory needed to evaluate the fields.')
+    incremental = fields.Boolean('Incremental', states={
+            'invisible': Eval('type') != 'model',
+            }, help='Only recompute the records created or modified since the '
+        'last calculation. Changes in related records are not detected so '
+        'expressions must only depend on the fields of the record itself.')
+    incremental_date = fields.DateTime('Incremental Date', readonly=True,
+        states={
+            'invisible': ~Eval('incremental'),
+            }, help='Last creation or modification date of the records '
+        'included in the last calculation.')
+    incremental_signature = fields.Char('Incremental Signature', readonly=True)
+    profile = fields.Boolean('Profile', states={
+            'invisible': Eval('type') != 'model',
+            }, help='Record the evaluation time, exceptions and queries of '
+        'each field and the timing of each chunk in the next calculation. '
+        'Fields are evaluated one by one in a single process so the '
+        'calculation is slower.')
+    compute_logs = fields.One2Many('babi.table.compute_log', 'table',
+        'Compute Logs', readonly=True)
     last_warning_execution = fields.DateTime('Last Warning Execution',
         readonly=True)
     related_field = fields.Many2One('babi.field', 'Related Field', domain=[
@@ -907,6 +1684,9 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         default.setdefault('internal_name', lambda x: (
                 convert_to_symbol(x['name'] + f' ({now})')))
         default.setdefault('pivots')
+        default.setdefault('incremental_date')
+        default.setdefault('incremental_signature')
+        default.setdefault('compute_logs')
         default.setdefault('related_field')
         default.setdefault('user_field')
         default.setdefault('employee_field')
@@ -1046,22 +1826,27 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         return res
 
     def get_records(self, where=None):
-        table = []
+        '''
+        Yield the labels of the visible fields followed by the records, which
+        are read while they are consumed (see iter_query)
+        '''
         fields = [x.internal_name for x in self.fields_ if x.show]
         labels = [x.name for x in self.fields_ if x.show]
-        table.append(labels)
+        yield labels
         try:
-            table += self.execute_query(fields=fields, where=where)
+            # Close the transaction and cursor of the query even if the
+            # records are not all consumed
+            records = self.iter_query(fields=fields, where=where)
+            with closing(records):
+                yield from records
         except Exception as e:
             raise UserError(gettext('babi.msg_error_obtaining_records',
                     table=self.rec_name, error=str(e)))
-        return table
 
     def get_object_records(self):
-        records = self.get_records()
-        fields = records[0]
-        records = records[1:]
-        return [SimpleNamespace(**dict(zip(fields, x))) for x in records]
+        with closing(self.get_records()) as records:
+            fields = next(records)
+            return [SimpleNamespace(**dict(zip(fields, x))) for x in records]
 
     def get_html(self, where=None, limit=None, wait=True):
         start = time.time()
@@ -1226,15 +2011,15 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
     @ModelView.button
     def csv(cls, tables):
         for table in tables:
-            try:
-                records = table.execute_query()
-            except Exception as e:
-                raise UserError(gettext('babi.msg_table_csv_error',
-                        table=table.rec_name, error=str(e)))
             filename = table.internal_name + '.csv'
             with open(filename, 'w', newline='') as csvfile:
                 writer = csv.writer(csvfile)
-                writer.writerows(records)
+                try:
+                    with closing(table.iter_query()) as records:
+                        writer.writerows(records)
+                except Exception as e:
+                    raise UserError(gettext('babi.msg_table_csv_error',
+                            table=table.rec_name, error=str(e)))
 
     @classmethod
     @ModelView.button
@@ -1244,11 +2029,7 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         Action = pool.get('ir.action')
 
         for table in tables:
-            if ((table.filter and table.filter.parameters
-                    and not table.parameters)
-                    or (table.type in ('table', 'view')
-                        and table.query_parameters
-                        and not table.parameters)):
+            if table.needs_parameters():
                 if len(tables) > 1:
                     raise UserError(gettext('babi.msg_table_parametrize',
                             table=table.rec_name))
@@ -1266,13 +2047,108 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
                 values = Action(action_id).get_action_value()
                 return values
 
+        cls.enqueue_compute(tables)
+
+    def needs_parameters(self):
+        "Return True if the table can not be computed without parameters"
+        return bool((self.filter and self.filter.parameters
+                and not self.parameters)
+            or (self.type in ('table', 'view')
+                and self.query_parameters
+                and not self.parameters))
+
+    @classmethod
+    def enqueue_compute(cls, tables):
+        '''
+        Queue the computation of the active tables and return the id of the
+        task of each table
+        '''
+        pool = Pool()
+        ComputeProgress = pool.get('babi.table.compute_progress')
+
+        for table in tables:
+            if table.needs_parameters():
+                raise UserError(gettext('babi.msg_table_parametrize',
+                        table=table.rec_name))
+
+        jobs = {}
         with Transaction().set_context(queue_name=QUEUE_NAME):
             for table in tables:
                 if not table.active:
                     continue
                 table.cluster_date = None
-                cls.__queue__._compute(table)
+                jobs[table.id] = cls.__queue__._compute(table)
             cls.save(tables)
+        with Transaction().set_context(_check_access=False):
+            ComputeProgress.delete(ComputeProgress.search([
+                        ('table', 'in', [x.id for x in tables]),
+                        ]))
+        return jobs
+
+    def get_compute_state(self, task_id):
+        '''
+        Return the state of the task task_id of the queue that computes the
+        table: 'queued', 'computing', 'failed' or 'done'. The tasks that do
+        not compute the table or that were cleaned from the queue are 'done'.
+        '''
+        pool = Pool()
+        Queue = pool.get('ir.queue')
+        Error = pool.get('ir.error')
+
+        with Transaction().set_context(_check_access=False):
+            tasks = Queue.search([('id', '=', task_id)], limit=1)
+            if not tasks:
+                return 'done'
+            task, = tasks
+            if (task.data.get('model') != self.__name__
+                    or task.data.get('method') != '_compute'
+                    or task.data.get('instances') != self.id):
+                return 'done'
+            if task.finished_at:
+                return 'done'
+            if not task.dequeued_at:
+                return 'queued'
+            # The worker reports user errors and pushes the task again once
+            # it has exhausted the retries of the database errors
+            if Error.search([('origin', '=', str(task))], limit=1):
+                return 'failed'
+            if any(x.data == task.data for x in Queue.search([
+                            ('name', '=', task.name),
+                            ('id', '>', task.id),
+                            ])):
+                return 'failed'
+        return 'computing'
+
+    def set_compute_progress(self, progress):
+        '''
+        Record the progress of the running computation in its own transaction
+        so it can be read while the table is computed
+        '''
+        pool = Pool()
+        ComputeProgress = pool.get('babi.table.compute_progress')
+        # The progress is kept out of the babi.table record, which is saved
+        # by the computation at the end
+        with Transaction().new_transaction():
+            records = ComputeProgress.search([('table', '=', self.id)])
+            if records:
+                ComputeProgress.write(records, {'progress': progress})
+            else:
+                ComputeProgress.create([{
+                            'table': self.id,
+                            'progress': progress,
+                            }])
+
+    @classmethod
+    def get_compute_progress(cls, tables, name):
+        pool = Pool()
+        ComputeProgress = pool.get('babi.table.compute_progress')
+        result = dict.fromkeys([x.id for x in tables])
+        for sub_tables in grouped_slice(tables):
+            for record in ComputeProgress.search([
+                        ('table', 'in', [x.id for x in sub_tables]),
+                        ]):
+                result[record.table.id] = record.progress
+        return result
 
     def get_cluster(self, tables=None):
         if tables is None:
@@ -1368,6 +2244,10 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         query = 'SELECT '
         # Add double quotes if fields don't have them
         fields = [x if '"' in x else f'"{x}"' for x in fields or []]
+        if not fields and self.type == 'model':
+            # Do not return the internal columns like the source id of
+            # incremental tables
+            fields = [f'"{x.internal_name}"' for x in self.fields_]
         if fields:
             query += ', '.join(fields) + ' '
         else:
@@ -1384,20 +2264,55 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         if groupby:
             query += 'GROUP BY %s ' % ', '.join(groupby) + ' '
 
-        if fields:
-            query += 'ORDER BY %s' % ', '.join(fields)
+        order = self.get_query_order(fields)
+        if order:
+            query += 'ORDER BY %s' % ', '.join(order)
 
         if limit:
             query += ' LIMIT %d' % limit
         return query
 
-    def execute_query(self, fields=None, where=None, groupby=None, timeout=None,
+    def get_query_order(self, fields):
+        '''
+        Return the ORDER BY items of a query on the quoted fields. Model tables
+        are sorted first by the order and descending options of their fields,
+        keeping the records with an empty value first.
+        '''
+        sort_key = []
+        if self.type == 'model':
+            headers = fields or [f'"{x.internal_name}"' for x in self.fields_]
+            for field in self.fields_:
+                name = f'"{field.internal_name}"'
+                if not field.order or name not in headers:
+                    continue
+                sort_key.append((field.order, headers.index(name),
+                        field.descending or False))
+            sort_key.sort()
+        order = []
+        for _, index, descending in sort_key:
+            if descending:
+                order.append(f'{headers[index]} DESC NULLS LAST')
+            else:
+                order.append(f'{headers[index]} ASC NULLS FIRST')
+        return order + list(fields)
+
+    def iter_query(self, fields=None, where=None, groupby=None, timeout=None,
             limit=None, wait=True):
+        '''
+        Yield the records of the query as they are read from the database so
+        that exports do not need to load the whole table in memory. On
+        PostgreSQL a server-side cursor fetches them in batches of
+        QUERY_FETCH_SIZE records.
+
+        Records are read in a new transaction that is only closed once the
+        generator is exhausted or closed, so callers that may not consume all
+        the records must close it, for example with contextlib.closing.
+        '''
         if (self.type != 'view'
                 and not backend.TableHandler.table_exist(self.table_name)):
-            return []
+            return
         if fields == []:
-            return []
+            return
         with Transaction().new_transaction() as transaction:
             cursor = transaction.connection.cursor()
             if not wait and backend.name == 'postgresql':
@@ -1411,34 +2326,18 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
             self._set_statement_timeout(timeout)
             query = self.get_query(fields, where=where, groupby=groupby,
                 limit=limit)
+            if backend.name == 'postgresql':
+                cursor = transaction.connection.cursor('babi_query')
+                cursor.itersize = QUERY_FETCH_SIZE
             cursor.execute(query)
-            records = cursor.fetchall()
+            yield from cursor
+            cursor.close()
             self._reset_statement_timeout()
-        if self.type == 'model':
-            # Sort records based on the order and descending fields from fields_
-            headers = fields
-            if not headers:
-                headers = [x.internal_name for x in self.fields_]
-            sort_key = []
-            for field in self.fields_:
-                if not field.order:
-                    continue
-                if not field.internal_name in headers:
-                    continue
-                sort_key.append((field.order,
-                        headers.index(field.internal_name),
-                        field.descending or False))
-            sort_key.sort()
-            if sort_key:
-                # Sort on reverse order taking advantage of the stability of
-                # the sort method
-                for item in reversed(sort_key):
-                    # En order to ensure sort does not raise an exception
-                    # when the field is None, we sort first by the presence
-                    # of None and then by the field value
-                    records.sort(key=lambda x: (x[item[1]] is not None,
-                        x[item[1]]), reverse=item[2])
-        return records
+
+    def execute_query(self, fields=None, where=None, groupby=None, timeout=None,
+            limit=None, wait=True):
+        return list(self.iter_query(fields=fields, where=where,
+                groupby=groupby, timeout=timeout, limit=limit, wait=wait))
 
     def timeout_exception(self):
         raise TimeoutException
@@ -1491,9 +2390,26 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         self.calculation_time = round(end_time - start_time,
             self.__class__.calculation_time.digits[1])
         self.save()
+        with Transaction().set_context(queue_name=QUEUE_NAME):
+            self.__class__.__queue__.compute_pivots(self)
         if compute_warnings:
             self.__class__.__queue__.compute_warnings(self)
 
+    def compute_pivots(self):
+        "Create the cube cache of the saved pivots of the table"
+        for pivot in self.pivots:
+            if not pivot.active:
+                continue
+            cube = pivot.get_cube()
+            if not cube or not cube.measures:
+                continue
+            try:
+                cube.precompute()
+            except Exception:
+                # The cube is computed when the pivot is opened anyway
+                logger.warning('Could not precompute pivot %s of %s',
+                    pivot.id, self.rec_name, exc_info=True)
+
     def compute_warnings(self):
         pool = Pool()
         Warning = pool.get('babi.warning')
@@ -1666,12 +2582,13 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         field_names = [x[0] for x in cursor.description]
         self.update_fields(field_names)
 
-    def _create_model_compute_table(self, table_name, connection):
+    def _create_model_compute_table(self, table_name, connection,
+            expression_specs):
         drop_table_or_view(connection, table_name)
         cursor = connection.cursor()
         fields = []
-        for field in self.fields_:
-            fields.append('"%s" %s' % (field.internal_name, field.sql_type()))
+        for _, internal_name, _, ttype, _ in expression_specs:
+            fields.append('"%s" %s' % (internal_name, get_sql_type(ttype)))
         cursor.execute('CREATE TABLE "%s" (%s);' % (
                 table_name, ', '.join(fields)))
 
@@ -1705,140 +2622,297 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
                     f'Worker exited with code {process.exitcode}')
 
     def _compute_model_sequential(self, Model, domain, context,
-            expression_specs, python_filter):
+            expression_specs, python_filter, chunk_size, translator,
+            profiler=None):
         with Transaction().new_transaction() as transaction:
-            cursor = transaction.connection.cursor()
             self._create_model_compute_table(self.table_name,
-                transaction.connection)
+                transaction.connection, expression_specs)
+            self._insert_model_records(transaction.connection, Model, domain,
+                context, expression_specs, python_filter, chunk_size,
+                translator, profiler=profiler)
+
+    def _insert_model_query(self, connection, domain, context,
+            expression_specs, translator, profiler=None):
+        table = sql.Table(self.table_name)
+        columns = [sql.Column(table, x[1]) for x in expression_specs]
+        checker = TimeoutChecker(self.timeout, self.timeout_exception)
+        with Transaction().set_context(context):
+            try:
+                query = translator.get_query(domain)
+            except Exception as message:
+                self._handle_model_compute_general_error(repr(message))
+        cursor = connection.cursor()
+        self._set_statement_timeout(connection=connection)
+        name = ', '.join(x[0] for x in expression_specs)
+        with profile_measure(profiler, 'sql', name, 0) as stats:
+            cursor.execute(*table.insert(columns=columns, values=query))
+            stats['records'] += cursor.rowcount
+        self._reset_statement_timeout(connection=connection)
+        if profiler:
+            profiler.add_chunk(cursor.rowcount, insert_time=checker.elapsed)
+        logger.info('Calculated %s with SQL in %s seconds'
+            % (self.model.name, checker.elapsed))
+
+    def _insert_model_records(self, connection, Model, domain, context,
+            expression_specs, python_filter, chunk_size, translator,
+            profiler=None):
+        if translator.is_complete(expression_specs, python_filter):
+            self._insert_model_query(connection, domain, context,
+                expression_specs, translator, profiler=profiler)
+            return
 
-            checker = TimeoutChecker(self.timeout, self.timeout_exception)
-            batch_expressions, batch_digits, batch_ttypes = (
-                get_model_batch_specs(expression_specs))
-            index = 0
-            count = 0
+        transaction = Transaction()
+        if profiler:
+            # Count the queries triggered by the evaluation of each field
+            profiler.counter = QueryCounter(transaction.connection)
+            transaction.connection = profiler.counter
+        try:
+            self._insert_model_chunks(connection, Model, domain, context,
+                expression_specs, python_filter, chunk_size, translator,
+                profiler)
+        finally:
+            if profiler:
+                transaction.connection = profiler.counter._connection
+                profiler.counter = None
 
-            with Transaction().set_context(**context):
-                try:
-                    records = Model.search(domain,
-                        offset=index * MODEL_COMPUTE_CHUNK_SIZE,
-                        limit=MODEL_COMPUTE_CHUNK_SIZE,
-                        order=[('id', 'ASC')])
-                except Exception as message:
-                    self._handle_model_compute_general_error(repr(message))
+    def _insert_model_chunks(self, connection, Model, domain, context,
+            expression_specs, python_filter, chunk_size, translator,
+            profiler):
+        cursor = connection.cursor()
+        checker = TimeoutChecker(self.timeout, self.timeout_exception)
+        batch_expressions, batch_digits, batch_ttypes = (
+            get_model_batch_specs(expression_specs))
+        prefetch_plan = get_model_prefetch_plan(Model,
+            [python_filter] + translator.get_python_expressions(
+                batch_expressions))
+        internal_names = [x[1] for x in expression_specs]
+        count = 0
+
+        search_start = time.perf_counter()
+        with Transaction().set_context(context,
+                _record_cache_size=chunk_size.size):
+            try:
+                total = Model.search_count(domain)
+                records = search_model_chunk(Model, domain,
+                    limit=chunk_size.size)
+            except Exception as message:
+                self._handle_model_compute_general_error(repr(message))
+        search_time = time.perf_counter() - search_start
+        progress_time = time.monotonic()
+
+        while records:
+            checker.check()
+            logger.info('Calculated %s, %s records in %s seconds'
+                % (self.model.name, count, checker.elapsed))
+
+            start = time.monotonic()
+            memory = get_memory_usage()
+            try:
+                to_insert = compute_model_insert_values(records,
+                    python_filter, expression_specs, batch_expressions,
+                    batch_digits, batch_ttypes, prefetch_plan=prefetch_plan,
+                    translator=translator, profiler=profiler)
+            except ModelComputeFieldError as error:
+                self._handle_model_compute_field_error(error)
+            eval_time = time.monotonic() - start
+            chunk_size.update(len(records), eval_time,
+                get_memory_usage() - memory)
+            insert_start = time.perf_counter()
+            insert_model_values(cursor, self.table_name, internal_names,
+                batch_ttypes, to_insert)
+            if profiler:
+                profiler.add_chunk(len(records), search_time, eval_time,
+                    time.perf_counter() - insert_start)
 
-            table = sql.Table(self.table_name)
-            columns = [sql.Column(table, x.internal_name) for x in self.fields_]
+            count += len(records)
+            if (total and time.monotonic() - progress_time
+                    >= MODEL_COMPUTE_PROGRESS_INTERVAL):
+                self.set_compute_progress(min(100 * count / total, 100))
+                progress_time = time.monotonic()
+            search_start = time.perf_counter()
+            with Transaction().set_context(context,
+                    _record_cache_size=chunk_size.size):
+                records = search_model_chunk(Model, domain,
+                    last_id=records[-1].id, limit=chunk_size.size)
+            search_time = time.perf_counter() - search_start
 
-            while records:
-                checker.check()
-                logger.info('Calculated %s, %s records in %s seconds'
-                    % (self.model.name, count, checker.elapsed))
+        logger.info('Calculated %s, %s records in %s seconds'
+            % (self.model.name, count, checker.elapsed))
 
+    def _compute_model_incremental(self, Model, domain, context,
+            expression_specs, python_filter, chunk_size, translator, since,
+            profiler=None):
+        '''
+        Update the table only with the records created or modified since the
+        previous computation and remove the rows of deleted records.
+        '''
+        changed_domain = ['OR',
+            ('create_date', '>=', since),
+            ('write_date', '>=', since),
+            ]
+        table = sql.Table(self.table_name)
+        source_id = sql.Column(table, MODEL_SOURCE_ID_COLUMN)
+        model_table = Model.__table__()
+        with Transaction().new_transaction() as transaction:
+            cursor = transaction.connection.cursor()
+            cursor.execute(*table.delete(
+                    where=~source_id.in_(model_table.select(model_table.id))))
+
+            # Modified records may no longer match the filter so their rows
+            # are always removed before inserting the recomputed ones
+            with Transaction().set_context(context):
                 try:
-                    to_insert = compute_model_insert_values(records,
-                        python_filter, expression_specs, batch_expressions,
-                        batch_digits, batch_ttypes)
-                except ModelComputeFieldError as error:
-                    self._handle_model_compute_field_error(error)
-                if to_insert:
-                    cursor.execute(*table.insert(columns=columns,
-                            values=to_insert))
-
-                index += 1
-                count += len(records)
-                with Transaction().set_context(**context):
-                    records = Model.search(domain,
-                        offset=index * MODEL_COMPUTE_CHUNK_SIZE,
-                        limit=MODEL_COMPUTE_CHUNK_SIZE,
+                    changed = Model.search(changed_domain,
                         order=[('id', 'ASC')])
+                except Exception as message:
+                    self._handle_model_compute_general_error(repr(message))
+            for sub_ids in grouped_slice([x.id for x in changed]):
+                cursor.execute(*table.delete(
+                        where=source_id.in_(list(sub_ids))))
 
-        logger.info('Calculated %s, %s records in %s seconds'
-            % (self.model.name, count, checker.elapsed))
+            self._insert_model_records(transaction.connection, Model,
+                [domain, changed_domain], context, expression_specs,
+                python_filter, chunk_size, translator, profiler=profiler)
+
+    def _create_model_source_id_index(self):
+        with Transaction().new_transaction() as transaction:
+            cursor = transaction.connection.cursor()
+            cursor.execute('CREATE INDEX "%s_source_id_index" ON "%s" ("%s")'
+                % (self.table_name, self.table_name, MODEL_SOURCE_ID_COLUMN))
+
+    def get_model_high_water_mark(self, Model):
+        '''
+        Return the date from which the records of Model must be computed
+        again on the next incremental computation.
+
+        It is the last create or write date of the records but no later than
+        the start of the oldest transaction still running, whose writes are
+        not visible yet, minus MODEL_INCREMENTAL_MARGIN seconds.
+        '''
+        table = Model.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(
+                Max(table.create_date), Max(table.write_date)))
+        dates = [x for x in cursor.fetchone() if x]
+        if not dates:
+            return
+        mark = max(dates)
+        if backend.name == 'postgresql':
+            cursor.execute("SELECT MIN(xact_start) AT TIME ZONE 'UTC' "
+                'FROM pg_stat_activity '
+                'WHERE datname = current_database()')
+            oldest, = cursor.fetchone()
+            if oldest:
+                mark = min(mark, oldest)
+        return mark - timedelta(seconds=MODEL_INCREMENTAL_MARGIN)
+
+    def get_model_compute_signature(self, domain, context, expression_specs,
+            python_filter):
+        "Return a hash of everything that defines the content of the table"
+        definition = repr((self.model.name, domain,
+                sorted((context or {}).items()), expression_specs,
+                python_filter))
+        return hashlib.md5(definition.encode('utf-8')).hexdigest()
 
     def _compute_model_parallel(self, Model, domain, context,
-            expression_specs, python_filter):
+            expression_specs, python_filter, chunk_size):
         staging_table_name = (
             f'{self.table_name}_compute_{secrets.token_hex(4)}')
         with Transaction().new_transaction() as transaction:
             self._create_model_compute_table(staging_table_name,
-                transaction.connection)
+                transaction.connection, expression_specs)
 
         checker = TimeoutChecker(self.timeout, self.timeout_exception)
-        internal_names = [field.internal_name for field in self.fields_]
-        mp_context = multiprocessing.get_context('spawn')
-        input_queue = mp_context.Queue()
-        result_queue = mp_context.Queue()
-        processes = []
-        try:
-            with Transaction().new_transaction(readonly=True):
-                cursor = Transaction().connection.cursor()
-                cursor.execute('SELECT pg_export_snapshot()')
-                snapshot_id, = cursor.fetchone()
-                with Transaction().set_context(**context):
-                    try:
-                        total_count = Model.search(domain, count=True)
-                    except Exception as message:
-                        self._handle_model_compute_general_error(repr(message))
-                chunk_count = (
-                    (total_count + MODEL_COMPUTE_CHUNK_SIZE - 1)
-                    // MODEL_COMPUTE_CHUNK_SIZE)
-                for chunk_index in range(chunk_count):
-                    input_queue.put(chunk_index)
-                for _ in range(MODEL_COMPUTE_PROCESSES):
-                    input_queue.put(None)
-
-                for _ in range(MODEL_COMPUTE_PROCESSES):
-                    process = mp_context.Process(
-                        target=compute_model_worker,
-                        args=(Transaction().database.name, Transaction().user,
-                            dict(context), snapshot_id, self.model.name,
-                            domain, staging_table_name, internal_names,
-                            expression_specs, python_filter, self.timeout,
-                            input_queue, result_queue))
-                    process.start()
-                    processes.append(process)
-
-                done = 0
-                count = 0
-                inserted = 0
-                while done < len(processes):
-                    checker.check()
-                    self._check_model_worker_processes(processes)
-                    logger.info(f'Calculated {self.model.name}: '
-                        f'{inserted}/{count} (inserted/count) records '
-                        f'in {checker.elapsed} seconds.')
-                    try:
-                        result = result_queue.get(timeout=1)
-                    except queue.Empty:
-                        continue
-                    if result['type'] == 'progress':
-                        count += result.get('count', 0)
-                        inserted += result.get('inserted', 0)
-                        continue
-                    if result['type'] == 'done':
-                        done += 1
-                        continue
-                    if result['type'] == 'field_error':
-                        error = ModelComputeFieldError(result['field_name'],
-                            result['record_id'], result['error'])
-                        self._handle_model_compute_field_error(error)
-                    self._handle_model_compute_general_error(result['error'])
-
-            with Transaction().new_transaction() as transaction:
-                self._drop(transaction.connection)
-                cursor = transaction.connection.cursor()
-                cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (
-                        staging_table_name, self.table_name))
-        except Exception:
-            with Transaction().new_transaction() as transaction:
-                drop_table_or_view(transaction.connection, staging_table_name)
-            for process in processes:
-                if process.is_alive():
-                    process.terminate()
-            raise
-        finally:
-            for process in processes:
-                process.join()
+        internal_names = [x[1] for x in expression_specs]
+        database_name = Transaction().database.name
+        job_id = secrets.token_hex(8)
+        pool = ComputeWorkerPool.get()
+        with pool.lock:
+            try:
+                pool.start(database_name)
+                with Transaction().new_transaction(readonly=True):
+                    cursor = Transaction().connection.cursor()
+                    cursor.execute('SELECT pg_export_snapshot()')
+                    snapshot_id, = cursor.fetchone()
+                    # Split the ids once inside the exported snapshot so
+                    # workers read their chunks with an index range scan
+                    with Transaction().set_context(**context):
+                        try:
+                            id_ranges = get_model_id_ranges(Model, domain,
+                                size=chunk_size.size)
+                        except Exception as message:
+                            self._handle_model_compute_general_error(
+                                repr(message))
+                    pool.submit({
+                            'id': job_id,
+                            'database_name': database_name,
+                            'user': Transaction().user,
+                            'context': dict(context,
+                                _record_cache_size=chunk_size.size),
+                            'snapshot_id': snapshot_id,
+                            'model_name': self.model.name,
+                            'domain': domain,
+                            'table_name': staging_table_name,
+                            'internal_names': internal_names,
+                            'expression_specs': expression_specs,
+                            'python_filter': python_filter,
+                            'timeout': self.timeout,
+                            }, id_ranges)
+
+                    done = 0
+                    count = 0
+                    inserted = 0
+                    computed_ranges = 0
+                    progress_time = time.monotonic()
+                    while done < pool.size:
+                        checker.check()
+                        self._check_model_worker_processes(pool.processes)
+                        logger.info(f'Calculated {self.model.name}: '
+                            f'{inserted}/{count} (inserted/count) records '
+                            f'in {checker.elapsed} seconds.')
+                        result = pool.get_result(job_id)
+                        if result is None:
+                            continue
+                        if result['type'] == 'progress':
+                            count += result.get('count', 0)
+                            inserted += result.get('inserted', 0)
+                            # Ranges are already split so the measures only
+                            # tune the size used by the next computation
+                            chunk_size.update(result.get('count', 0),
+                                result.get('elapsed', 0),
+                                result.get('memory', 0))
+                            computed_ranges += 1
+                            if (time.monotonic() - progress_time
+                                    >= MODEL_COMPUTE_PROGRESS_INTERVAL):
+                                self.set_compute_progress(
+                                    100 * computed_ranges / len(id_ranges))
+                                progress_time = time.monotonic()
+                            continue
+                        if result.get('recycle'):
+                            pool.replace(result['worker'])
+                        if result['type'] == 'done':
+                            done += 1
+                            continue
+                        if result['type'] == 'field_error':
+                            error = ModelComputeFieldError(
+                                result['field_name'], result['record_id'],
+                                result['error'])
+                            self._handle_model_compute_field_error(error)
+                        self._handle_model_compute_general_error(
+                            result['error'])
+
+                with Transaction().new_transaction() as transaction:
+                    self._drop(transaction.connection)
+                    cursor = transaction.connection.cursor()
+                    cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (
+                            staging_table_name, self.table_name))
+            except Exception:
+                with Transaction().new_transaction() as transaction:
+                    drop_table_or_view(transaction.connection,
+                        staging_table_name)
+                # The queues may still hold chunks of the failed job
+                pool.shutdown()
+                raise
 
         logger.info('Calculated %s, %s records in %s seconds'
             % (self.model.name, count, checker.elapsed))
@@ -1856,15 +2930,67 @@ class Table(DeactivableMixin, ModelSQL, ModelView):
         # This is needed when execute the wizard to calculate the report, to
         # ensure the company rule is used.
         context['_check_access'] = True
-        context['_record_cache_size'] = MODEL_COMPUTE_CHUNK_SIZE
 
-        expression_specs = get_model_expression_specs(self.fields_)
+        expression_specs = get_model_expression_specs(self.fields_,
+            source_id=self.incremental)
         python_filter = self.get_python_filter()
-        if backend.name == 'postgresql' and MODEL_COMPUTE_PROCESSES > 1:
-            return self._compute_model_parallel(Model, domain, context,
+        chunk_size = ChunkSizeController(self.compute_chunk_size)
+
+        signature = None
+        high_water_mark = None
+        if self.incremental:
+            signature = self.get_model_compute_signature(domain, context,
                 expression_specs, python_filter)
-        return self._compute_model_sequential(Model, domain, context,
-            expression_specs, python_filter)
+            high_water_mark = self.get_model_high_water_mark(Model)
+
+        # Expressions that are plain field paths are computed by the database
+        translator = ExpressionSQLTranslator(Model)
+        translator.add_columns(expression_specs)
+
+        profiler = None
+        if self.profile:
+            profiler = ComputeProfiler(
+                self.filter.rec_name if self.filter else None)
+
+        incremental = (self.incremental
+            and self.incremental_date
+            and self.incremental_signature == signature
+            and backend.TableHandler.table_exist(self.table_name))
+        try:
+            if incremental:
+                self._compute_model_incremental(Model, domain, context,
+                    expression_specs, python_filter, chunk_size, translator,
+                    self.incremental_date, profiler=profiler)
+            # Profiling measures the evaluation in the current process
+            elif (backend.name == 'postgresql' and MODEL_COMPUTE_PROCESSES > 1
+                    and not profiler
+                    and not translator.is_complete(expression_specs,
+                        python_filter)):
+                self._compute_model_parallel(Model, domain, context,
+                    expression_specs, python_filter, chunk_size)
+            else:
+                self._compute_model_sequential(Model, domain, context,
+                    expression_specs, python_filter, chunk_size, translator,
+                    profiler=profiler)
+        finally:
+            if profiler:
+                self.save_compute_logs(profiler)
+        if self.incremental and not incremental:
+            self._create_model_source_id_index()
+        self.compute_chunk_size = chunk_size.size
+        self.incremental_date = high_water_mark
+        self.incremental_signature = signature
+
+    def save_compute_logs(self, profiler):
+        "Replace the compute logs of the table with the ones of profiler"
+        pool = Pool()
+        ComputeLog = pool.get('babi.table.compute_log')
+        with Transaction().new_transaction():
+            ComputeLog.delete(ComputeLog.search([
+                        ('table', '=', self.id),
+                        ]))
+            ComputeLog.create([dict(x, table=self.id)
+                    for x in profiler.get_logs()])
 
     def check_access(self, user=None):
         pool = Pool()
@@ -1957,18 +3083,7 @@ class Field(sequence_ordered(), ModelSQL, ModelView):
             babi_field.check_internal_name()
 
     def sql_type(self):
-        datetime_type = 'TIMESTAMP' if backend.name == 'postgresql' else 'DATETIME'
-        mapping = {
-            'char': 'VARCHAR',
-            'integer': 'INTEGER',
-            'float': 'FLOAT',
-            'numeric': 'NUMERIC',
-            'boolean': 'BOOLEAN',
-            'many2one': 'INTEGER',
-            'date': 'DATE',
-            'datetime': datetime_type,
-            }
-        return mapping[self.expression.ttype]
+        return get_sql_type(self.expression.ttype)
 
     def check_internal_name(self):
         if not self.internal_name[0] in VALID_FIRST_SYMBOLS:
@@ -2011,6 +3126,46 @@ class TableDependency(ModelSQL, ModelView):
         cls.__access__.add('table')
 
 
+class TableComputeLog(ModelSQL, ModelView):
+    'BABI Table Compute Log'
+    __name__ = 'babi.table.compute_log'
+    table = fields.Many2One('babi.table', 'Table', required=True,
+        ondelete='CASCADE')
+    type = fields.Selection([
+            ('field', 'Field'),
+            ('sql', 'SQL Fields'),
+            ('prefetch', 'Prefetch'),
+            ('filter', 'Filter'),
+            ('chunk', 'Chunk'),
+            ], 'Type', required=True, readonly=True)
+    name = fields.Char('Name', readonly=True)
+    records = fields.Integer('Records', readonly=True)
+    eval_time = fields.Float('Evaluation Time', digits=(16, 6), readonly=True)
+    exceptions = fields.Integer('Exceptions', readonly=True)
+    queries = fields.Integer('Queries', readonly=True)
+    search_time = fields.Float('Search Time', digits=(16, 6), readonly=True)
+    insert_time = fields.Float('Insert Time', digits=(16, 6), readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.__access__.add('table')
+        cls._order.insert(0, ('type', 'DESC'))
+
+
+class TableComputeProgress(ModelSQL):
+    'BABI Table Compute Progress'
+    __name__ = 'babi.table.compute_progress'
+    table = fields.Many2One('babi.table', 'Table', required=True,
+        ondelete='CASCADE')
+    progress = fields.Float('Progress', digits=(16, 2))
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.__access__.add('table')
+
+
 class Warning(Workflow, ModelSQL, ModelView):
     'BABI Warning'
     __name__ = 'babi.warning'
@@ -2321,7 +3476,7 @@ def _convert_to_cell(value, ws):
             fmt = '#,##0.' + '0' * (-exp)
         else:
             fmt = '#,##0'
-        cell = Cell(ws, value=value)
+        cell = WriteOnlyCell(ws, value=value)
         cell.number_format = fmt
         return cell
     if isinstance(value, str):
@@ -2346,19 +3501,15 @@ class TableExcel(Report):
         action, model = cls.get_action(data)
         cls.check_access(action, model, ids)
 
-        wb = Workbook()
-        wb.remove(wb.active)
+        # Records are streamed from the database to the workbook
+        wb = Workbook(write_only=True)
         tables = Table.browse(ids)
         for table in tables:
             ws = wb.create_sheet(_convert_to_title(table.name))
-            for record in table.get_records():
-                ws.append([_convert_to_cell(item, ws) for item in record])
-            # try/except openpyxl/worksheet/worksheet.py _get_cell() raise:
-            # ValueError: Row numbers must be between 1 and 1048576. Row number supplied was 1048577
-            try:
-                adjust_column_widths(ws, max_width=30)
-            except ValueError:
-                continue
+            with closing(table.get_records()) as records:
+                append_rows(ws, ([_convert_to_cell(item, ws)
+                            for item in record] for record in records),
+                    max_width=30)
         if len(tables) == 1:
             name = table.name
         else:
@@ -2381,19 +3532,17 @@ class WarningExcel(Report):
         action, model = cls.get_action(data)
         cls.check_access(action, None, None)
 
-        wb = Workbook()
-        wb.remove(wb.active)
+        wb = Workbook(write_only=True)
 
         with Transaction().set_context(_check_access=False):
             warnings = Warning.browse(ids)
         for warning in warnings:
             ws = wb.create_sheet(_convert_to_title(warning.table.name))
-            for record in warning.table.get_records(where=warning.query_where()):
-                ws.append([_convert_to_cell(item, ws) for item in record])
-            try:
-                adjust_column_widths(ws, max_width=30)
-            except ValueError as e:
-                raise UserError(str(e))
+            records = warning.table.get_records(where=warning.query_where())
+            with closing(records):
+                append_rows(ws, ([_convert_to_cell(item, ws)
+                            for item in record] for record in records),
+                    max_width=30)
         if len(warnings) == 1:
             name = warning.table.name
         else:
@@ -2590,6 +3739,7 @@ class Pivot(ModelSQL, ModelView):
                 record.pivot = new
                 record.field = rel[measure.field.internal_name]
                 record.aggregate = measure.aggregate
+                record.approximate = measure.approximate
                 record.percentile = measure.percentile
                 record.over_field = (measure.over_field
                     and rel[measure.over_field.internal_name])
@@ -2836,9 +3986,18 @@ class Measure(sequence_ordered(), ModelSQL, ModelView):
             ('median', 'Median'),
             ('percentile', 'Percentile'),
             ('count', 'Count'),
+            ('count_distinct', 'Distinct Count'),
             ('max', 'Max'),
             ('min', 'Min'),
             ], 'Aggregate')
+    approximate = fields.Boolean('Approximate',
+        states={
+            'invisible': ~Eval('aggregate').in_(APPROXIMATE_AGGREGATES),
+            }, depends=['aggregate'],
+        help='Compute an estimate of the aggregate, which is much faster on '
+        'large tables. Requires the tdigest extension of PostgreSQL for '
+        'medians and percentiles and the hll extension for distinct counts, '
+        'there is no approximation without them.')
     percentile = fields.Float('Percentile',
         digits=(16, 2), states={
             'invisible': Eval('aggregate') != 'percentile',
@@ -2853,9 +4012,20 @@ class Measure(sequence_ordered(), ModelSQL, ModelView):
     def default_percentile():
         return 50.0
 
+    @staticmethod
+    def default_approximate():
+        return False
+
+    @property
+    def cube_aggregate(self):
+        'The aggregate of the measure in the cube'
+        if self.approximate and self.aggregate in APPROXIMATE_AGGREGATES:
+            return 'approx_' + self.aggregate
+        return self.aggregate
+
     @classmethod
     def get_measure_tuple(cls, measure):
-        values = [measure.field.internal_name, measure.aggregate]
+        values = [measure.field.internal_name, measure.cube_aggregate]
         if measure.aggregate == 'percentile':
             values.append(measure.percentile)
         if measure.over_field:
@@ -2881,6 +4051,12 @@ class Measure(sequence_ordered(), ModelSQL, ModelView):
         if field_names & {'aggregate', 'percentile'}:
             for record in records:
                 record.check_percentile()
+        if field_names & {'aggregate', 'over_field'}:
+            for record in records:
+                record.check_over_field()
+        if field_names & {'aggregate', 'approximate'}:
+            for record in records:
+                record.check_approximate()
 
     @classmethod
     def check_unique_configuration(cls, records):
@@ -2915,6 +4091,17 @@ class Measure(sequence_ordered(), ModelSQL, ModelView):
         if self.percentile is None or not (0 <= self.percentile <= 100):
             raise ValidationError('Percentile must be between 0 and 100.')
 
+    def check_over_field(self):
+        if self.aggregate == 'count_distinct' and self.over_field:
+            raise ValidationError('Distinct counts can not be computed over '
+                'a field.')
+
+    def check_approximate(self):
+        extension = approximate_missing_extension(self.cube_aggregate)
+        if extension:
+            raise ValidationError(gettext('babi.msg_approximate_extension',
+                    aggregate=self.rec_name, extension=extension))
+
     @fields.depends('aggregate')
     def on_change_aggregate(self):
         if self.aggregate == 'percentile' and self.percentile is None:
@@ -3016,6 +4203,210 @@ class Order(sequence_ordered(), ModelSQL, ModelView):
         return [(None, '')] + [(m, get_name(m)) for m in models]
 
 
+class CubeCache(ModelSQL, ModelView):
+    'Cube Cache'
+    __name__ = 'babi.cube.cache'
+    name = fields.Char('Name', required=True, readonly=True)
+    table_name = fields.Char('Table Name', required=True, readonly=True)
+    signature = fields.Char('Signature', readonly=True)
+    definition = fields.Text('Definition', readonly=True,
+        help='Dimensions, measures and properties of the cube.')
+    size = fields.BigInteger('Size', readonly=True,
+        help='Size in bytes of the cache table and its indexes.')
+    hits = fields.Integer('Hits', readonly=True)
+    last_access = fields.DateTime('Last Access', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('name_uniq', Unique(t, t.name),
+                'babi.msg_cube_cache_name_unique'),
+            ]
+        cls._order.insert(0, ('last_access', 'DESC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        exist = backend.TableHandler.table_exist(cls._table)
+        super().__register__(module_name)
+        # Cache tables created before the registry existed can not be
+        # tracked, so they are removed
+        if not exist:
+            cls.sweep()
+
+    @classmethod
+    def lookup(cls, name):
+        "Return True if the cache table is registered"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.id,
+                where=table.name == name, limit=1))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def get_size(name):
+        "Return the size in bytes of the cache table and its indexes"
+        if backend.name != 'postgresql':
+            return 0
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT COALESCE('
+            'pg_total_relation_size(to_regclass(%s)), 0)', (f'"{name}"',))
+        return cursor.fetchone()[0]
+
+    @classmethod
+    def register(cls, name, table_name, signature, definition=None):
+        '''
+        Register the cache table name of the BABI table table_name with the
+        definition of its cube (see Cube.get_definition)
+        '''
+        if cls.lookup(name):
+            cls.touch(name)
+            return
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        now = datetime.now()
+        if definition is not None:
+            definition = json.dumps(definition)
+        on_conflict = None
+        if backend.name == 'postgresql':
+            # Another transaction may have registered the same cache since
+            # the lookup, as both create it with CREATE TABLE IF NOT EXISTS
+            on_conflict = Conflict(table, indexed_columns=[table.name])
+        cursor.execute(*table.insert([table.name, table.table_name,
+                    table.signature, table.definition, table.size,
+                    table.hits, table.last_access, table.create_uid,
+                    table.create_date],
+                [[name, table_name, signature, definition,
+                        cls.get_size(name), 1, now, Transaction().user,
+                        now]], on_conflict=on_conflict))
+        if not cursor.rowcount:
+            cls.touch(name)
+
+    @classmethod
+    def get_definitions(cls, table_name):
+        '''
+        Return the name and definition of the caches of the BABI table
+        table_name, smallest first
+        '''
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.name, table.definition,
+                where=(table.table_name == table_name)
+                & (table.definition != Null),
+                order_by=[table.size.asc, table.id.asc]))
+        return [(name, json.loads(definition))
+            for name, definition in cursor]
+
+    @classmethod
+    def touch(cls, name):
+        "Record an access to the cache table"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        if backend.name == 'postgresql':
+            # Concurrent accesses to the same cache must not wait for each
+            # other only to count a hit
+            cursor.execute(f'UPDATE "{cls._table}" '
+                'SET hits = hits + 1, last_access = %s '
+                f'WHERE id IN (SELECT id FROM "{cls._table}" '
+                'WHERE name = %s FOR UPDATE SKIP LOCKED)',
+                (datetime.now(), name))
+        else:
+            cursor.execute(*table.update([table.hits, table.last_access],
+                    [table.hits + 1, datetime.now()],
+                    where=table.name == name))
+
+    @classmethod
+    def drop(cls, names):
+        "Drop the cache tables and remove them from the registry"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        for name in names:
+            cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+        for sub_names in grouped_slice(names):
+            cursor.execute(*table.delete(
+                    where=table.name.in_(list(sub_names))))
+
+    @classmethod
+    def clear(cls, table_names):
+        "Drop the caches of the BABI tables table_names"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        names = []
+        for sub_names in grouped_slice(table_names):
+            cursor.execute(*table.select(table.name,
+                    where=table.table_name.in_(list(sub_names))))
+            names += [x for x, in cursor]
+        cls.drop(names)
+
+    @classmethod
+    def clear_orphans(cls, table_names):
+        "Drop the caches of BABI tables other than table_names"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.name, table.table_name))
+        table_names = set(table_names)
+        cls.drop([name for name, table_name in cursor
+                if table_name not in table_names])
+
+    @classmethod
+    def sweep(cls):
+        "Drop the cache tables that are not registered"
+        cursor = Transaction().connection.cursor()
+        if backend.name == 'postgresql':
+            table = sql.Table('tables', schema='information_schema')
+            query = table.select(table.table_name,
+                where=(table.table_schema == 'public')
+                & (table.table_name.like('_babi_cache_%')))
+        else:
+            table = sql.Table('sqlite_master')
+            query = table.select(table.name,
+                where=(table.type == 'table')
+                & (table.name.like('_babi_cache_%')))
+        cursor.execute(*query)
+        names = [x for x, in cursor.fetchall()]
+        for name in names:
+            if not cls.lookup(name):
+                cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+
+    @classmethod
+    def evict(cls):
+        '''
+        Drop the caches that are no longer used and then the least recently
+        used ones until their total size is under CUBE_CACHE_MAX_SIZE
+        '''
+        pool = Pool()
+        Table = pool.get('babi.table')
+
+        with Transaction().set_context(active_test=False):
+            tables = Table.search([])
+        cls.clear_orphans([x.table_name for x in tables])
+        cls.sweep()
+
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        cursor.execute(*table.select(table.id, table.name,
+                order_by=[table.last_access.asc, table.id.asc]))
+        caches = cursor.fetchall()
+        sizes = {}
+        for id_, name in caches:
+            sizes[name] = cls.get_size(name)
+            cursor.execute(*table.update([table.size], [sizes[name]],
+                    where=table.id == id_))
+
+        total = sum(sizes.values())
+        budget = CUBE_CACHE_MAX_SIZE * 1024 * 1024
+        evicted = []
+        for _, name in caches:
+            if total <= budget:
+                break
+            evicted.append(name)
+            total -= sizes[name]
+        if evicted:
+            logger.info('Evicting %s cube caches', len(evicted))
+            cls.drop(evicted)
+
+
 class PivotExcel(Report):
     'Pivot Excel Export'
     __name__ = 'babi.pivot.excel'
@@ -3041,22 +4432,19 @@ class PivotExcel(Report):
 
         language = Transaction().context.get('language', 'en')
         language, = Language.search([('code', '=', language)], limit=1)
-        wb = Workbook()
-        wb.remove(wb.active)
+        # Rows are streamed to the workbook as the cubes are built
+        wb = Workbook(write_only=True)
         for pivot in pivots:
             ws = wb.create_sheet(_convert_to_title(pivot.rec_name))
             cube = pivot.get_cube()
             cube.column_expansions = Cube.EXPAND_ALL
             cube.row_expansions = Cube.EXPAND_ALL
             try:
-                for row in cube.build():
-                    ws.append([x.formatted(language, worksheet=ws) for x in row])
+                append_rows(ws, ([x.formatted(language, worksheet=ws)
+                            for x in row] for row in cube.build()),
+                    max_width=30)
             except psycopg.errors.UndefinedTable:
                 continue
-            try:
-                adjust_column_widths(ws, max_width=30)
-            except ValueError as e:
-                raise UserError(str(e))
 
         if len(pivots) == 1:
             name = pivot.table.name
@@ -9,17 +9,28 @@ import sql
 from unittest.mock import patch
 from decimal import Decimal
 from types import SimpleNamespace
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.writer.excel import save_workbook
 from lxml import etree
 from trytond import backend
+from trytond.exceptions import UserError
 from trytond.model.exceptions import ValidationError
 from trytond.pool import Pool
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
 from trytond.transaction import Transaction
-from trytond.modules.babi.babi_eval import babi_eval, babi_eval_batch
+from simpleeval import (
+    AttributeDoesNotExist, FeatureNotAvailable, FunctionNotDefined,
+    NameNotDefined)
+from trytond.modules.babi.babi_eval import (
+    babi_eval, babi_eval_batch, babi_eval_columns, compile_expression,
+    get_column_inputs, get_expression_paths)
 from trytond.modules.babi.table import (
-    ModelComputeFieldError, compute_model_insert_values)
+    MODEL_SOURCE_ID_COLUMN, ChunkSizeController, ComputeWorkerPool,
+    ExpressionSQLTranslator, ModelComputeFieldError, compute_model_insert_values, get_model_id_ranges,
+    get_model_prefetch_plan, insert_model_values, search_model_chunk,
+    search_model_id_range)
 from trytond.modules.babi.cube import Cube
+from trytond.modules.babi.tools import append_rows
 from trytond.pyson import PYSONEncoder
 from trytond.modules.company.tests import CompanyTestMixin
 
@@ -219,6 +230,121 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         self.assertEqual(babi_eval('o', None, convert_none=''), '')
         self.assertEqual(babi_eval('o', None, convert_none=None), None)
 
+    def test_compile_expression_sandbox(self):
+        'Test compiled expressions keep simpleeval restrictions'
+        record = SimpleNamespace(id=1, format='x', values=[1, 2, 3],
+            date=datetime.date(2024, 1, 1))
+        self.assertEqual(
+            compile_expression('[x * 2 for x in o.values if x > 1]')(record),
+            [4, 6])
+        self.assertEqual(compile_expression('sum(x for x in o.values)')(
+                record), 6)
+        self.assertEqual(compile_expression('today()')(record),
+            datetime.date.today())
+        self.assertEqual(compile_expression("o.date.strftime('%Y')")(record),
+            '2024')
+        for expression, exception in [
+                ('o.__class__', FeatureNotAvailable),
+                ('o.format', FeatureNotAvailable),
+                ('(lambda: 1)()', FeatureNotAvailable),
+                ('[x for o.id in o.values]', FeatureNotAvailable),
+                ('[1 for math in [1]] and math', FeatureNotAvailable),
+                ('[x for x in o.values] and x', NameNotDefined),
+                ('[o.id for _babi_getattr in [max]]', FeatureNotAvailable),
+                ('math', FeatureNotAvailable),
+                ('math.floor(o.id)', FeatureNotAvailable),
+                ('unknown', NameNotDefined),
+                ('open("/etc/passwd")', FunctionNotDefined),
+                ]:
+            with self.assertRaises(exception):
+                compile_expression(expression)(record)
+
+    def test_eval_columns(self):
+        'Test column-wise evaluation matches record by record evaluation'
+        records = [SimpleNamespace(
+                id=x,
+                date=datetime.date(2024, x % 12 + 1, 1),
+                quantity=float(x % 3),
+                price=1.5,
+                party=SimpleNamespace(name='Party') if x % 2 else None,
+                amount=Decimal(x) / 3)
+            for x in range(20)]
+        expressions = [
+            'ym(o.date)',
+            'o.quantity * o.price',
+            'o.party.name if o.party else "-"',
+            'o.amount',
+            'getattr(o, "id")',
+            ]
+        digits = [None, 2, None, 2, None]
+        ttypes = ['char', 'float', 'char', 'numeric', 'integer']
+        columns = babi_eval_columns(expressions, records, convert_none=None,
+            digits=digits, ttypes=ttypes)
+        self.assertEqual(list(zip(*columns)), [
+                babi_eval_batch(expressions, x, convert_none=None,
+                    digits=digits, ttypes=ttypes)
+                for x in records])
+        self.assertEqual(get_column_inputs('o.party.name if o.party else 0'),
+            (('party',),))
+        self.assertIsNone(get_column_inputs('getattr(o, "id")'))
+        self.assertIsNone(get_column_inputs('(today() - o.date).days'))
+        with self.assertRaises(AttributeDoesNotExist):
+            babi_eval_columns(['o.party.name'], records)
+
+        # Large integer constants must not overflow
+        expressions = [
+            'o.id * 4000000000000000000',
+            'o.id + 9223372036854775807',
+            'o.id * 2 ** 64',
+            ]
+        columns = babi_eval_columns(expressions, records, convert_none=None,
+            ttypes=['integer'] * len(expressions))
+        self.assertEqual(list(zip(*columns)), [
+                (x.id * 4000000000000000000, x.id + 9223372036854775807,
+                    x.id * 2 ** 64)
+                for x in records])
+
+        # Paths are not read from invalid expressions
+        read = []
+
+        class Record:
+            @property
+            def party(self):
+                read.append('party')
+                return records[1].party
+        with self.assertRaises(FeatureNotAvailable):
+            babi_eval_columns(['o.party.name.format'], [Record()])
+        self.assertEqual(read, [])
+
+    def test_get_expression_paths(self):
+        'Test attribute paths found in expressions'
+        self.assertEqual(get_expression_paths('o.party.addresses[0].city'),
+            {('party', 'addresses', 'city')})
+        self.assertEqual(
+            get_expression_paths('o.party.code + ymd(o.date)'),
+            {('party', 'code'), ('date',)})
+        self.assertEqual(
+            get_expression_paths('sum(l.amount for l in o.lines)'),
+            {('lines', 'amount')})
+        self.assertEqual(get_expression_paths('o.('), set())
+
+    @with_transaction()
+    def test_get_model_prefetch_plan(self):
+        'Test prefetch plan only follows fields'
+        pool = Pool()
+        Table = pool.get('babi.table')
+
+        plan = get_model_prefetch_plan(Table, [
+                None,
+                'o.model.name.upper()',
+                'o.fields_[0].expression.ttype',
+                'o.unknown.name',
+                ])
+        self.assertEqual(plan, {
+                'model': {'name': {}},
+                'fields_': {'expression': {'ttype': {}}},
+                })
+
     @with_transaction()
     def test_compute_model_insert_values_identifies_field(self):
         record = SimpleNamespace(id=7, ok=3)
@@ -238,6 +364,134 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         self.assertEqual(cm.exception.record_id, 7)
         self.assertIn('missing', cm.exception.error)
 
+    @with_transaction()
+    def test_search_model_chunk_keyset(self):
+        pool = Pool()
+        TestModel = pool.get('babi.test')
+
+        self.create_data()
+        records = TestModel.search([], order=[('id', 'ASC')])
+
+        chunks = []
+        chunk = search_model_chunk(TestModel, [], limit=5)
+        while chunk:
+            chunks.append(chunk)
+            chunk = search_model_chunk(TestModel, [], last_id=chunk[-1].id,
+                limit=5)
+
+        self.assertTrue(all(len(x) <= 5 for x in chunks))
+        self.assertEqual(sum(chunks, []), records)
+
+    @with_transaction()
+    def test_get_model_id_ranges(self):
+        pool = Pool()
+        TestModel = pool.get('babi.test')
+
+        self.create_data()
+        records = TestModel.search([], order=[('id', 'ASC')])
+
+        ranges = get_model_id_ranges(TestModel, [], size=7)
+        self.assertEqual(len(ranges), (len(records) + 6) // 7)
+        chunks = [search_model_id_range(TestModel, [], min_id, max_id)
+            for min_id, max_id in ranges]
+        self.assertTrue(all(len(x) <= 7 for x in chunks))
+        self.assertEqual(sum(chunks, []), records)
+
+    def test_chunk_size_controller(self):
+        controller = ChunkSizeController(100, target_time=1,
+            memory=1000, min_size=10, max_size=1000)
+
+        # Cheap expressions grow the chunk, at most doubling it
+        self.assertEqual(controller.update(100, 0.01), 200)
+        self.assertEqual(controller.update(200, 0.5), 400)
+        # Slow expressions shrink it, at most halving it
+        self.assertEqual(controller.update(400, 100), 200)
+        # Memory growth bounds the size
+        self.assertEqual(controller.update(200, 0.01, memory=2000), 100)
+        # Limits are always honoured
+        for _ in range(10):
+            controller.update(controller.size, 1000)
+        self.assertEqual(controller.size, 10)
+
+    def test_compute_worker_pool_results(self):
+        pool = ComputeWorkerPool(size=2)
+        self.assertEqual(pool.processes, [])
+
+        # Messages left by a previous job are discarded
+        pool.result_queue.put({'type': 'progress', 'job': 'old'})
+        pool.result_queue.put({'type': 'done', 'job': 'new', 'count': 3})
+        self.assertEqual(pool.get_result('new', timeout=5),
+            {'type': 'done', 'job': 'new', 'count': 3})
+        self.assertIsNone(pool.get_result('new', timeout=0.1))
+        pool.shutdown()
+
+    @with_transaction()
+    def test_expression_sql_translator(self):
+        'Test translation of field paths to SQL'
+        pool = Pool()
+        TestModel = pool.get('babi.test')
+
+        self.create_data()
+        expression_specs = [
+            ('Id', 'id', 'o.id', 'integer', None),
+            ('Category', 'category', 'o.category', 'char', None),
+            ('Amount', 'amount', 'o.amount', 'numeric', 2),
+            ('Category Id', 'category_id', 'o.category', 'integer', None),
+            ('Upper', 'upper', 'o.category.upper()', 'char', None),
+            ('Unknown', 'unknown', 'o.unknown', 'char', None),
+            ]
+        translator = ExpressionSQLTranslator(TestModel)
+        translator.add_columns(expression_specs)
+        # Amount is rounded in Python
+        self.assertEqual(set(translator.columns), {0, 1})
+        self.assertFalse(translator.is_complete(expression_specs))
+        self.assertTrue(translator.is_complete(expression_specs[:2]))
+        self.assertFalse(translator.is_complete(expression_specs[:2],
+                python_filter='o.amount > 0'))
+
+        records = TestModel.search([], limit=5)
+        batch_expressions, batch_digits, batch_ttypes = zip(
+            *[(x[2], x[4], x[3]) for x in expression_specs[:5]])
+        values = compute_model_insert_values(records, None,
+            expression_specs[:5], list(batch_expressions), list(batch_digits),
+            list(batch_ttypes), translator=translator)
+        self.assertEqual(values, [[
+                    x.id, x.category, x.amount, x.category,
+                    x.category.upper()]
+                for x in records])
+
+        # Python fails on empty relations which SQL would return as NULL
+        translator = ExpressionSQLTranslator(pool.get('ir.model.access'))
+        self.assertIsNotNone(translator.translate('o.model.model', 'char'))
+        self.assertIsNone(translator.translate('o.group.id', 'integer'))
+
+    @with_transaction()
+    def test_insert_model_values_copy(self):
+        'Test COPY stores the same values as INSERT'
+        if backend.name != 'postgresql':
+            return
+        cursor = Transaction().connection.cursor()
+        values = [[x, x] for x in [
+                2.5, 3.5, -2.5, 2.4, Decimal('2.5'), Decimal('-2.5'),
+                Decimal('3.5'), 7, None]]
+        rows = []
+        for name, backend_name in [
+                ('babi_test_copy', 'postgresql'),
+                ('babi_test_insert', 'sqlite')]:
+            cursor.execute(f'CREATE TABLE "{name}" '
+                '(id SERIAL, "integer" INTEGER, "float" FLOAT8)')
+            with patch('trytond.modules.babi.table.backend.name',
+                    backend_name):
+                insert_model_values(cursor, name, ['integer', 'float'],
+                    ['integer', 'float'], values)
+            cursor.execute(f'SELECT "integer", "float" FROM "{name}" '
+                'ORDER BY id')
+            rows.append(cursor.fetchall())
+        copy_rows, insert_rows = rows
+        self.assertEqual(copy_rows, insert_rows)
+        self.assertEqual([x[0] for x in copy_rows],
+            [2, 4, -2, 2, 3, -3, 4, 7, None])
+
     @with_transaction()
     def test_compute_model_dispatch(self):
         pool = Pool()
@@ -253,7 +507,8 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         table.name = 'Dispatch Table'
         table.on_change_name()
         table.model, = Model.search([('name', '=', 'babi.test')])
-        expression, = Expression.search([('name', '=', 'Id')], limit=1)
+        expression, = Expression.search([('name', '=', 'Amount this month')],
+            limit=1)
         field = Field()
         field.expression = expression
         field.on_change_expression()
@@ -269,6 +524,18 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
             parallel.assert_called_once()
             sequential.assert_not_called()
 
+        # Tables computed only with SQL do not need workers
+        expression, = Expression.search([('name', '=', 'Id')], limit=1)
+        field.expression = expression
+        field.save()
+        with patch.object(Table, '_compute_model_parallel') as parallel, \
+                patch.object(Table, '_compute_model_sequential') as sequential, \
+                patch('trytond.modules.babi.table.backend.name',
+                    'postgresql'):
+            table._compute_model()
+            sequential.assert_called_once()
+            parallel.assert_not_called()
+
         with patch.object(Table, '_compute_model_parallel') as parallel, \
                 patch.object(Table, '_compute_model_sequential') as sequential, \
                 patch('trytond.modules.babi.table.backend.name', 'sqlite'):
@@ -331,6 +598,27 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         fields = sorted([x.internal_name for x in table.fields_])
         self.assertEqual(fields, ['amount', 'date'])
 
+    @with_transaction()
+    def test_table_query_order(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        Field = pool.get('babi.field')
+
+        table = Table(type='model', fields_=[
+                Field(internal_name='name', order=None, descending=False),
+                Field(internal_name='amount', order=2, descending=True),
+                Field(internal_name='date', order=1, descending=False),
+                ])
+        fields = ['"name"', '"amount"', '"date"']
+        # Model tables are sorted in the database so records can be streamed
+        self.assertEqual(table.get_query_order(fields), [
+                '"date" ASC NULLS FIRST', '"amount" DESC NULLS LAST',
+                '"name"', '"amount"', '"date"'])
+        self.assertEqual(table.get_query_order([]), [
+                '"date" ASC NULLS FIRST', '"amount" DESC NULLS LAST'])
+        table.type = 'table'
+        self.assertEqual(table.get_query_order(fields), fields)
+
     @with_transaction()
     def test_table_model_batches_over_1000_records(self):
         pool = Pool()
@@ -376,6 +664,146 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
             count = cursor.fetchone()[0]
         self.assertEqual(count, initial_count + 1205)
 
+    @with_transaction()
+    def test_table_model_incremental(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        Field = pool.get('babi.field')
+        Model = pool.get('ir.model')
+        Expression = pool.get('babi.expression')
+        TestModel = pool.get('babi.test')
+
+        TestModel.delete(TestModel.search([]))
+        records = TestModel.create([{
+                    'date': datetime.date(2024, 1, 1),
+                    'category': 'odd',
+                    'amount': Decimal(x),
+                    } for x in range(5)])
+        model, = Model.search([('name', '=', 'babi.test')])
+        Model.write([model], {'babi_enabled': True})
+        expression, = Expression.create([{
+                    'name': 'Amount',
+                    'model': model.id,
+                    'ttype': 'numeric',
+                    'expression': 'o.amount',
+                    }])
+        Transaction().commit()
+
+        table = Table()
+        table.type = 'model'
+        table.name = 'Incremental Table'
+        table.on_change_name()
+        table.model = model
+        table.incremental = True
+
+        field = Field()
+        field.expression = expression
+        field.on_change_expression()
+        field.on_change_name()
+        table.fields_ = [field]
+        table.save()
+        table._compute()
+        self.assertIsNotNone(table.incremental_date)
+        self.assertIsNotNone(table.incremental_signature)
+
+        TestModel.write([records[0]], {'amount': Decimal(10)})
+        TestModel.delete([records[1]])
+        new_record, = TestModel.create([{
+                    'date': datetime.date(2024, 1, 1),
+                    'category': 'even',
+                    'amount': Decimal(20),
+                    }])
+        Transaction().commit()
+
+        with patch.object(Table, '_compute_model_sequential') as sequential:
+            table._compute()
+            sequential.assert_not_called()
+        self.assertIsNone(table.compute_error)
+
+        with Transaction().new_transaction() as transaction:
+            cursor = transaction.connection.cursor()
+            cursor.execute('SELECT "%s", "%s" FROM "%s"' % (
+                    MODEL_SOURCE_ID_COLUMN, field.internal_name,
+                    table.table_name))
+            rows = {x[0]: Decimal(str(x[1])) for x in cursor.fetchall()}
+        self.assertEqual(rows, {
+                records[0].id: Decimal(10),
+                records[2].id: Decimal(2),
+                records[3].id: Decimal(3),
+                records[4].id: Decimal(4),
+                new_record.id: Decimal(20),
+                })
+        # The source id is not exported
+        self.assertCountEqual(
+            [Decimal(str(x)) for x, in table.execute_query()],
+            [Decimal(10), Decimal(2), Decimal(3), Decimal(4), Decimal(20)])
+
+    @with_transaction()
+    def test_table_model_profile(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        Field = pool.get('babi.field')
+        Model = pool.get('ir.model')
+        Expression = pool.get('babi.expression')
+        TestModel = pool.get('babi.test')
+
+        TestModel.delete(TestModel.search([]))
+        TestModel.create([{
+                    'date': datetime.date(2024, 1, 1),
+                    'category': 'odd',
+                    'amount': Decimal(x),
+                    } for x in range(5)])
+        model, = Model.search([('name', '=', 'babi.test')])
+        Model.write([model], {'babi_enabled': True})
+        expression, sql_expression = Expression.create([{
+                    'name': 'Double Amount',
+                    'model': model.id,
+                    'ttype': 'numeric',
+                    'expression': 'o.amount * 2',
+                    }, {
+                    'name': 'Profiled Category',
+                    'model': model.id,
+                    'ttype': 'char',
+                    'expression': 'o.category',
+                    }])
+        Transaction().commit()
+
+        table = Table()
+        table.type = 'model'
+        table.name = 'Profiled Table'
+        table.on_change_name()
+        table.model = model
+        table.profile = True
+
+        field = Field()
+        field.expression = expression
+        field.on_change_expression()
+        field.on_change_name()
+        sql_field = Field()
+        sql_field.expression = sql_expression
+        sql_field.on_change_expression()
+        sql_field.on_change_name()
+        table.fields_ = [field, sql_field]
+        table.save()
+        table._compute()
+        self.assertIsNone(table.compute_error)
+
+        table = Table(table.id)
+        logs = {}
+        for log in table.compute_logs:
+            logs.setdefault(log.type, []).append(log)
+        field_log, = logs['field']
+        self.assertEqual(field_log.name, field.name)
+        self.assertEqual(field_log.records, 5)
+        self.assertEqual(field_log.exceptions, 0)
+        self.assertGreaterEqual(field_log.eval_time, 0)
+        # Fields computed by the database are profiled together
+        sql_log, = logs['sql']
+        self.assertEqual(sql_log.name, sql_field.name)
+        self.assertEqual(sql_log.records, 5)
+        self.assertEqual(sum(x.records for x in logs['chunk']), 5)
+        self.assertNotIn('filter', logs)
+
     @with_transaction()
     def test_table_xls_report(self):
         pool = Pool()
@@ -425,6 +853,21 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         ws = wb.active
         self.assertEqual(ws['B2'].value, '3103250004395152603')
 
+    def test_append_rows_write_only(self):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Rows')
+        rows = ([index, 'x' * index] for index in range(50))
+        append_rows(ws, rows, max_width=30, sample_size=10)
+        output = io.BytesIO()
+        save_workbook(wb, output)
+
+        ws = load_workbook(io.BytesIO(output.getvalue())).active
+        self.assertEqual(ws.max_row, 50)
+        self.assertEqual(ws['B50'].value, 'x' * 49)
+        # Widths are computed from the sampled rows only
+        self.assertEqual(ws.column_dimensions['A'].width, 3)
+        self.assertEqual(ws.column_dimensions['B'].width, 11)
+
     @with_transaction()
     def test_pivot_median_aggregate(self):
         pool = Pool()
@@ -471,6 +914,85 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         self.assertEqual(Cube.measure_name(('value', 'percentile', 12.5)),
             'percentile_12_5_value__')
 
+    @with_transaction()
+    def test_pivot_approximate_aggregate(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        Pivot = pool.get('babi.pivot')
+        RowDimension = pool.get('babi.pivot.row_dimension')
+        Measure = pool.get('babi.pivot.measure')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Approximate Table'
+        table.on_change_name()
+        if backend.name == 'sqlite':
+            table.query = """
+                SELECT 'a' AS category, 1 AS value
+                UNION ALL SELECT 'a', 1
+                UNION ALL SELECT 'a', 2
+                UNION ALL SELECT 'b', 3
+                """
+        else:
+            table.query = """
+                SELECT * FROM (
+                    VALUES ('a', 1), ('a', 1), ('a', 2), ('b', 3)
+                ) AS data(category, value)
+                """
+        table.save()
+        table._compute()
+
+        fields = {field.internal_name: field for field in table.fields_}
+        pivot = Pivot(table=table, name='Approximate')
+        pivot.save()
+        RowDimension(pivot=pivot, field=fields['category']).save()
+        with patch('trytond.modules.babi.cube.database_extensions',
+                return_value={'tdigest', 'hll'}):
+            Measure.save([
+                    Measure(pivot=pivot, field=fields['value'],
+                        aggregate='count_distinct'),
+                    Measure(pivot=pivot, field=fields['value'],
+                        aggregate='count_distinct', approximate=True),
+                    Measure(pivot=pivot, field=fields['value'],
+                        aggregate='sum', approximate=True),
+                    ])
+        with self.assertRaises(ValidationError):
+            Measure(pivot=pivot, field=fields['value'],
+                aggregate='count_distinct',
+                over_field=fields['category']).save()
+
+        pivot = Pivot(pivot.id)
+        cube = pivot.get_cube()
+        self.assertCountEqual(cube.measures, [
+                ('value', 'count_distinct'),
+                ('value', 'approx_count_distinct'),
+                ('value', 'sum'),
+                ])
+        self.assertEqual(
+            Cube.measure_name(('value', 'approx_percentile', 90)),
+            'approx_percentile_90_value__')
+
+        # Approximate aggregates are rejected without their extension
+        with patch('trytond.modules.babi.cube.database_extensions',
+                return_value=set()):
+            with self.assertRaises(ValidationError):
+                Measure(pivot=pivot, field=fields['value'],
+                    aggregate='median', approximate=True).save()
+            with self.assertRaises(UserError):
+                Cube.measure_method(sql.Table(table.table_name),
+                    ('value', 'approx_median'))
+
+            cube.measures = [('value', 'count_distinct')]
+            cube.row_expansions = Cube.EXPAND_ALL
+            values = cube.get_values()
+            counts = {values.decode_row(row): values.get(row, column)[:1]
+                for row, column in values.keys()}
+            self.assertEqual(counts, {
+                    (None,): [3],
+                    ('a',): [2],
+                    ('b',): [1],
+                    })
+
     @with_transaction()
     def test_pivot_window_aggregate(self):
         measure = Cube.measure_method(sql.Table('test'),
@@ -523,6 +1045,286 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
         result = list(cube.build())
         self.assertTrue(result)
 
+    @with_transaction()
+    def test_pivot_cube_cache(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Cube Cache Table'
+        table.on_change_name()
+        if backend.name == 'sqlite':
+            table.query = '''
+                SELECT 1 AS id, 10 AS company, 'Alice' AS name
+                UNION ALL
+                SELECT 2 AS id, 10 AS company, 'Bob' AS name
+                UNION ALL
+                SELECT 3 AS id, 20 AS company, 'Carol' AS name
+                '''
+        else:
+            table.query = '''
+                SELECT * FROM (
+                    VALUES
+                        (1, 10, 'Alice'),
+                        (2, 10, 'Bob'),
+                        (3, 20, 'Carol')
+                ) AS data(id, company, name)
+                '''
+        table.save()
+        table._compute()
+
+        cube = Cube(table=table.table_name,
+            rows=['company', 'name'],
+            columns=['id'],
+            measures=[('id', 'count')],
+            order=[('company', 'desc')],
+            row_expansions=Cube.EXPAND_ALL,
+            column_expansions=Cube.EXPAND_ALL)
+        values = cube.get_values()
+        totals = [values.decode_row(row) for row, column in values.keys()
+            if column == (None,)]
+        self.assertEqual([x[0] for x in totals], [None, 20, 10, 20, 10, 10])
+        self.assertEqual(values.get((None, None), (None,)), [3])
+        # Values are coded per dimension and decoded when needed
+        self.assertEqual(values.row_values[0], [20, 10])
+        self.assertEqual(sorted(values.row_values[1]),
+            ['Alice', 'Bob', 'Carol'])
+
+        # All the levels share a single cache table
+        cursor = Transaction().connection.cursor()
+        if backend.name == 'postgresql':
+            cache_table = sql.Table('tables', schema='information_schema')
+            query = cache_table.select(cache_table.table_name,
+                where=cache_table.table_name.like(cube.cache_prefix() + '%'))
+        else:
+            cache_table = sql.Table('sqlite_master')
+            query = cache_table.select(cache_table.name,
+                where=(cache_table.type == 'table')
+                & cache_table.name.like(cube.cache_prefix() + '%'))
+        cursor.execute(*query)
+        self.assertEqual(len(cursor.fetchall()), 1)
+
+        # Only the children of the expanded header are returned
+        cube = Cube(table=table.table_name,
+            rows=['company', 'name'],
+            measures=[('id', 'count')],
+            order=[('company', 'asc'), ('name', 'asc')],
+            row_expansions=[(None, None), (10,)])
+        values = cube.get_values()
+        self.assertEqual([values.decode_row(k[0]) for k in values.keys()], [
+                (None, None), (10, None), (20, None), (10, 'Alice'),
+                (10, 'Bob')])
+
+        # Rows are paged by the values of the first row dimension
+        cube.row_expansions = Cube.EXPAND_ALL
+        self.assertEqual(cube.get_row_keys(), [10, 20])
+        self.assertEqual(cube.get_row_keys(1, 1), [20])
+        full = [[x.value for x in row] for row in cube.build()]
+        pages = [[x.value for x in row] for row in cube.build(0, 1)]
+        self.assertEqual(len(pages), len(full) - 1)
+        pages += [[x.value for x in row]
+            for row in cube.build(1, 1, header=False)]
+        self.assertEqual(pages, full)
+
+        # Pages stop when the expanded rows exceed max_rows but keep at least
+        # one value
+        row_keys, _ = cube.get_page(0, 2, max_rows=1)
+        self.assertEqual(row_keys, [10])
+        row_keys, _ = cube.get_page(0, 2, max_rows=100)
+        self.assertEqual(row_keys, [10, 20])
+        page = cube.get_page(0, 2, max_rows=1)
+        pages = [[x.value for x in row] for row in cube.build(page=page)]
+        pages += [[x.value for x in row]
+            for row in cube.build(1, 2, header=False, max_rows=1)]
+        self.assertEqual(pages, full)
+
+    @with_transaction()
+    def test_cube_cache_registry(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        CubeCache = pool.get('babi.cube.cache')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Cube Cache Registry'
+        table.on_change_name()
+        table.query = 'SELECT 1 AS id, 10 AS company'
+        table.save()
+        table._compute()
+
+        cube = Cube(table=table.table_name, rows=['company'],
+            measures=[('id', 'count')])
+        list(cube.build())
+        cache, = CubeCache.search([('table_name', '=', table.table_name)])
+        hits = cache.hits
+        self.assertTrue(CubeCache.lookup(cache.name))
+        list(cube.build())
+        record, = CubeCache.read([cache.id], ['hits'])
+        self.assertGreater(record['hits'], hits)
+
+        # Registering an existing cache records an access instead of failing
+        CubeCache.register(cache.name, table.table_name, cache.signature)
+        self.assertEqual(
+            CubeCache.read([cache.id], ['hits'])[0]['hits'],
+            record['hits'] + 1)
+
+        # Least recently used caches are dropped when over the budget
+        with patch('trytond.modules.babi.table.CUBE_CACHE_MAX_SIZE', -1):
+            CubeCache.evict()
+        self.assertEqual(CubeCache.search([]), [])
+        self.assertFalse(CubeCache.lookup(cache.name))
+        self.assertFalse(backend.TableHandler.table_exist(cache.name))
+
+    @with_transaction()
+    def test_cube_reuse_finer_cache(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        CubeCache = pool.get('babi.cube.cache')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Cube Reuse Table'
+        table.on_change_name()
+        if backend.name == 'sqlite':
+            table.query = '''
+                SELECT 1 AS id, 10 AS company, 'Alice' AS name
+                UNION ALL
+                SELECT 2 AS id, 10 AS company, 'Bob' AS name
+                UNION ALL
+                SELECT 3 AS id, 20 AS company, 'Carol' AS name
+                '''
+        else:
+            table.query = '''
+                SELECT * FROM (
+                    VALUES
+                        (1, 10, 'Alice'),
+                        (2, 10, 'Bob'),
+                        (3, 20, 'Carol')
+                ) AS data(id, company, name)
+                '''
+        table.save()
+        table._compute()
+
+        fine = Cube(table=table.table_name, rows=['company', 'name'],
+            measures=[('id', 'sum'), ('id', 'count')])
+        list(fine.build())
+        fine_cache, = CubeCache.search([
+                ('table_name', '=', table.table_name)])
+
+        # Coarser cubes are computed from the cache of the finer one
+        coarse = Cube(table=table.table_name, rows=['company'],
+            measures=[('id', 'avg'), ('id', 'count')],
+            order=[('company', 'asc')],
+            row_expansions=Cube.EXPAND_ALL)
+        self.assertEqual(coarse.get_reusable_cache(), fine_cache.name)
+        values = [[x.value for x in row][-3:] for row in coarse.build()]
+        self.assertEqual(values[2:], [['', 2, 3], [10, 1.5, 2],
+                [20, 3, 1]])
+
+        # Sums keep the type they have in the finer cube
+        coarse = Cube(table=table.table_name, rows=['company'],
+            measures=[('id', 'sum')],
+            order=[('company', 'asc')],
+            row_expansions=Cube.EXPAND_ALL)
+        self.assertEqual(coarse.get_reusable_cache(), fine_cache.name)
+        values = [row[-1].value for row in coarse.build()][-3:]
+        self.assertEqual(values, [6, 3, 3])
+        self.assertTrue(all(type(x) is int for x in values))
+
+        # Medians can not be computed from other aggregates
+        cube = Cube(table=table.table_name, rows=['company'],
+            measures=[('id', 'median')])
+        self.assertIsNone(cube.get_reusable_cache())
+
+    @with_transaction()
+    def test_pivot_sampled_cube(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        CubeCache = pool.get('babi.cube.cache')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Sampled Table'
+        table.on_change_name()
+        if backend.name == 'sqlite':
+            table.query = """
+                SELECT 1 AS id, 10 AS company, 2.5 AS amount
+                UNION ALL
+                SELECT 2 AS id, 10 AS company, 1.5 AS amount
+                UNION ALL
+                SELECT 3 AS id, 20 AS company, 4.0 AS amount
+                """
+        else:
+            table.query = """
+                SELECT * FROM (
+                    VALUES
+                        (1, 10, 2.5),
+                        (2, 10, 1.5),
+                        (3, 20, 4.0)
+                ) AS data(id, company, amount)
+                """
+        table.save()
+        table._compute()
+
+        kwargs = dict(rows=['company'],
+            measures=[('id', 'count'), ('amount', 'sum'), ('amount', 'max')],
+            order=[('company', 'asc')],
+            row_expansions=Cube.EXPAND_ALL)
+        exact = Cube(table=table.table_name, **kwargs)
+        sampled = Cube(table=table.table_name, sample=100, **kwargs)
+        exact_rows = list(exact.build())
+        sampled_rows = list(sampled.build())
+        self.assertEqual([[x.value for x in row] for row in sampled_rows],
+            [[x.value for x in row] for row in exact_rows])
+        self.assertTrue(all(x.estimate for x in sampled_rows[-1][-3:]))
+        self.assertFalse(any(x.estimate for x in exact_rows[-1]))
+
+        # Sums and counts are scaled to the whole table
+        self.assertEqual(Cube(table=table.table_name, sample=50,
+                **kwargs).get_sample_factors(), [2, 2, None])
+        self.assertEqual(Cube.parse_properties(sampled.encode_properties(),
+                table.table_name).sample, 100)
+        self.assertNotIn('sample', exact.encode_properties())
+
+        # Caches of sampled cubes are not used to compute exact ones
+        definitions = dict(CubeCache.get_definitions(table.table_name))
+        coarse = Cube(table=table.table_name, rows=['company'],
+            measures=[('id', 'count')])
+        self.assertIsNone(
+            definitions[coarse.get_reusable_cache()].get('sample'))
+
+        # The sample is cleared with the caches of the table
+        sample_cache = sampled.get_source_table()._name
+        self.assertTrue(CubeCache.lookup(sample_cache))
+        exact.clear_cache()
+        self.assertFalse(CubeCache.lookup(sample_cache))
+
+    def test_pivot_grouping_sets_query(self):
+        cube = Cube(table='test', rows=['company', 'name'], columns=['id'],
+            measures=[('id', 'count')])
+        group_columns = cube.get_group_columns()
+        query = cube.get_grouping_sets_query(sql.Table('test'),
+            group_columns, [['company', 'name', 'id'], ['company'], []])
+        query_string = str(query)
+        self.assertIn('GROUPING("a"."company", "a"."name", "a"."id") '
+            'AS "_babi_level"', query_string)
+        self.assertIn('GROUP BY GROUPING SETS (("a"."company", "a"."name", '
+            '"a"."id"), ("a"."company"), ())', query_string)
+        # Levels match the bitmask returned by GROUPING()
+        self.assertEqual(cube.get_level(group_columns, ['company']), 3)
+        self.assertEqual(cube.get_level(group_columns, []), 7)
+
+    def test_pivot_header_elements(self):
+        elements = Cube.get_header_elements([
+                (None, None), (1, None), (0, None), (0, 1), (1, 0), (0, 0),
+                (0, 1), (2, 0)], 2)
+        # Each header is followed by its children in the order they were
+        # read and headers without parent are not displayed
+        self.assertEqual(elements, [(None, None), (1, None), (1, 0),
+                (0, None), (0, 1), (0, 0)])
+        self.assertEqual(Cube.get_header_elements([()], 0), [()])
+
     @with_transaction()
     def test_pivot_measure_allows_reused_fields(self):
         pool = Pool()
@@ -574,6 +1376,137 @@ class BabiTestCase(BabiCompanyTestMixin, ModuleTestCase):
                 ('name', 'count'),
                 ])
 
+    @with_transaction()
+    def test_table_get_records_close(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Streamed Table'
+        table.on_change_name()
+        table.query = 'SELECT 1 AS id UNION ALL SELECT 2'
+        table.save()
+        table._compute()
+
+        transaction = Transaction()
+        records = table.get_records()
+        next(records)
+        next(records)
+        # The query is read in its own transaction until it is closed
+        self.assertIsNot(Transaction(), transaction)
+        records.close()
+        self.assertIs(Transaction(), transaction)
+
+    @with_transaction()
+    def test_table_enqueue_compute(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        QueryParameter = pool.get('babi.table.query_parameter')
+        ComputeProgress = pool.get('babi.table.compute_progress')
+        Queue = pool.get('ir.queue')
+        Error = pool.get('ir.error')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Enqueued Table'
+        table.on_change_name()
+        table.query = 'SELECT 1 AS id'
+        table.save()
+        ComputeProgress.create([{'table': table.id, 'progress': 50}])
+        self.assertEqual(Table(table.id).compute_progress, 50)
+
+        jobs = Table.enqueue_compute([table])
+        task = Queue(jobs[table.id])
+        self.assertEqual(task.data['model'], 'babi.table')
+        self.assertEqual(task.data['method'], '_compute')
+        self.assertEqual(task.data['instances'], table.id)
+        self.assertIsNone(task.finished_at)
+        self.assertIsNone(Table(table.id).compute_progress)
+
+        # Only the task of the table reports its state
+        other = Table()
+        other.type = 'table'
+        other.name = 'Other Enqueued Table'
+        other.on_change_name()
+        other.query = 'SELECT 1 AS id'
+        other.save()
+        self.assertEqual(table.get_compute_state(task.id), 'queued')
+        self.assertEqual(other.get_compute_state(task.id), 'done')
+        self.assertEqual(table.get_compute_state(-1), 'done')
+        Queue.write([task], {'dequeued_at': datetime.datetime.now()})
+        self.assertEqual(table.get_compute_state(task.id), 'computing')
+
+        # Tasks with errors or pushed again by the worker have failed
+        Error.create([{
+                    'origin': str(task),
+                    'message': 'Error',
+                    }])
+        self.assertEqual(table.get_compute_state(task.id), 'failed')
+        Error.delete(Error.search([]))
+        Queue.push(task.name, task.data)
+        self.assertEqual(table.get_compute_state(task.id), 'failed')
+        Queue.write([task], {'finished_at': datetime.datetime.now()})
+        self.assertEqual(table.get_compute_state(task.id), 'done')
+
+        QueryParameter.create([{
+                    'table': table.id,
+                    'name': 'company',
+                    'ttype': 'char',
+                    }])
+        with self.assertRaises(UserError):
+            Table.enqueue_compute([Table(table.id)])
+
+        table.active = False
+        table.save()
+        self.assertEqual(Table.enqueue_compute([Table(table.id)]), {})
+
+    @with_transaction()
+    def test_pivot_precompute(self):
+        pool = Pool()
+        Table = pool.get('babi.table')
+        Pivot = pool.get('babi.pivot')
+        RowDimension = pool.get('babi.pivot.row_dimension')
+        Measure = pool.get('babi.pivot.measure')
+
+        table = Table()
+        table.type = 'table'
+        table.name = 'Precompute Table'
+        table.on_change_name()
+        table.query = 'SELECT 1 AS id, 10 AS company'
+        table.save()
+        table._compute()
+
+        fields = {field.internal_name: field for field in table.fields_}
+        pivot = Pivot(table=table, name='Precompute')
+        pivot.save()
+        RowDimension(pivot=pivot, field=fields['company']).save()
+        Measure(pivot=pivot, field=fields['id'], aggregate='count').save()
+
+        def cache_count():
+            cursor = Transaction().connection.cursor()
+            if backend.name == 'postgresql':
+                cache_table = sql.Table('tables', schema='information_schema')
+                query = cache_table.select(cache_table.table_name,
+                    where=cache_table.table_name.like(
+                        Cube(table.table_name).cache_prefix() + '%'))
+            else:
+                cache_table = sql.Table('sqlite_master')
+                query = cache_table.select(cache_table.name,
+                    where=(cache_table.type == 'table')
+                    & cache_table.name.like(
+                        Cube(table.table_name).cache_prefix() + '%'))
+            cursor.execute(*query)
+            return len(cursor.fetchall())
+
+        table.clear_cache([table])
+        self.assertEqual(cache_count(), 0)
+        table.compute_pivots()
+        self.assertEqual(cache_count(), 1)
+        # Building the cube of the pivot reuses the precomputed cache
+        list(Pivot(pivot.id).get_cube().build())
+        self.assertEqual(cache_count(), 1)
+
     @with_transaction()
     def test_pivot_measure_requires_unique_configuration(self):
         pool = Pool()
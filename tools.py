@@ -1,3 +1,4 @@
+from itertools import chain, islice
 from openpyxl.utils import get_column_letter
 
 def adjust_column_widths(ws, padding=2, max_width=None):
@@ -17,3 +18,28 @@ def adjust_column_widths(ws, padding=2, max_width=None):
                     max_length = max_width
                     break
         ws.column_dimensions[col_letter].width = max_length + padding
+
+def append_rows(ws, rows, padding=2, max_width=None, sample_size=1000):
+    """
+    Appends `rows` to the write-only worksheet `ws` as they are produced.
+    Column widths must be set before the first row is written, so they are
+    computed from the first `sample_size` rows, with additional padding.
+    """
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    widths = []
+    for row in sample:
+        for index, value in enumerate(row):
+            # Values may be already wrapped in an openpyxl Cell
+            value = getattr(value, 'value', value)
+            length = len(str(value)) if value is not None else 0
+            if max_width is not None and length > max_width:
+                length = max_width
+            if index >= len(widths):
+                widths.append(length)
+            elif length > widths[index]:
+                widths[index] = length
+    for index, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(index)].width = width + padding
+    for row in chain(sample, rows):
+        ws.append(row)